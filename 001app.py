@@ -1,11 +1,16 @@
 import streamlit as st
 import json
 import datetime
+import time
 import requests
 
 # Constants
 CONTEXTS = ["general", "romantic", "coparenting", "workplace", "family", "friend"]
 REQUIRE_TOKEN = False
+REQUEST_BUDGET_SECONDS = float(st.secrets.get("REQUEST_BUDGET_SECONDS", 25))  # Worst case for one click
+CONNECT_TIMEOUT = 3.05
+MIN_READ_TIMEOUT = 2.0
+CONTACT_PAGE_SIZE = 15
 
 # Setup
 st.set_page_config(page_title="The Third Voice", page_icon="🎙️", layout="wide")
@@ -30,6 +35,8 @@ defaults = {
     'token_validated': not REQUIRE_TOKEN,
     'api_key': st.secrets.get("OPENROUTER_API_KEY", ""),
     'contacts': {'General': {'context': 'general', 'history': []}},
+    'contact_index': {'General': {'context': 'general', 'total': 0, 'coached': 0, 'translated': 0, 'last_active': ''}},
+    'stored_contacts': {},  # name -> {'contact': json, 'journal': json}, parsed when selected
     'active_contact': 'General',
     'journal_entries': {},
     'feedback_data': {},
@@ -85,11 +92,18 @@ def get_ai_response(message, context, is_received=False):
         "microsoft/phi-3-mini-128k-instruct:free"
     ]
     
-    for model in models:
+    # One time budget for the whole fallback chain, split between the models left
+    deadline = time.monotonic() + REQUEST_BUDGET_SECONDS
+    for i, model in enumerate(models):
+        remaining = deadline - time.monotonic()
+        connect = min(CONNECT_TIMEOUT, remaining / 4)
+        read = (remaining - connect) / (len(models) - i)
+        if read < MIN_READ_TIMEOUT:
+            return {"error": f"No answer within {REQUEST_BUDGET_SECONDS:.0f}s. Please try again."}
         try:
             r = requests.post("https://openrouter.ai/api/v1/chat/completions", 
                 headers={"Authorization": f"Bearer {st.session_state.api_key}"},
-                json={"model": model, "messages": messages}, timeout=30)
+                json={"model": model, "messages": messages}, timeout=(connect, read))
             r.raise_for_status()
             reply = r.json()["choices"][0]["message"]["content"]
             
@@ -116,6 +130,32 @@ def get_ai_response(message, context, is_received=False):
     
     return {"error": "All models failed"}
 
+# Contact directory: a small index per contact; histories stay serialized until selected
+def summarize_contact(contact):
+    history = contact.get('history', [])
+    return {
+        'context': contact.get('context', 'general'),
+        'total': len(history),
+        'coached': sum(1 for h in history if h.get('type') == 'coach'),
+        'translated': sum(1 for h in history if h.get('type') == 'translate'),
+        # ISO timestamps sort correctly across years; older entries only have a year-less 'time'
+        'last_active': history[-1].get('timestamp', '') if history else ''
+    }
+
+def load_contact(name):
+    stored = st.session_state.stored_contacts.pop(name, None)
+    if stored:
+        st.session_state.contacts[name] = json.loads(stored['contact'])
+        if stored.get('journal'):
+            st.session_state.journal_entries[name] = json.loads(stored['journal'])
+
+def all_contacts():
+    for name in st.session_state.contact_index:
+        if name in st.session_state.contacts:
+            yield name, st.session_state.contacts[name]
+        elif name in st.session_state.stored_contacts:
+            yield name, json.loads(st.session_state.stored_contacts[name]['contact'])
+
 # Sidebar - Contact Management
 st.sidebar.markdown("### 👥 Your Contacts")
 
@@ -123,28 +163,50 @@ st.sidebar.markdown("### 👥 Your Contacts")
 with st.sidebar.expander("➕ Add Contact"):
     new_name = st.text_input("Name:")
     new_context = st.selectbox("Relationship:", CONTEXTS)
-    if st.button("Add") and new_name and new_name not in st.session_state.contacts:
+    if st.button("Add") and new_name and new_name not in st.session_state.contact_index:
         st.session_state.contacts[new_name] = {'context': new_context, 'history': []}
+        st.session_state.contact_index[new_name] = summarize_contact(st.session_state.contacts[new_name])
         st.session_state.active_contact = new_name
         st.success(f"Added {new_name}")
         st.rerun()
 
-# Contact selection
-contact_names = list(st.session_state.contacts.keys())
-if contact_names:
-    selected = st.sidebar.radio("Select Contact:", contact_names, 
-                               index=contact_names.index(st.session_state.active_contact))
-    st.session_state.active_contact = selected
+# Contact selection: search by name or relationship, most recently active first
+index = st.session_state.contact_index
+query = st.sidebar.text_input("Search contacts", key="contact_search", type="search", live=True)
+words = query.lower().split()
+contact_names = sorted(
+    (name for name, info in index.items() if all(w in f"{name} {info['context']}".lower() for w in words)),
+    key=lambda name: index[name]['last_active'], reverse=True
+)
+pages = max(1, -(-len(contact_names) // CONTACT_PAGE_SIZE))
+if st.session_state.get("contact_page", 1) > pages:
+    st.session_state.contact_page = pages
+page = st.sidebar.number_input("Page", min_value=1, max_value=pages, key="contact_page") if pages > 1 else 1
+shown = contact_names[(page - 1) * CONTACT_PAGE_SIZE:page * CONTACT_PAGE_SIZE]
+if shown:
+    active = st.session_state.active_contact
+    # Keyed on the active contact too, so a stale selection never switches back after an upload or delete
+    selected = st.sidebar.radio("Select Contact:", shown, key=f"contact_pick_{page}_{query}_{active}",
+                               index=shown.index(active) if active in shown else None)
+    if selected and selected != active:
+        st.session_state.active_contact = selected
+        st.rerun()
+else:
+    st.sidebar.caption("No contacts match your search")
+st.sidebar.caption(f"{len(contact_names)} of {len(index)} contacts")
+load_contact(st.session_state.active_contact)
 
 # Contact info
-if st.session_state.active_contact in st.session_state.contacts:
-    contact = st.session_state.contacts[st.session_state.active_contact]
-    st.sidebar.markdown(f"**Context:** {contact['context']}")
-    st.sidebar.markdown(f"**Messages:** {len(contact['history'])}")
+if st.session_state.active_contact in index:
+    info = index[st.session_state.active_contact]
+    st.sidebar.markdown(f"**Active:** {st.session_state.active_contact}")
+    st.sidebar.markdown(f"**Context:** {info['context']}")
+    st.sidebar.markdown(f"**Messages:** {info['total']}")
 
 # Delete contact
 if st.sidebar.button("🗑️ Delete Contact") and st.session_state.active_contact != "General":
-    del st.session_state.contacts[st.session_state.active_contact]
+    for store in ('contacts', 'contact_index', 'stored_contacts', 'journal_entries'):
+        st.session_state[store].pop(st.session_state.active_contact, None)
     st.session_state.active_contact = "General"
     st.rerun()
 
@@ -152,21 +214,38 @@ if st.sidebar.button("🗑️ Delete Contact") and st.session_state.active_conta
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 💾 Data Management")
 uploaded = st.sidebar.file_uploader("📤 Load History", type="json")
-if uploaded:
+if uploaded and st.session_state.get('loaded_file') != uploaded.file_id:
     try:
         data = json.load(uploaded)
-        st.session_state.contacts = data.get('contacts', st.session_state.contacts)
-        st.session_state.journal_entries = data.get('journal_entries', {})
+        contacts = data.get('contacts') or {'General': {'context': 'general', 'history': []}}
+        journals = data.get('journal_entries', {})
+        # Index every contact, but keep only the active one parsed
+        st.session_state.contact_index = {name: summarize_contact(c) for name, c in contacts.items()}
+        if st.session_state.active_contact not in contacts:
+            st.session_state.active_contact = next(iter(contacts))
+        st.session_state.stored_contacts = {
+            name: {'contact': json.dumps(c), 'journal': json.dumps(journals[name]) if name in journals else None}
+            for name, c in contacts.items() if name != st.session_state.active_contact
+        }
+        st.session_state.contacts = {st.session_state.active_contact: contacts[st.session_state.active_contact]}
+        st.session_state.journal_entries = {name: j for name, j in journals.items() if name in st.session_state.contacts}
         st.session_state.feedback_data = data.get('feedback_data', {})
         st.session_state.user_stats = data.get('user_stats', st.session_state.user_stats)
+        st.session_state.loaded_file = uploaded.file_id
         st.sidebar.success("✅ Data loaded!")
-    except:
+    except (ValueError, KeyError, AttributeError, TypeError):
         st.sidebar.error("❌ Invalid file")
+    else:
+        # Outside the try: rerun works by raising, and a handler must not read that as a bad file
+        st.rerun()
 
 if st.sidebar.button("💾 Save All"):
     save_data = {
-        'contacts': st.session_state.contacts,
-        'journal_entries': st.session_state.journal_entries,
+        'contacts': dict(all_contacts()),
+        'journal_entries': {
+            **{name: json.loads(s['journal']) for name, s in st.session_state.stored_contacts.items() if s.get('journal')},
+            **st.session_state.journal_entries
+        },
         'feedback_data': st.session_state.feedback_data,
         'user_stats': st.session_state.user_stats,
         'saved_at': datetime.datetime.now().isoformat()
@@ -249,6 +328,7 @@ if st.session_state.active_mode:
                 history_entry = {
                     "id": f"{mode}_{len(contact['history'])}_{datetime.datetime.now().timestamp()}",
                     "time": datetime.datetime.now().strftime("%m/%d %H:%M"),
+                    "timestamp": datetime.datetime.now().isoformat(),
                     "type": mode,
                     "original": message,
                     "result": result.get("improved" if mode == "coach" else "response", ""),
@@ -257,6 +337,10 @@ if st.session_state.active_mode:
                 }
                 
                 contact['history'].append(history_entry)
+                info = st.session_state.contact_index[st.session_state.active_contact]
+                info['total'] += 1
+                info['coached' if mode == 'coach' else 'translated'] += 1
+                info['last_active'] = history_entry['timestamp']
                 st.session_state.user_stats['total_messages'] += 1
                 
                 # Simple feedback
@@ -371,11 +455,12 @@ with tab3:
     
     # Contact breakdown
     st.markdown("### 👥 By Contact")
-    for name, contact in st.session_state.contacts.items():
-        if contact['history']:
-            coached = sum(1 for h in contact['history'] if h['type'] == 'coach')
-            translated = sum(1 for h in contact['history'] if h['type'] == 'translate')
-            st.markdown(f"**{name}:** {len(contact['history'])} total ({coached} coached, {translated} understood)")
+    busiest = sorted((item for item in st.session_state.contact_index.items() if item[1]['total']),
+                     key=lambda item: item[1]['total'], reverse=True)
+    for name, info in busiest[:CONTACT_PAGE_SIZE]:
+        st.markdown(f"**{name}:** {info['total']} total ({info['coached']} coached, {info['translated']} understood)")
+    if len(busiest) > CONTACT_PAGE_SIZE:
+        st.caption(f"…and {len(busiest) - CONTACT_PAGE_SIZE} more")
     
     # Feedback summary
     if st.session_state.feedback_data:
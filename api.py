@@ -0,0 +1,292 @@
+"""
+The Third Voice AI - Headless API
+The coach and translate pipeline from app.backup.py as an ASGI service for integrations
+
+Run with:
+    OPENROUTER_API_KEY=... API_TOKENS=token1,token2 uvicorn api:app --host 0.0.0.0 --port 8000
+"""
+
+import hmac
+import importlib.util
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Any
+
+import anyio
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+APP_PATH = Path(__file__).with_name("app.backup.py")
+API_MAX_CONCURRENCY = int(os.environ.get("API_MAX_CONCURRENCY", 32))  # Upstream calls in flight
+API_MAX_BATCH = 20
+API_HISTORY_LIMIT = 500  # Entries kept per contact
+API_MAX_CONTACTS = int(os.environ.get("API_MAX_CONTACTS", 1000))
+API_MAX_CONTACT_NAME = 100
+
+# Every client spends the server's OpenRouter key, so the API never runs open
+API_TOKENS = [token.strip() for token in os.environ.get("API_TOKENS", "").split(",") if token.strip()]
+if not API_TOKENS:
+    raise RuntimeError("Set API_TOKENS to a comma-separated list of client tokens before starting the API")
+
+ACTIONS = {"analyze": True, "improve": False}  # action -> is_received
+
+def load_core():
+    """Import app.backup.py as a module without running the Streamlit UI"""
+    from streamlit import logger as st_logger
+    st_logger.set_log_level("error")
+
+    spec = importlib.util.spec_from_file_location("third_voice_app", APP_PATH)
+    if spec.name in sys.modules:
+        return sys.modules[spec.name]
+    core = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = core
+    spec.loader.exec_module(core)
+    return core
+
+core = load_core()
+upstream_limiter = anyio.CapacityLimiter(API_MAX_CONCURRENCY)
+
+# =============================================
+# History Store
+# =============================================
+
+contacts: Dict[str, Dict[str, Any]] = {}
+contacts_lock = threading.Lock()
+
+def get_contact(name: str, context: str = "general") -> Dict[str, Any]:
+    """Contact record in the same shape the Streamlit app uses, created up to API_MAX_CONTACTS"""
+    if not name or len(name) > API_MAX_CONTACT_NAME:
+        raise ValueError(f"contact must be 1-{API_MAX_CONTACT_NAME} characters")
+    with contacts_lock:
+        if name not in contacts and len(contacts) >= API_MAX_CONTACTS:
+            raise ValueError(f"contact limit of {API_MAX_CONTACTS} reached")
+        return contacts.setdefault(name, {"context": context, "history": []})
+
+def append_history(name: str, entry: Dict[str, Any]):
+    """Append an entry, keeping the newest API_HISTORY_LIMIT"""
+    contact = get_contact(name)
+    with contacts_lock:
+        contact["history"].append(entry)
+        del contact["history"][:-API_HISTORY_LIMIT]
+
+# =============================================
+# Request Handling
+# =============================================
+
+def check_access(request: Request):
+    """Require one of API_TOKENS as a bearer token"""
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if token and any(hmac.compare_digest(token, allowed) for allowed in API_TOKENS):
+        return None
+    return JSONResponse({"error": "Invalid or missing API token"}, status_code=401)
+
+def validate_item(item: Any) -> Dict[str, Any]:
+    """Normalize one coach/translate request body"""
+    if not isinstance(item, dict):
+        raise ValueError("Request must be a JSON object")
+
+    message = str(item.get("message", ""))
+    # sanitize_input would cut an over-long message silently; an API caller should hear about it
+    if core.estimate_tokens(message) > core.MESSAGE_TOKEN_BUDGET:
+        raise ValueError(f"message is longer than {core.MESSAGE_TOKEN_BUDGET} tokens")
+    message = core.sanitize_input(message)
+    if not message:
+        raise ValueError("message is required")
+
+    action = item.get("action", "analyze")
+    if action not in ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+
+    context = item.get("context", "general")
+    if context not in core.CONTEXTS:
+        raise ValueError(f"context must be one of {', '.join(core.CONTEXTS)}")
+
+    model_mode = item.get("model_mode", "auto")
+    if model_mode not in core.MODEL_MODES:
+        raise ValueError(f"model_mode must be one of {', '.join(core.MODEL_MODES)}")
+
+    contact = item.get("contact")
+    if contact is not None:
+        contact = str(contact)
+        get_contact(contact, context)  # Created now, so a full directory is a 400 rather than a failed run
+
+    return {
+        "message": message,
+        "action": action,
+        "context": context,
+        "contact": contact,
+        "structured": bool(item.get("structured", True)),
+        "model_mode": model_mode
+    }
+
+def validate_entry(entry: Any) -> Dict[str, Any]:
+    """Check a posted history entry before anything is stored"""
+    if not isinstance(entry, dict):
+        raise ValueError("entry must be a JSON object")
+    if not isinstance(entry.get("original"), str) or not entry["original"].strip():
+        raise ValueError("entry needs a non-empty string 'original' field")
+    if not isinstance(entry.get("result", ""), str):
+        raise ValueError("'result' must be a string")
+    return entry
+
+def run_pipeline(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Same steps as the Streamlit message processor, without the UI"""
+    with core.start_trace(f"api.{item['action']}", context=item["context"], chars=len(item["message"])):
+        contact = get_contact(item["contact"], item["context"]) if item["contact"] else None
+        memory = core.build_memory_context(contact) if contact else None
+
+        result = core.get_long_message_response(
+            item["message"], item["context"], ACTIONS[item["action"]],
+            structured=item["structured"], model_mode=item["model_mode"],
+            api_key=os.environ.get("OPENROUTER_API_KEY", ""), memory=memory,
+            session_tokens=0  # API clients share the server-wide hourly budget only
+        )
+        core.annotate_span(model=result.get("model_id"), ok="error" not in result)
+
+        if "error" not in result and contact:
+            entry_type = "translate" if ACTIONS[item["action"]] else "coach"
+            append_history(item["contact"], core.create_history_entry(item["message"], result, entry_type))
+        return result
+
+async def process(item: Dict[str, Any], client: str) -> Dict[str, Any]:
+    """Run the blocking upstream call on a worker thread, queued fairly per client"""
+    core.admission_owner.set(f"api:{client}")
+    return await anyio.to_thread.run_sync(run_pipeline, item, limiter=upstream_limiter)
+
+def client_id(request: Request) -> str:
+    return request.client.host if request.client else "unknown"
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ValueError("Body must be valid JSON")
+
+class ProducerStreamingResponse(StreamingResponse):
+    """Streams body_iterator while producer fills it; the producer is cancelled when the response ends or the client leaves"""
+
+    def __init__(self, content, producer, **kwargs):
+        super().__init__(content, **kwargs)
+        self.producer = producer
+
+    async def __call__(self, scope, receive, send):
+        # The task group lives here rather than in the generator, which Starlette may close from another task
+        async with anyio.create_task_group() as tasks:
+            tasks.start_soon(self.producer)
+            try:
+                await super().__call__(scope, receive, send)
+            finally:
+                tasks.cancel_scope.cancel()
+
+def make_action_endpoint(action: str):
+    async def endpoint(request: Request):
+        denied = check_access(request)
+        if denied:
+            return denied
+        try:
+            item = validate_item({**(await read_json(request)), "action": action})
+        except (ValueError, TypeError) as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        result = await process(item, client_id(request))
+        status = 503 if result.get("busy") else 502 if "error" in result else 200
+        return JSONResponse(result, status_code=status)
+    return endpoint
+
+async def batch(request: Request):
+    """Several requests in one call, run concurrently; stream=true returns NDJSON as each finishes"""
+    denied = check_access(request)
+    if denied:
+        return denied
+    try:
+        body = await read_json(request)
+        items = [validate_item(item) for item in body.get("items", [])]
+    except (ValueError, TypeError, AttributeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not items or len(items) > API_MAX_BATCH:
+        return JSONResponse({"error": f"items must contain 1-{API_MAX_BATCH} requests"}, status_code=400)
+    client = client_id(request)
+
+    if body.get("stream"):
+        send, receive = anyio.create_memory_object_stream(len(items))
+
+        async def run_one(index, item):
+            await send.send({"index": index, **(await process(item, client))})
+
+        async def produce():
+            async with send:
+                async with anyio.create_task_group() as tasks:
+                    for index, item in enumerate(items):
+                        tasks.start_soon(run_one, index, item)
+
+        async def lines():
+            async with receive:
+                async for result in receive:
+                    yield json.dumps(result) + "\n"
+
+        return ProducerStreamingResponse(lines(), produce, media_type="application/x-ndjson")
+
+    results = [None] * len(items)
+
+    async def run_into(index, item):
+        results[index] = await process(item, client)
+
+    async with anyio.create_task_group() as tasks:
+        for index, item in enumerate(items):
+            tasks.start_soon(run_into, index, item)
+    return JSONResponse({"results": results})
+
+async def history(request: Request):
+    """GET pages through a contact's history; POST appends an entry"""
+    denied = check_access(request)
+    if denied:
+        return denied
+    name = request.path_params["contact"]
+
+    if request.method == "POST":
+        try:
+            entry = validate_entry(await read_json(request))
+            get_contact(name)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        # The server scores every posted entry; a client-sent tone is not trusted
+        entry.pop("tone", None)
+        core.score_entries([entry])
+        append_history(name, entry)
+        return JSONResponse({"ok": True, "sentiment": entry.get("sentiment")}, status_code=201)
+
+    # Reading never creates a contact
+    with contacts_lock:
+        contact = contacts.get(name, {"context": "general", "history": []})
+    entry_type = request.query_params.get("type")
+    try:
+        limit = min(100, int(request.query_params.get("limit", 20)))
+        offset = max(0, int(request.query_params.get("offset", 0)))
+    except ValueError:
+        return JSONResponse({"error": "limit and offset must be integers"}, status_code=400)
+
+    with contacts_lock:
+        entries = [entry for entry in reversed(contact["history"])
+                   if not entry_type or entry.get("type") == entry_type]
+    return JSONResponse({
+        "contact": name,
+        "context": contact["context"],
+        "total": len(entries),
+        "entries": entries[offset:offset + limit]
+    })
+
+async def health(request: Request):
+    return JSONResponse({"ok": True, "models": core.AI_MODELS})
+
+app = Starlette(routes=[
+    Route("/v1/analyze", make_action_endpoint("analyze"), methods=["POST"]),
+    Route("/v1/improve", make_action_endpoint("improve"), methods=["POST"]),
+    Route("/v1/batch", batch, methods=["POST"]),
+    Route("/v1/history/{contact}", history, methods=["GET", "POST"]),
+    Route("/healthz", health)
+])
@@ -9,8 +9,45 @@ Created by Predrag Mirković from detention, fighting to come home to Samantha 
 import streamlit as st
 import json
 import datetime
+import os
+import re
+import time
+import random
+import logging
+import threading
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import cProfile
+import io
+import marshal
+import pstats
+import queue
+import gzip
+import hashlib
+import mmap
+import struct
+import zlib
+import sqlite3
+import tempfile
+import uuid
+import numpy as np
 import requests
 from typing import Dict, Any, Optional, List
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+try:
+    from llama_cpp import Llama  # Optional: offline fallback model on the CPU
+except ImportError:
+    Llama = None
+
+try:
+    import pyarrow as pa  # Optional: columnar history table with vectorized filters
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
 
 # =============================================
 # Configuration and Constants
@@ -26,6 +63,130 @@ AI_MODELS = [
     "microsoft/phi-3-mini-128k-instruct:free"
 ]
 
+# Relative cost and capability of each model, used by the automatic router
+MODEL_PROFILES = {
+    "google/gemma-2-9b-it:free": {"tier": "strong", "cost": 3},
+    "meta-llama/llama-3.2-3b-instruct:free": {"tier": "fast", "cost": 1},
+    "microsoft/phi-3-mini-128k-instruct:free": {"tier": "fast", "cost": 2}
+}
+MODEL_MODES = {
+    "auto": "🪄 Auto (fastest adequate model)",
+    "adaptive": "🎯 Adaptive (learns from your feedback)",
+    "fixed": "📋 Fixed order (Gemma first)"
+}
+STRONG_CONTEXTS = ["coparenting", "romantic"]
+LONG_MESSAGE_CHARS = 1200
+ROUTER_SLOW_SECONDS = 12.0  # Models slower than this drop to the end of the chain
+ROUTER_SECONDS_PER_COST = 4.0  # How many seconds of latency weigh as much as one cost step
+
+# Local data shared by all sessions on this server
+DATA_DIR = os.environ.get("THIRD_VOICE_DATA_DIR", ".third_voice")
+BANDIT_STATE_FILE = os.path.join(DATA_DIR, "bandit_state.json")
+
+FEEDBACK_REWARDS = {"positive": 1.0, "neutral": 0.5, "negative": 0.0}
+BANDIT_LATENCY_WEIGHT = 0.3  # Score lost by a model that is as slow as ROUTER_SLOW_SECONDS
+BANDIT_MAX_EXPLORATION = 0.2  # Share of recent choices allowed to differ from the best-known model
+BANDIT_WINDOW = 100
+BANDIT_SAVE_INTERVAL_SECONDS = 30.0  # Pull counts are saved at most this often; ratings are saved at once
+
+# Rolling memory: recent turns verbatim plus a running summary, within a fixed token budget
+MEMORY_RECENT_TURNS = 4
+MEMORY_SUMMARY_BATCH = 6  # Re-summarize once this many turns have scrolled out of the recent window
+MEMORY_TOKEN_BUDGET = 600
+MEMORY_SUMMARY_TOKENS = 250
+BACKGROUND_WORKERS = 2
+
+# Deadline for one user action across the whole fallback chain (the worst-case latency SLO)
+REQUEST_BUDGET_SECONDS = 25.0
+CONNECT_TIMEOUT_SECONDS = 3.05
+MIN_READ_TIMEOUT_SECONDS = 2.0
+READ_TIMEOUT_P95_FACTOR = 2.0  # Give a model this multiple of its recent p95 before moving on
+
+# Local CPU model used when every remote model fails (needs llama-cpp-python and a GGUF file)
+LOCAL_MODEL_ID = "local/cpu"
+LOCAL_MODEL_NAME = "Local CPU Model"
+LOCAL_MODEL_PATH = ""  # e.g. models/qwen2.5-1.5b-instruct-q4_k_m.gguf, or set it in secrets
+LOCAL_THREADS = max(1, (os.cpu_count() or 2) // 2)
+LOCAL_CONTEXT_TOKENS = 4096
+
+# Record/replay of upstream traffic for repeatable performance runs
+UPSTREAM_MODES = ["live", "record", "replay"]
+CASSETTE_FILE = os.path.join(DATA_DIR, "upstream.cassette.jsonl.gz")
+REPLAY_LATENCY_SCALE = 1.0  # 0 replays instantly, 2 doubles the recorded latency
+SECRET_PATTERN = re.compile(r"(sk-or-[\w-]+|sk-[\w-]{20,}|Bearer\s+[\w.-]+)")
+
+# Write-behind autosave of contacts, journals and feedback to a local SQLite file
+AUTOSAVE_FILE = os.path.join(DATA_DIR, "autosave.sqlite3")
+AUTOSAVE_DEBOUNCE_SECONDS = 2.0  # Flush once changes have been quiet this long...
+AUTOSAVE_MAX_DELAY_SECONDS = 10.0  # ...but never hold a change longer than this
+
+# Compact history file (.tvh): zlib-compressed columnar chunks behind an offset index
+HISTORY_FILE_MAGIC = b"TVHF"
+HISTORY_FILE_VERSION = 1
+HISTORY_CHUNK_ENTRIES = 256  # Entries per chunk; a page read decodes only the chunks it touches
+HISTORY_HEADER = struct.Struct("<4sHH")  # magic, version, reserved
+HISTORY_FOOTER = struct.Struct("<QI4s")  # index offset, index length, magic
+
+# Tracing spans for one user action, from button click to rendered result
+TRACE_FILE = os.path.join(DATA_DIR, "traces.jsonl")
+TRACE_MAX_BYTES = 5_000_000  # Rotate the export file past this size
+TRACE_HISTORY = 10  # Recent traces kept per session for the debug waterfall
+
+# Token accounting and budgets; a budget of 0 means unlimited
+DEFAULT_MAX_TOKENS = 1000
+SESSION_TOKEN_BUDGET = 60000  # Tokens one browser session may spend
+GLOBAL_TOKENS_PER_HOUR = 0  # Tokens per rolling hour across all sessions, e.g. a provider quota
+BUDGET_DOWNGRADE_SHARE = 0.8  # Past this share of a budget the cheapest models are tried first
+MIN_COMPLETION_TOKENS = 200  # Below this many tokens left, requests are refused
+
+# Adaptive output length: max_tokens and a word limit sized to the message, continued if cut off
+OUTPUT_BASE_TOKENS = {"coach": 60, "translate": 150}
+OUTPUT_TOKENS_PER_INPUT_TOKEN = {"coach": 1.3, "translate": 0.5}  # A rewrite runs about as long as the original
+OUTPUT_STRUCTURED_TOKENS = 120  # Meaning, sentiment and needs around the reply
+OUTPUT_CONTEXT_SCALE = {"coparenting": 1.2, "romantic": 1.2, "family": 1.1, "workplace": 0.9}
+OUTPUT_MAX_TOKENS = 2000
+OUTPUT_MAX_CONTINUATIONS = 2  # Extra calls when an answer stops at max_tokens
+LENGTH_HOLDOUT_SHARE = 0.05  # Answers sent with the fixed DEFAULT_MAX_TOKENS, as the baseline for savings
+
+# Trend rollups kept up to date as entries and feedback arrive
+ROLLUP_METRICS = ["messages", "tone_sum", "latency_sum", "latency_count"]
+ROLLUP_BUCKET_DAYS = {"day": 1, "week": 7}
+ROLLUP_CHART_BUCKETS = {"day": 30, "week": 26}  # How far back the Stats tab charts go
+
+# Columnar history view (needs pyarrow)
+HISTORY_TABLE_COMPACT_CHUNKS = 64  # Merge appended batches once there are this many
+HISTORY_TABLE_COLUMNS = ["contact", "time", "type", "model", "sentiment", "tone", "latency",
+                         "tokens", "feedback", "original", "result"]
+
+# Thread mode: a pasted conversation analyzed one received message at a time, in parallel
+THREAD_WORKERS = 8  # Concurrent upstream calls for thread analysis, across all sessions
+THREAD_MAX_MESSAGES = 20  # Most recent received messages that get their own analysis
+THREAD_MAX_CHARS = 20000
+THREAD_CONTEXT_TURNS = 6  # Earlier lines sent along with each message
+THREAD_SUMMARY_TOKENS = 1500  # Transcript budget for the combined summary
+THREAD_BUDGET_FACTOR = 2.0  # All of a thread's messages finish within this many request budgets
+SELF_SPEAKER_NAMES = {"me", "i", "you", "myself"}
+
+# Long messages: split on paragraph and sentence boundaries, parts analyzed in parallel, then merged
+MESSAGE_TOKEN_BUDGET = 12000  # Longest message accepted, in estimated tokens
+LONG_MESSAGE_CHUNK_TOKENS = 1500  # Messages longer than this are analyzed in parts
+
+# Contact directory: an index drives the sidebar; histories are parsed only when a contact is selected
+CONTACT_PAGE_SIZE = 15
+
+# Admission control for upstream calls, shared by every session and API client
+UPSTREAM_MAX_CONCURRENCY = 6
+ADMISSION_MAX_WAIT_SECONDS = 20.0  # Requests that would wait longer are turned away
+ADMISSION_POLL_SECONDS = 0.5  # How often a waiting request refreshes its queue position
+ADMISSION_DEFAULT_HOLD_SECONDS = 5.0  # Assumed call length until real ones are measured
+
+# Rerun profiler, shown in the debug panel when the DEBUG secret is set
+PROFILE_WINDOW = 100  # Reruns kept for the rolling percentiles
+PROFILE_SLOW_MS = 500  # Default threshold for capturing a cProfile of a slow rerun
+PROFILE_TOP_FUNCTIONS = 30
+
+logger = logging.getLogger("third_voice")
+
 CSS_STYLES = """
 <style>
 .contact-card {
@@ -122,6 +283,21 @@ def apply_styles():
     """Apply CSS styles to the app"""
     st.markdown(CSS_STYLES, unsafe_allow_html=True)
 
+def coerce_setting(value: Any, default: Any) -> Any:
+    """Convert a raw setting to the default's type; bool("0") would be True, so booleans are parsed"""
+    if isinstance(default, bool):
+        return str(value).strip().lower() in {"1", "true", "yes", "on"}
+    return type(default)(value)
+
+def get_setting(name: str, default: Any) -> Any:
+    """Read a setting from secrets, then the environment, then the default"""
+    try:
+        if name in st.secrets:
+            return coerce_setting(st.secrets[name], default)
+    except Exception:
+        pass  # No secrets file, e.g. when run from benchmark.py
+    return coerce_setting(os.environ.get(name, default), default)
+
 def get_api_key():
     """Get API key from secrets or session state"""
     return st.secrets.get("OPENROUTER_API_KEY", st.session_state.get('api_key', ""))
@@ -185,7 +361,7 @@ EMERGENCY_PROMPTS = {
     )
 }
 
-def get_system_prompt(context: str, is_received: bool = False) -> str:
+def get_system_prompt(context: str, is_received: bool = False, message_type: str = "normal") -> str:
     """Generate system prompt based on context and message type"""
     base_prompt = COACHING_PROMPTS.get(context, COACHING_PROMPTS["general"])
     
@@ -202,93 +378,1908 @@ def get_system_prompt(context: str, is_received: bool = False) -> str:
             "Maintain the sender's authentic voice while enhancing the message."
         )
     
+    if message_type in EMERGENCY_PROMPTS:
+        return f"{base_prompt} {action_prompt} {EMERGENCY_PROMPTS[message_type]}"
+    
     return f"{base_prompt} {action_prompt}"
 
-def create_message_payload(message: str, context: str, is_received: bool = False) -> list:
+STRUCTURED_SENTIMENTS = ["positive", "neutral", "negative"]
+
+STRUCTURED_OUTPUT_PROMPTS = {
+    "translate": (
+        "Respond ONLY with a JSON object, no other text, using exactly these keys: "
+        '"meaning" (what they are really saying, in 1-2 sentences), '
+        '"sentiment" (one of "positive", "neutral", "negative"), '
+        '"needs" (a list of the emotional needs behind their words), '
+        '"reply" (a suggested reply the user could send back).'
+    ),
+    "coach": (
+        "Respond ONLY with a JSON object, no other text, using exactly these keys: "
+        '"meaning" (how the original message is likely to land, in 1-2 sentences), '
+        '"sentiment" (one of "positive", "neutral", "negative", for the original message), '
+        '"needs" (a list of the needs the sender is trying to express), '
+        '"reply" (the improved message, ready to send).'
+    )
+}
+
+def create_message_payload(message: str, context: str, is_received: bool = False, structured: bool = False,
+                           message_type: str = "normal", memory: Optional[str] = None) -> list:
     """Create the message payload for AI API"""
-    system_prompt = get_system_prompt(context, is_received)
+    system_prompt = get_system_prompt(context, is_received, message_type)
+    
+    if memory:
+        system_prompt = f"{system_prompt}\n\nWhat you know about this relationship so far:\n{memory}"
+    
+    if structured:
+        mode = "translate" if is_received else "coach"
+        system_prompt = f"{system_prompt} {STRUCTURED_OUTPUT_PROMPTS[mode]}"
     
     return [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": f"Message: {message}"}
     ]
 
+# Keywords are matched on word boundaries, so "mad" no longer fires inside "made"
+MESSAGE_TYPE_KEYWORDS = {
+    "conflict": [
+        "angry", "upset", "frustrated", "mad", "hate", "furious", "pissed",
+        "sick of", "fed up", "ridiculous", "unacceptable", "how dare"
+    ],
+    "apology": [
+        "sorry", "apologize", "apologise", "my fault", "forgive", "my bad",
+        "i was wrong", "i messed up", "regret"
+    ],
+    "difficult_news": [
+        "bad news", "problem", "issue", "concern", "concerned", "worried",
+        "diagnosis", "hospital", "laid off", "passed away", "can't afford"
+    ]
+}
+
+CONTEXT_KEYWORDS = {
+    "romantic": [
+        "love you", "babe", "honey", "sweetheart", "date night", "anniversary",
+        "boyfriend", "girlfriend", "husband", "wife", "miss you", "our relationship"
+    ],
+    "coparenting": [
+        "kids", "custody", "pickup", "pick up", "drop off", "dropoff", "child support",
+        "visitation", "parenting plan", "the children", "daycare", "pediatrician"
+    ],
+    "workplace": [
+        "meeting", "deadline", "project", "manager", "boss", "client", "invoice",
+        "shift", "office", "colleague", "performance review", "quarterly"
+    ],
+    "family": [
+        "mom", "dad", "mother", "father", "sister", "brother", "grandma", "grandpa",
+        "aunt", "uncle", "cousin", "thanksgiving", "family dinner"
+    ],
+    "friend": [
+        "buddy", "bro", "dude", "hang out", "hangout", "bestie", "best friend",
+        "friendship", "game night", "birthday party"
+    ]
+}
+
+# Weight of the implicit "normal"/"general" category when turning hits into confidences
+CLASSIFIER_PRIOR = 1.0
+CONTEXT_OVERRIDE_CONFIDENCE = 0.6
+
+def build_classifier():
+    """Compile all keyword lists into one word-boundary regex and a lookup table"""
+    lookup = {}
+    for group, keyword_map in (("type", MESSAGE_TYPE_KEYWORDS), ("context", CONTEXT_KEYWORDS)):
+        for category, keywords in keyword_map.items():
+            for keyword in keywords:
+                lookup[keyword] = (group, category)
+    
+    # Longest first so "bad news" wins over a shorter overlapping keyword
+    alternatives = sorted(lookup, key=len, reverse=True)
+    pattern = r"\b(?:" + "|".join(
+        re.escape(keyword).replace(r"\ ", r"\s+").replace("'", "['\u2019]")
+        for keyword in alternatives
+    ) + r")\b"
+    
+    return re.compile(pattern, re.IGNORECASE), lookup
+
+CLASSIFIER_PATTERN, CLASSIFIER_LOOKUP = build_classifier()
+
+def score_hits(hits: Dict[str, int], default: str) -> Dict[str, float]:
+    """Turn keyword hit counts into confidences that sum to 1"""
+    total = sum(hits.values()) + CLASSIFIER_PRIOR
+    scores = {category: count / total for category, count in hits.items()}
+    scores[default] = CLASSIFIER_PRIOR / total
+    return scores
+
+def classify_message(message: str) -> Dict[str, Any]:
+    """Classify message type and likely context in a single regex pass"""
+    type_hits = dict.fromkeys(MESSAGE_TYPE_KEYWORDS, 0)
+    context_hits = dict.fromkeys(CONTEXT_KEYWORDS, 0)
+    
+    for match in CLASSIFIER_PATTERN.finditer(message):
+        keyword = " ".join(match.group(0).lower().replace("\u2019", "'").split())
+        group, category = CLASSIFIER_LOOKUP[keyword]
+        if group == "type":
+            type_hits[category] += 1
+        else:
+            context_hits[category] += 1
+    
+    type_scores = score_hits(type_hits, "normal")
+    context_scores = score_hits(context_hits, "general")
+    
+    # max() keeps the first of equal scores: a single hit beats the default,
+    # and ties between categories follow keyword list order
+    message_type = max(type_scores, key=type_scores.get)
+    context = max(context_scores, key=context_scores.get)
+    
+    return {
+        "message_type": message_type,
+        "type_confidence": round(type_scores[message_type], 3),
+        "type_scores": type_scores,
+        "context": context,
+        "context_confidence": round(context_scores[context], 3),
+        "context_scores": context_scores
+    }
+
 def detect_message_type(message: str) -> str:
-    """Simple detection of message type for special handling"""
-    message_lower = message.lower()
+    """Detect message type for special handling"""
+    return classify_message(message)["message_type"]
+
+def resolve_prompt_context(context: str, classification: Dict[str, Any]) -> str:
+    """Use a specialized coaching prompt when a general contact's message clearly fits one"""
+    if (context == "general"
+            and classification["context"] in COACHING_PROMPTS
+            and classification["context_confidence"] >= CONTEXT_OVERRIDE_CONFIDENCE):
+        return classification["context"]
+    return context
+
+CLASSIFIER_BENCHMARK_MESSAGES = [
+    "ok see you at 5",
+    "I'm so frustrated that you made plans without asking me first",
+    "Sorry I missed pickup, can we swap weekends with the kids?",
+    "The client moved the deadline up, can we meet before the project review?",
+    "Mom wants everyone at Thanksgiving, I'm worried about the drive",
+    "Love you babe, can't wait for date night",
+    "I have some bad news about the hospital results"
+]
+
+def benchmark_classifier(messages: Optional[List[str]] = None, rounds: int = 2000) -> Dict[str, float]:
+    """Time classify_message and report microseconds per message"""
+    messages = messages or CLASSIFIER_BENCHMARK_MESSAGES
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            classify_message(message)
+    elapsed = time.perf_counter() - start
+    
+    return {
+        "messages": len(messages) * rounds,
+        "us_per_message": round(elapsed / (len(messages) * rounds) * 1_000_000, 2)
+    }
+
+# =============================================
+# Model Routing
+# =============================================
+
+class ModelLatencyTracker:
+    """Process-wide rolling latency per model, shared by all sessions"""
+    
+    def __init__(self, window: int = 50, alpha: float = 0.3):
+        self.alpha = alpha
+        self.window = window
+        self.ewma = {}
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.failures = collections.Counter()
+        self.failure_streak = collections.Counter()  # Failures since the model last succeeded
+        self.lock = threading.Lock()
+    
+    def record(self, model: str, seconds: float, ok: bool = True):
+        """Record one attempt; failures count as well past slow, so even a fast 429 makes the router back off"""
+        if not ok:
+            seconds = max(seconds, ROUTER_SLOW_SECONDS * 2)
+        with self.lock:
+            previous = self.ewma.get(model)
+            self.ewma[model] = seconds if previous is None else (
+                self.alpha * seconds + (1 - self.alpha) * previous
+            )
+            if ok:
+                self.samples[model].append(seconds)
+                self.failure_streak[model] = 0
+            else:
+                self.failures[model] += 1
+                self.failure_streak[model] += 1
+    
+    def streak(self, model: str) -> int:
+        """Consecutive failed attempts, 0 once the model answers again"""
+        with self.lock:
+            return self.failure_streak.get(model, 0)
+    
+    def estimate(self, model: str) -> float:
+        """Smoothed latency in seconds, 0 for models not seen yet"""
+        with self.lock:
+            return self.ewma.get(model, 0.0)
+    
+    def percentile(self, model: str, pct: float) -> Optional[float]:
+        """Latency percentile of recent successful calls"""
+        with self.lock:
+            samples = sorted(self.samples.get(model, []))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Summary per model for the debug panel"""
+        return {
+            model: {
+                "ewma_s": round(self.estimate(model), 2),
+                "p50_s": self.percentile(model, 50),
+                "p95_s": self.percentile(model, 95),
+                "failures": self.failures.get(model, 0)
+            }
+            for model in AI_MODELS + [LOCAL_MODEL_ID]
+            if model in AI_MODELS or model in self.ewma
+        }
+
+@st.cache_resource
+def get_latency_tracker() -> ModelLatencyTracker:
+    """Shared latency tracker that lives as long as the server process"""
+    return ModelLatencyTracker()
+
+def needs_strong_model(message: str, context: str, message_type: str) -> Optional[str]:
+    """Return why a request needs the strongest model, or None if a fast one will do"""
+    if context in STRONG_CONTEXTS:
+        return f"{context} context"
+    if message_type != "normal":
+        return f"{message_type} message"
+    if len(message) >= LONG_MESSAGE_CHARS:
+        return "long message"
+    return None
+
+def route_models(message: str, context: str, message_type: str = "normal") -> Dict[str, Any]:
+    """Order AI_MODELS so the cheapest adequate, currently fast model is tried first"""
+    tracker = get_latency_tracker()
+    strong_reason = needs_strong_model(message, context, message_type)
+    
+    def rank(model: str):
+        profile = MODEL_PROFILES.get(model, {"tier": "fast", "cost": 1})
+        latency = tracker.estimate(model)
+        adequate = profile["tier"] == "strong" or strong_reason is None
+        return (latency > ROUTER_SLOW_SECONDS, not adequate, tracker.streak(model),
+                profile["cost"] + latency / ROUTER_SECONDS_PER_COST)
+    
+    models = sorted(AI_MODELS, key=rank)
+    decision = {
+        "models": models,
+        "reason": strong_reason or "short, low-stakes message",
+        "latency": {model: round(tracker.estimate(model), 2) for model in models}
+    }
+    
+    logger.info("route %s -> %s (%s)", context, models[0], decision["reason"])
+    return decision
+
+def log_routing_decision(decision: Dict[str, Any], used_model: Optional[str]):
+    """Keep the last routing decisions in the session for the debug panel"""
+    if get_script_run_ctx() is None:
+        return  # Called from a worker thread or the headless API
+    if 'routing_log' not in st.session_state:
+        st.session_state.routing_log = collections.deque(maxlen=20)
+    st.session_state.routing_log.appendleft({
+        "time": datetime.datetime.now().strftime("%H:%M:%S"),
+        "first_choice": decision["models"][0],
+        "used": used_model,
+        "reason": decision["reason"]
+    })
+
+def select_models(message: str, context: str, message_type: str, model_mode: str) -> Dict[str, Any]:
+    """Pick the fallback chain of models for one request"""
+    if model_mode == "fixed":
+        return {"models": list(AI_MODELS), "reason": "fixed order"}
+    
+    decision = route_models(message, context, message_type)
+    
+    if model_mode == "adaptive":
+        bandit = get_feedback_bandit()
+        choice, explored = bandit.choose(context, AI_MODELS, decision["latency"])
+        decision["models"] = [choice] + [model for model in decision["models"] if model != choice]
+        decision["reason"] = f"feedback {'exploration' if explored else 'best rated'} for {context}"
+    
+    return decision
+
+# =============================================
+# Feedback Learning
+# =============================================
+
+class FeedbackBandit:
+    """Thompson sampling over models per context, learning from 👍/👌/👎 feedback"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()  # One writer at a time, so saves never interleave
+        self.last_save = time.monotonic()
+        self.arms = {}
+        self.recent_choices = collections.deque(maxlen=BANDIT_WINDOW)
+        self.load()
+    
+    def arm(self, context: str, model: str) -> Dict[str, float]:
+        """Beta posterior and pull count for one context/model pair"""
+        return self.arms.setdefault(f"{context}|{model}", {"alpha": 1.0, "beta": 1.0, "pulls": 0})
+    
+    def exploration_rate(self) -> float:
+        """Share of recent choices that were not the best-known model"""
+        if not self.recent_choices:
+            return 0.0
+        return sum(self.recent_choices) / len(self.recent_choices)
+    
+    def choose(self, context: str, models: List[str], latency: Dict[str, float]) -> tuple:
+        """Sample a model for this context; returns (model, explored)"""
+        with self.lock:
+            sampled, expected = {}, {}
+            for model in models:
+                arm = self.arm(context, model)
+                penalty = BANDIT_LATENCY_WEIGHT * min(1.0, latency.get(model, 0.0) / ROUTER_SLOW_SECONDS)
+                sampled[model] = random.betavariate(arm["alpha"], arm["beta"]) - penalty
+                expected[model] = arm["alpha"] / (arm["alpha"] + arm["beta"]) - penalty
+            
+            best = max(expected, key=expected.get)
+            choice = max(sampled, key=sampled.get)
+            
+            # Keep exploration bounded: fall back to the best model when we've explored enough
+            explored = expected[choice] < expected[best]
+            if explored and self.exploration_rate() >= BANDIT_MAX_EXPLORATION:
+                choice, explored = best, False
+            
+            self.recent_choices.append(explored)
+            self.arm(context, choice)["pulls"] += 1
+        
+        # Pulls only feed the stats table, so the request path writes them on a debounce
+        if time.monotonic() - self.last_save >= BANDIT_SAVE_INTERVAL_SECONDS:
+            self.save()
+        return choice, explored
+    
+    def update(self, context: str, model: str, feedback: str, previous: Optional[str] = None):
+        """Add a feedback reward, replacing an earlier rating of the same entry"""
+        with self.lock:
+            arm = self.arm(context, model)
+            if previous in FEEDBACK_REWARDS:
+                arm["alpha"] = max(1.0, arm["alpha"] - FEEDBACK_REWARDS[previous])
+                arm["beta"] = max(1.0, arm["beta"] - (1 - FEEDBACK_REWARDS[previous]))
+            reward = FEEDBACK_REWARDS[feedback]
+            arm["alpha"] += reward
+            arm["beta"] += 1 - reward
+        
+        self.save()
+    
+    def stats(self) -> List[Dict[str, Any]]:
+        """One row per context/model that has been used or rated"""
+        with self.lock:
+            rows = []
+            for key, arm in sorted(self.arms.items()):
+                if not arm["pulls"] and arm["alpha"] + arm["beta"] <= 2:
+                    continue
+                context, model = key.split("|", 1)
+                rows.append({
+                    "context": context,
+                    "model": format_model_name(model),
+                    "pulls": arm["pulls"],
+                    "ratings": round(arm["alpha"] + arm["beta"] - 2),
+                    "score": round(arm["alpha"] / (arm["alpha"] + arm["beta"]), 2)
+                })
+            return rows
+    
+    def load(self):
+        """Restore learned state from disk, starting fresh if it is missing or corrupt"""
+        try:
+            with open(self.path, encoding="utf-8") as state_file:
+                data = json.load(state_file)
+            self.arms = data.get("arms", {})
+            self.recent_choices.extend(data.get("recent_choices", []))
+        except (OSError, ValueError):
+            self.arms = {}
+    
+    def save(self):
+        """Write state atomically so a crash never leaves a half-written file"""
+        with self.save_lock:
+            self.last_save = time.monotonic()
+            with self.lock:
+                data = json.dumps({
+                    "arms": self.arms,
+                    "recent_choices": list(self.recent_choices)
+                })
+            temp_path = None
+            try:
+                directory = os.path.dirname(self.path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".bandit_state.", suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as state_file:
+                    state_file.write(data)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning("could not save bandit state: %s", e)
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+@st.cache_resource
+def get_feedback_bandit() -> FeedbackBandit:
+    """Shared bandit state for all sessions, persisted across restarts"""
+    return FeedbackBandit(BANDIT_STATE_FILE)
+
+def record_model_feedback(history_entry: dict, feedback_type: str):
+    """Teach the bandit which model earned this feedback"""
+    model_id = history_entry.get("model_id")
+    if model_id not in AI_MODELS or feedback_type not in FEEDBACK_REWARDS:
+        return
+    
+    previous = st.session_state.feedback_data.get(history_entry['id'])
+    get_feedback_bandit().update(history_entry.get("context", "general"), model_id, feedback_type, previous)
+
+# =============================================
+# Conversation Memory
+# =============================================
+
+SUMMARY_PROMPT = (
+    "You keep a running summary of one relationship's communication for a "
+    "communication coach. Merge the previous summary with the new exchanges. "
+    "Keep recurring topics, tensions, needs and what helped. "
+    "Write at most 120 words of plain text."
+)
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+def clip_to_tokens(text: str, max_tokens: int) -> str:
+    """Shorten text to roughly max_tokens"""
+    max_chars = max(0, max_tokens * 4)
+    return text if len(text) <= max_chars else text[:max_chars].rstrip() + "…"
+
+def format_memory_turn(entry: dict) -> str:
+    """One history entry as a line of conversation"""
+    if entry.get("type") == "translate":
+        return f"They said: {entry.get('original', '')}"
+    return f"User sent: {entry.get('result') or entry.get('original', '')}"
+
+def get_contact_memory(contact: dict) -> dict:
+    """Memory state stored on a contact, created on first use"""
+    return contact.setdefault('memory', {'summary': '', 'summarized_count': 0})
+
+def build_memory_context(contact: dict) -> str:
+    """Summary plus the most recent turns, never longer than MEMORY_TOKEN_BUDGET"""
+    history = contact.get('history', [])
+    memory = get_contact_memory(contact)
+    
+    parts = []
+    budget = MEMORY_TOKEN_BUDGET
+    if memory['summary']:
+        summary = "Summary: " + clip_to_tokens(memory['summary'], MEMORY_SUMMARY_TOKENS)
+        parts.append(summary)
+        budget -= estimate_tokens(summary)
+    
+    # Newest turns first so the oldest ones are dropped when the budget runs out
+    recent = []
+    per_turn = max(1, budget // MEMORY_RECENT_TURNS)
+    for entry in reversed(history[-MEMORY_RECENT_TURNS:]):
+        line = clip_to_tokens(format_memory_turn(entry), per_turn)
+        if estimate_tokens(line) > budget:
+            break
+        recent.append(line)
+        budget -= estimate_tokens(line)
+    
+    if recent:
+        parts.append("Recent exchanges:\n" + "\n".join(reversed(recent)))
     
-    # Check for conflict indicators
-    if any(word in message_lower for word in ['angry', 'upset', 'frustrated', 'mad', 'hate']):
-        return "conflict"
+    return "\n".join(parts)
+
+@st.cache_resource
+def get_background_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Small shared thread pool for work that must not block a rerun"""
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=BACKGROUND_WORKERS,
+        thread_name_prefix="third-voice"
+    )
+
+def summarize_turns(previous_summary: str, entries: List[dict], context: str,
+                    api_key: str, models: List[str]) -> Optional[Dict[str, Any]]:
+    """Fold new turns into the running summary with a fast model; tokens go on the shared ledger"""
+    exchanges = "\n".join(clip_to_tokens(format_memory_turn(entry), 150) for entry in entries)
+    messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": (
+            f"Relationship: {context}\n"
+            f"Previous summary: {previous_summary or 'None yet.'}\n"
+            f"New exchanges:\n{exchanges}"
+        )}
+    ]
+    
+    for model in models:
+        try:
+            data = post_chat_completion(
+                model, messages, api_key, max_tokens=MEMORY_SUMMARY_TOKENS,
+                timeout=(CONNECT_TIMEOUT_SECONDS, 30)
+            )
+            summary = data["choices"][0]["message"]["content"].strip()
+            usage = usage_from_response(data, messages, summary)
+            get_token_ledger().record(model, context, usage)
+            return {"summary": summary, "model_id": model, "context": context, "usage": usage}
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            logger.warning("summary with %s failed: %s", model, e)
+    return None
+
+def maybe_schedule_summary(contact_name: str):
+    """Start a background re-summary once enough turns have left the recent window"""
+    contact = st.session_state.contacts.get(contact_name)
+    jobs = st.session_state.setdefault('memory_jobs', {})
+    api_key = st.session_state.get('api_key', '')
+    if not st.session_state.get('use_memory', True) or not contact or contact_name in jobs or not api_key:
+        return
+    
+    # Summaries are optional, so they stop as soon as either budget is nearly spent
+    session_tokens = st.session_state.get('token_usage', {}).get('total_tokens', 0)
+    if token_budget_status(session_tokens)["state"] != "ok":
+        return
+    
+    memory = get_contact_memory(contact)
+    history = contact['history']
+    summarize_upto = len(history) - MEMORY_RECENT_TURNS
+    start = min(memory['summarized_count'], max(0, summarize_upto))
+    if summarize_upto - start < MEMORY_SUMMARY_BATCH:
+        return
+    
+    # Summaries are low stakes, so the router's cheapest model goes first
+    models = route_models("", "general")["models"]
+    future = get_background_executor().submit(
+        summarize_turns, memory['summary'], history[start:summarize_upto],
+        contact['context'], api_key, models
+    )
+    jobs[contact_name] = (future, summarize_upto)
+
+def collect_memory_summaries():
+    """Store finished background summaries on their contacts"""
+    jobs = st.session_state.get('memory_jobs', {})
+    for contact_name, (future, summarized_count) in list(jobs.items()):
+        if not future.done():
+            continue
+        del jobs[contact_name]
+        
+        contact = st.session_state.contacts.get(contact_name)
+        result = None if future.exception() else future.result()
+        if result:
+            record_session_usage(result)
+        if contact and result:
+            memory = get_contact_memory(contact)
+            memory['summary'] = result["summary"]
+            memory['summarized_count'] = summarized_count
+
+# =============================================
+# Sentiment Scoring
+# =============================================
+
+# Word weights on a -3..+3 scale, tuned for relationship messages
+SENTIMENT_LEXICON = {
+    # Positive
+    "love": 3, "loved": 3, "loving": 2.5, "adore": 3, "grateful": 2.5, "thankful": 2.5,
+    "thanks": 2, "thank": 2, "appreciate": 2.5, "appreciated": 2.5, "happy": 2.5,
+    "glad": 2, "proud": 2.5, "excited": 2, "wonderful": 3, "amazing": 3, "great": 2.5,
+    "good": 1.5, "nice": 1.5, "kind": 2, "sweet": 2, "beautiful": 2.5, "care": 1.5,
+    "caring": 2, "support": 1.5, "supportive": 2, "understand": 1, "understanding": 1.5,
+    "sorry": 0.5, "forgive": 1.5, "together": 1, "hope": 1.5, "calm": 1.5, "safe": 1.5,
+    "trust": 2, "miss": 1, "fun": 2, "enjoy": 2, "enjoyed": 2, "welcome": 1.5,
+    "okay": 0.5, "fine": 0.5, "agree": 1.5, "respect": 1.5, "listen": 1, "heard": 1,
+    "better": 1.5, "best": 2.5, "peace": 2, "thoughtful": 2, "helpful": 2, "honest": 1.5,
+    # Negative
+    "hate": -3, "hated": -3, "angry": -2.5, "mad": -2, "furious": -3, "upset": -2,
+    "annoyed": -2, "frustrated": -2, "frustrating": -2, "hurt": -2.5, "hurts": -2.5,
+    "sad": -2, "lonely": -2, "alone": -1.5, "scared": -2, "afraid": -2, "worried": -1.5,
+    "anxious": -2, "disappointed": -2, "disappointing": -2, "tired": -1, "exhausted": -2,
+    "sick": -1.5, "unfair": -2, "wrong": -1.5, "bad": -2, "terrible": -3, "awful": -3,
+    "horrible": -3, "worst": -3, "stupid": -2.5, "ridiculous": -2, "pathetic": -3,
+    "useless": -2.5, "selfish": -2.5, "lazy": -2, "liar": -3, "lie": -2, "lied": -2.5,
+    "cheat": -3, "blame": -2, "fault": -1.5, "ignore": -2, "ignored": -2, "ignoring": -2,
+    "yell": -2, "yelling": -2, "fight": -2, "fighting": -2, "argue": -1.5, "problem": -1,
+    "sucks": -2, "cry": -1.5, "crying": -1.5, "leave": -1, "divorce": -2, "enough": -0.5,
+    "whatever": -1, "done": -0.5, "nothing": -0.5, "nobody": -1, "disrespect": -2.5
+}
+SENTIMENT_NEGATORS = {"not", "no", "never", "nothing", "nobody", "none", "neither", "nor", "without"}
+SENTIMENT_INTENSIFIERS = {"very", "so", "really", "extremely", "totally", "completely", "always", "too"}
+SENTIMENT_NEGATION_SCALE = -0.75  # "not happy" is milder than "unhappy"
+SENTIMENT_INTENSIFIER_SCALE = 1.5
+SENTIMENT_NEUTRAL_BAND = 0.05  # |score| below this is neutral
+SENTIMENT_CLASSES = {"positive": "pos", "negative": "neg", "neutral": "neu"}
+
+SENTIMENT_TOKEN_PATTERN = re.compile(r"[a-z']+")
+# Index 0 is the weight of every word outside the lexicon
+SENTIMENT_VOCAB = {word: index + 1 for index, word in enumerate(SENTIMENT_LEXICON)}
+SENTIMENT_WEIGHTS = np.array([0.0] + list(SENTIMENT_LEXICON.values()))
+
+def score_sentiment(texts: List[str]) -> np.ndarray:
+    """Compound tone in [-1, 1] for each text, scored as one vectorized batch"""
+    tokens, doc_ids = [], []
+    for doc, text in enumerate(texts):
+        words = SENTIMENT_TOKEN_PATTERN.findall((text or "").lower())
+        tokens.extend(words)
+        doc_ids.extend([doc] * len(words))
+    if not tokens:
+        return np.zeros(len(texts))
+    
+    doc_ids = np.array(doc_ids)
+    weights = SENTIMENT_WEIGHTS[np.fromiter((SENTIMENT_VOCAB.get(t, 0) for t in tokens), int, len(tokens))]
+    is_negator = np.fromiter(
+        (t in SENTIMENT_NEGATORS or t.endswith("n't") for t in tokens), bool, len(tokens)
+    )
+    is_intensifier = np.fromiter((t in SENTIMENT_INTENSIFIERS for t in tokens), bool, len(tokens))
+    
+    # A negator up to two words back flips a word ("not very happy"); an intensifier right before boosts it
+    negated = np.zeros(len(tokens), bool)
+    for back in (1, 2):
+        negated[back:] |= is_negator[:-back] & (doc_ids[back:] == doc_ids[:-back])
+    boosted = np.zeros(len(tokens), bool)
+    boosted[1:] = is_intensifier[:-1] & (doc_ids[1:] == doc_ids[:-1])
+    
+    weights = weights * np.where(negated, SENTIMENT_NEGATION_SCALE, 1.0)
+    weights = weights * np.where(boosted, SENTIMENT_INTENSIFIER_SCALE, 1.0)
+    raw = np.bincount(doc_ids, weights=weights, minlength=len(texts))
+    
+    # Squash the sum into [-1, 1] so long messages don't saturate
+    return raw / np.sqrt(raw * raw + 15)
+
+def sentiment_label(score: float) -> str:
+    if score >= SENTIMENT_NEUTRAL_BAND:
+        return "positive"
+    if score <= -SENTIMENT_NEUTRAL_BAND:
+        return "negative"
+    return "neutral"
+
+def score_entries(entries: List[Dict[str, Any]]) -> int:
+    """Add a local tone score to history entries that lack one; returns how many were scored"""
+    pending = [entry for entry in entries if "tone" not in entry]
+    if not pending:
+        return 0
+    
+    scores = score_sentiment(
+        [entry.get("original", "") for entry in pending] + [entry.get("result", "") for entry in pending]
+    )
+    for entry, original, result in zip(pending, scores[:len(pending)], scores[len(pending):]):
+        entry["tone"] = {"original": round(float(original), 3), "result": round(float(result), 3)}
+        # A model-given sentiment is kept; otherwise the label comes from the original message
+        if entry.get("sentiment") not in STRUCTURED_SENTIMENTS or not entry.get("meaning"):
+            entry["sentiment"] = sentiment_label(original)
+    return len(pending)
+
+def backfill_sentiment(contacts: Dict[str, Dict[str, Any]]) -> int:
+    """Score every unscored entry across all contacts in one batch"""
+    return score_entries([entry for contact in contacts.values() for entry in contact.get('history', [])])
+
+# =============================================
+# Trend Rollups
+# =============================================
+
+class RollupSeries:
+    """Dense rows of ROLLUP_METRICS per bucket, starting at bucket `origin` and grown by doubling"""
+    
+    def __init__(self):
+        self.origin = None
+        self.data = np.zeros((0, len(ROLLUP_METRICS)), np.float32)
+    
+    def add(self, bucket: int, values: np.ndarray):
+        if self.origin is None:
+            self.origin = bucket
+        if bucket < self.origin:
+            padding = np.zeros((self.origin - bucket, len(ROLLUP_METRICS)), np.float32)
+            self.data = np.vstack([padding, self.data])
+            self.origin = bucket
+        row = bucket - self.origin
+        if row >= len(self.data):
+            grown = np.zeros((max(row + 1, 2 * len(self.data)), len(ROLLUP_METRICS)), np.float32)
+            grown[:len(self.data)] = self.data
+            self.data = grown
+        self.data[row] += values
+    
+    def window(self, first: int, count: int) -> np.ndarray:
+        """Rows for buckets [first, first + count), zeros where nothing was recorded"""
+        out = np.zeros((count, len(ROLLUP_METRICS)), np.float32)
+        if self.origin is None:
+            return out
+        start, end = max(first, self.origin), min(first + count, self.origin + len(self.data))
+        if start < end:
+            out[start - first:end - first] = self.data[start - self.origin:end - self.origin]
+        return out
+
+class RollupStore:
+    """Daily and weekly totals per contact, entry type, model and feedback, updated one entry at a time"""
+    
+    def __init__(self):
+        self.series = {}
     
-    # Check for apology indicators  
-    if any(word in message_lower for word in ['sorry', 'apologize', 'my fault', 'forgive']):
-        return "apology"
+    def bump(self, when: datetime.datetime, contact: str, dimensions: List[tuple], values: np.ndarray):
+        day = when.date().toordinal()
+        for granularity, days in ROLLUP_BUCKET_DAYS.items():
+            bucket = (day - 1) // days  # Ordinal 1 is a Monday, so weeks start on Mondays
+            for scope in ("*", contact):
+                for dimension in dimensions:
+                    key = (granularity, scope) + dimension
+                    self.series.setdefault(key, RollupSeries()).add(bucket, values)
     
-    # Check for difficult news indicators
-    if any(word in message_lower for word in ['bad news', 'problem', 'issue', 'concern', 'worried']):
-        return "difficult_news"
+    def add_entry(self, contact: str, entry: Dict[str, Any]):
+        latency = entry.get("latency")
+        values = np.array([
+            1, entry.get("tone", {}).get("original", 0.0), latency or 0.0, 1 if latency else 0
+        ], np.float32)
+        dimensions = [("all", ""), ("type", entry.get("type", "")), ("model", entry.get("model", "Unknown"))]
+        self.bump(entry_time(entry), contact, dimensions, values)
     
-    return "normal"
+    def add_feedback(self, contact: str, entry: Dict[str, Any], feedback: str, delta: int = 1):
+        values = np.array([delta, 0, 0, 0], np.float32)
+        self.bump(entry_time(entry), contact, [("feedback", feedback)], values)
+    
+    def chart(self, granularity: str, scope: str, dimension: str) -> Dict[str, Any]:
+        """The last ROLLUP_CHART_BUCKETS buckets of every series in a dimension, ending now"""
+        days = ROLLUP_BUCKET_DAYS[granularity]
+        count = ROLLUP_CHART_BUCKETS[granularity]
+        last = (datetime.date.today().toordinal() - 1) // days
+        first = last - count + 1
+        labels = [
+            datetime.date.fromordinal(bucket * days + 1).strftime("%m/%d") for bucket in range(first, last + 1)
+        ]
+        windows = {
+            key[3]: series.window(first, count)
+            for key, series in self.series.items()
+            if key[:3] == (granularity, scope, dimension)
+        }
+        return {"labels": labels, "series": windows}
+
+def entry_time(entry: Dict[str, Any]) -> datetime.datetime:
+    """When an entry was created, from its timestamp or the time encoded in its id"""
+    try:
+        return datetime.datetime.fromisoformat(entry["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    try:
+        return datetime.datetime.fromtimestamp(float(str(entry.get("id", "")).rsplit("_", 1)[-1]))
+    except ValueError:
+        return datetime.datetime.now()
+
+def get_rollups() -> RollupStore:
+    """This session's rollups, built from history in one pass the first time they are needed"""
+    if 'rollups' not in st.session_state:
+        rollups = RollupStore()
+        entries_by_id = {}
+        for name, contact in iter_all_contacts():
+            for entry in contact.get('history', []):
+                rollups.add_entry(name, entry)
+                entries_by_id[entry.get('id')] = (name, entry)
+        for entry_id, feedback in st.session_state.feedback_data.items():
+            if entry_id in entries_by_id:
+                rollups.add_feedback(*entries_by_id[entry_id], feedback)
+        st.session_state.rollups = rollups
+    return st.session_state.rollups
+
+def find_history_entry(entry_id: str):
+    """(contact name, entry) for an entry id, or (None, None)"""
+    for name, contact in st.session_state.contacts.items():
+        for entry in reversed(contact.get('history', [])):
+            if entry.get('id') == entry_id:
+                return name, entry
+    return None, None
+
+# =============================================
+# Columnar History
+# =============================================
+
+def history_schema():
+    return pa.schema([
+        ("contact", pa.string()),
+        ("id", pa.string()),
+        ("time", pa.timestamp("us")),
+        ("type", pa.string()),
+        ("model", pa.string()),
+        ("context", pa.string()),
+        ("sentiment", pa.string()),
+        ("tone", pa.float32()),
+        ("latency", pa.float32()),
+        ("tokens", pa.int32()),
+        ("original", pa.string()),
+        ("result", pa.string())
+    ])
+
+def history_batch(contact: str, entries: List[Dict[str, Any]]):
+    """One Arrow record batch for a run of a contact's history entries"""
+    return pa.RecordBatch.from_pydict({
+        "contact": [contact] * len(entries),
+        "id": [entry.get("id", "") for entry in entries],
+        "time": [entry_time(entry) for entry in entries],
+        "type": [entry.get("type", "") for entry in entries],
+        "model": [entry.get("model", "Unknown") for entry in entries],
+        "context": [entry.get("context", "") for entry in entries],
+        "sentiment": [entry.get("sentiment", "neutral") for entry in entries],
+        "tone": [entry.get("tone", {}).get("original") for entry in entries],
+        "latency": [entry.get("latency") for entry in entries],
+        "tokens": [entry.get("tokens") for entry in entries],
+        "original": [entry.get("original", "") for entry in entries],
+        "result": [entry.get("result", "") for entry in entries]
+    }, schema=history_schema())
+
+class HistoryTable:
+    """All contacts' history as one Arrow table, extended with only the entries added since the last sync"""
+    
+    def __init__(self):
+        self.batches = []
+        self.synced = {}  # contact -> (entries converted, id of the last one)
+        self.stored_keys = {}  # stored contact -> index (total, last_active) when it was last parsed
+        self.table = None
+    
+    def is_stale(self, contacts: Dict[str, Dict[str, Any]], names: set) -> bool:
+        """True when entries were removed or replaced, e.g. by an import or a deleted contact"""
+        for name, (count, last_id) in self.synced.items():
+            if name not in names:
+                return True
+            if name not in contacts:
+                continue  # Stored and unchanged since it was synced
+            history = contacts[name].get('history', [])
+            if len(history) < count or (count and history[count - 1].get('id') != last_id):
+                return True
+        return False
+    
+    def sync(self, contacts: Dict[str, Dict[str, Any]], stored: Optional[Dict[str, tuple]] = None):
+        """Loaded contacts, plus stored ones as name -> (index key, JSON), parsed only when the key changed"""
+        stored = stored or {}
+        current = {**contacts, **{name: json.loads(text) for name, (key, text) in stored.items()
+                                  if self.stored_keys.get(name) != key}}
+        if self.is_stale(current, set(contacts) | set(stored)):
+            self.batches, self.synced, self.table = [], {}, None
+            current = {**contacts, **{name: json.loads(text) for name, (key, text) in stored.items()}}
+        self.stored_keys = {name: key for name, (key, _) in stored.items()}
+        
+        changed = self.table is None
+        for name, contact in current.items():
+            history = contact.get('history', [])
+            count = self.synced.get(name, (0, None))[0]
+            if len(history) > count:
+                self.batches.append(history_batch(name, history[count:]))
+                self.synced[name] = (len(history), history[-1].get('id'))
+                changed = True
+        
+        if changed:
+            self.table = pa.Table.from_batches(self.batches, schema=history_schema())
+            if len(self.batches) > HISTORY_TABLE_COMPACT_CHUNKS:
+                self.table = self.table.combine_chunks()
+                self.batches = self.table.to_batches()
+        return self.table
+
+def get_history_table():
+    """Arrow table of every contact's history with current feedback, or None without pyarrow"""
+    if pa is None:
+        return None
+    if 'history_table' not in st.session_state:
+        st.session_state.history_table = HistoryTable()
+    # Stored contacts are parsed only when their index entry moved; only new entries are converted
+    index = st.session_state.contact_index
+    contacts = {name: st.session_state.contacts[name] for name in index if name in st.session_state.contacts}
+    stored = {
+        name: ((index[name]['total'], index[name]['last_active']), st.session_state.stored_contacts[name]['contact'])
+        for name in index if name not in contacts and name in st.session_state.stored_contacts
+    }
+    table = st.session_state.history_table.sync(contacts, stored)
+    return with_feedback(table, st.session_state.feedback_data)
+
+def with_feedback(table, feedback_data: Dict[str, str]):
+    """Join ratings onto entries by id; feedback changes too often to bake into the table"""
+    if feedback_data:
+        ratings = pa.array(list(feedback_data.values()), pa.string())
+        positions = pc.index_in(table["id"], value_set=pa.array(list(feedback_data), pa.string()))
+        feedback = pc.take(ratings, positions)
+    else:
+        feedback = pa.nulls(len(table), pa.string())
+    return table.append_column("feedback", feedback)
+
+def filter_history_table(table, contacts: Optional[List[str]] = None, types: Optional[List[str]] = None,
+                         models: Optional[List[str]] = None, since: Optional[datetime.datetime] = None,
+                         until: Optional[datetime.datetime] = None, feedback: Optional[List[str]] = None):
+    """Rows matching every given filter; 'unrated' in feedback matches entries without a rating"""
+    conditions = []
+    for column, values in (("contact", contacts), ("type", types), ("model", models)):
+        if values:
+            conditions.append(pc.is_in(table[column], value_set=pa.array(values, pa.string())))
+    if since:
+        conditions.append(pc.greater_equal(table["time"], pa.scalar(since, pa.timestamp("us"))))
+    if until:
+        conditions.append(pc.less(table["time"], pa.scalar(until, pa.timestamp("us"))))
+    if feedback:
+        rated = pc.is_in(table["feedback"], value_set=pa.array([f for f in feedback if f != "unrated"], pa.string()))
+        conditions.append(pc.or_(rated, pc.is_null(table["feedback"])) if "unrated" in feedback else rated)
+    
+    if not conditions:
+        return table
+    mask = conditions[0]
+    for condition in conditions[1:]:
+        mask = pc.and_(mask, condition)
+    return table.filter(mask)
+
+def summarize_history_table(table):
+    """Counts, tone, latency and tokens per contact and type"""
+    return table.group_by(["contact", "type"]).aggregate([
+        ("id", "count"), ("tone", "mean"), ("latency", "mean"), ("tokens", "sum")
+    ]).rename_columns(["contact", "type", "entries", "avg_tone", "avg_latency", "tokens"])
+
+def history_table_to_feather(table) -> bytes:
+    """Arrow IPC (Feather v2) bytes; columns are written as they are, without conversion"""
+    sink = pa.BufferOutputStream()
+    feather.write_feather(table, sink, compression="zstd")
+    return sink.getvalue().to_pybytes()
+
+# =============================================
+# Token Accounting
+# =============================================
+
+def empty_usage() -> Dict[str, Any]:
+    return {
+        "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0,
+        "by_model": {}, "by_context": {}
+    }
+
+def usage_from_response(result_data: Dict[str, Any], messages: list, reply: str) -> Dict[str, Any]:
+    """Token counts from the provider's usage block, estimated when it sends none"""
+    usage = result_data.get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens")
+    completion_tokens = usage.get("completion_tokens")
+    estimated = prompt_tokens is None or completion_tokens is None
+    if estimated:
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = estimate_tokens(reply)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated": estimated
+    }
+
+def usage_cost(model: str, tokens: int) -> float:
+    """Relative cost units: thousands of tokens times the model's router cost (local is free)"""
+    if model == LOCAL_MODEL_ID:
+        return 0.0
+    return tokens / 1000 * MODEL_PROFILES.get(model, {"cost": 1})["cost"]
+
+def add_usage(totals: Dict[str, Any], model: str, context: str, usage: Dict[str, Any]):
+    """Add one call to running totals, overall and per model and context"""
+    cost = usage_cost(model, usage["total_tokens"])
+    totals["calls"] += usage.get("calls", 1)  # Merged answers carry the number of calls behind them
+    totals["cost"] += cost
+    for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        totals[key] += usage[key]
+    for group, name in (("by_model", model), ("by_context", context)):
+        bucket = totals[group].setdefault(name, {"calls": 0, "total_tokens": 0, "cost": 0.0})
+        bucket["calls"] += usage.get("calls", 1)
+        bucket["total_tokens"] += usage["total_tokens"]
+        bucket["cost"] += cost
+
+class TokenLedger:
+    """Process-wide token totals, plus a rolling hour for the global budget"""
+    
+    def __init__(self):
+        self.totals = empty_usage()
+        self.recent = collections.deque()
+        self.lock = threading.Lock()
+    
+    def record(self, model: str, context: str, usage: Dict[str, Any]):
+        with self.lock:
+            add_usage(self.totals, model, context, usage)
+            self.recent.append((time.time(), usage["total_tokens"]))
+    
+    def last_hour(self) -> int:
+        cutoff = time.time() - 3600
+        with self.lock:
+            while self.recent and self.recent[0][0] < cutoff:
+                self.recent.popleft()
+            return sum(tokens for _, tokens in self.recent)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {**self.totals, "by_model": dict(self.totals["by_model"]),
+                    "by_context": dict(self.totals["by_context"])}
+
+@st.cache_resource
+def get_token_ledger() -> TokenLedger:
+    """Token totals shared by all sessions on this server"""
+    return TokenLedger()
+
+def token_budget_status(session_tokens: int) -> Dict[str, Any]:
+    """'ok', 'downgrade' or 'throttle', with the tokens left under the tightest budget"""
+    limits = []
+    session_budget = get_setting("SESSION_TOKEN_BUDGET", SESSION_TOKEN_BUDGET)
+    if session_budget:
+        limits.append(("session", session_tokens, session_budget))
+    hourly_budget = get_setting("GLOBAL_TOKENS_PER_HOUR", GLOBAL_TOKENS_PER_HOUR)
+    if hourly_budget:
+        limits.append(("hourly", get_token_ledger().last_hour(), hourly_budget))
+    
+    status = {"state": "ok", "scope": None, "remaining": None}
+    for scope, used, budget in limits:
+        remaining = budget - used
+        if status["remaining"] is None or remaining < status["remaining"]:
+            status.update(scope=scope, remaining=remaining)
+        if remaining < MIN_COMPLETION_TOKENS:
+            status["state"] = "throttle"
+        elif used >= budget * BUDGET_DOWNGRADE_SHARE and status["state"] == "ok":
+            status["state"] = "downgrade"
+    return status
+
+def downgrade_routing(routing: Dict[str, Any]) -> Dict[str, Any]:
+    """Cheapest models first once a budget is nearly spent"""
+    models = sorted(routing["models"], key=lambda m: MODEL_PROFILES.get(m, {"cost": 1})["cost"])
+    return {**routing, "models": models, "reason": f"{routing['reason']}; token budget nearly spent"}
+
+def record_session_usage(result: Dict[str, Any]):
+    """Add a successful answer's tokens to this session's totals"""
+    if "usage" not in result:
+        return
+    totals = st.session_state.setdefault('token_usage', empty_usage())
+    add_usage(totals, result["model_id"], result.get("context", ""), result["usage"])
+
+# =============================================
+# Output Length
+# =============================================
+
+CONTINUE_PROMPT = "You were cut off. Continue exactly where you stopped, without repeating anything."
+
+def plan_output_tokens(message: str, context: str, is_received: bool, structured: bool) -> int:
+    """max_tokens for one answer, from the message length, the action and the context"""
+    mode = "translate" if is_received else "coach"
+    tokens = OUTPUT_BASE_TOKENS[mode] + OUTPUT_TOKENS_PER_INPUT_TOKEN[mode] * estimate_tokens(message)
+    if structured:
+        tokens += OUTPUT_STRUCTURED_TOKENS
+    tokens *= OUTPUT_CONTEXT_SCALE.get(context, 1.0)
+    return int(min(OUTPUT_MAX_TOKENS, max(MIN_COMPLETION_TOKENS, tokens)))
+
+def with_length_hint(messages: list, max_tokens: int) -> list:
+    """Ask for an answer that fits well inside max_tokens, so it ends on its own instead of being cut"""
+    words = max(40, int(max_tokens * 0.6) // 10 * 10)  # ~0.75 words per token, with headroom
+    system = {**messages[0], "content": f"{messages[0]['content']} Keep your whole answer under {words} words."}
+    return [system] + messages[1:]
+
+def complete_with_continuation(model: str, messages: list, api_key: str, max_tokens: int,
+                               extra: Optional[Dict[str, Any]], timeout: tuple, deadline: "Deadline",
+                               token_budget: Optional[int] = None) -> Dict[str, Any]:
+    """One completion, asked to go on while it stops at max_tokens; returns the joined reply in the provider's shape"""
+    provider = get_provider(model)
+    result_data = provider.complete(model, messages, api_key, max_tokens=max_tokens, extra=extra,
+                                    timeout=timeout, deadline=deadline)
+    choice = result_data["choices"][0]
+    reply = choice["message"]["content"]
+    usages = [result_data.get("usage")]
+    truncated = choice.get("finish_reason") == "length"
+    # Every call re-sends the prompt, so continuations spend the token budget faster than the reply grows
+    spent = usage_from_response(result_data, messages, reply)["total_tokens"]
+    
+    continuations = 0
+    while choice.get("finish_reason") == "length" and continuations < OUTPUT_MAX_CONTINUATIONS:
+        timeout = attempt_timeouts(deadline, model, 1)
+        if timeout is None:
+            break
+        more_messages = messages + [{"role": "assistant", "content": reply}, {"role": "user", "content": CONTINUE_PROMPT}]
+        more_tokens = max_tokens
+        if token_budget is not None:
+            left = token_budget - spent - sum(estimate_tokens(m["content"]) for m in more_messages)
+            if left < MIN_COMPLETION_TOKENS:
+                break
+            more_tokens = min(max_tokens, left)
+        continuations += 1
+        # Without response_format: JSON mode would start a new object instead of finishing this one
+        try:
+            with trace_span("continue", round=continuations, max_tokens=more_tokens):
+                more = provider.complete(
+                    model, more_messages, api_key, max_tokens=more_tokens, timeout=timeout, deadline=deadline
+                )
+            more_choice = more["choices"][0]
+            more_text = more_choice["message"]["content"]
+        except (requests.exceptions.RequestException, UpstreamBusy, concurrent.futures.TimeoutError,
+                KeyError, IndexError, ValueError) as e:
+            # The reply so far is still an answer; it is reported as cut off rather than thrown away
+            logger.warning("continuation %d with %s failed: %s", continuations, model, e)
+            continuations -= 1
+            break
+        choice = more_choice
+        reply += more_text
+        usages.append(more.get("usage"))
+        spent += usage_from_response(more, more_messages, more_text)["total_tokens"]
+    
+    # Summed usage only when every call reported it; otherwise usage_from_response estimates
+    usage = None
+    if all(u and "prompt_tokens" in u and "completion_tokens" in u for u in usages):
+        usage = {key: sum(u[key] for u in usages) for key in ("prompt_tokens", "completion_tokens")}
+    return {
+        "choices": [{"message": {"content": reply}, "finish_reason": choice.get("finish_reason")}],
+        "usage": usage,
+        "truncated": truncated,
+        "continuations": continuations
+    }
+
+class OutputLengthStats:
+    """Answer lengths and latency for adaptive and fixed max_tokens, to report what adaptive sizing saves"""
+    
+    def __init__(self):
+        self.groups = {"adaptive": collections.Counter(), "fixed": collections.Counter()}
+        self.lock = threading.Lock()
+    
+    def record(self, group: str, max_tokens: int, completion_tokens: int, latency: float,
+               truncated: bool, continuations: int, cut_off: bool):
+        with self.lock:
+            counts = self.groups[group]
+            counts.update({
+                "answers": 1, "max_tokens": max_tokens, "completion_tokens": completion_tokens,
+                "latency": latency, "truncated": int(truncated), "continuations": continuations,
+                "cut_off": int(cut_off)
+            })
+    
+    def report(self) -> Dict[str, Any]:
+        """Per-group averages and rates, plus seconds saved by adaptive answers against the fixed baseline"""
+        with self.lock:
+            groups = {name: dict(counts) for name, counts in self.groups.items()}
+        report = {}
+        for name, counts in groups.items():
+            answers = counts.get("answers", 0)
+            report[name] = {"answers": answers} if not answers else {
+                "answers": answers,
+                "avg_max_tokens": counts["max_tokens"] / answers,
+                "avg_completion_tokens": counts["completion_tokens"] / answers,
+                "avg_latency": counts["latency"] / answers,
+                "truncation_rate": counts["truncated"] / answers,
+                "continuations": counts["continuations"],
+                "cut_off_rate": counts["cut_off"] / answers
+            }
+        
+        adaptive, fixed = report["adaptive"], report["fixed"]
+        report["saved_seconds"] = None
+        if adaptive["answers"] and fixed["answers"]:
+            report["saved_seconds"] = (fixed["avg_latency"] - adaptive["avg_latency"]) * adaptive["answers"]
+        return report
+
+@st.cache_resource
+def get_output_length_stats() -> OutputLengthStats:
+    return OutputLengthStats()
+
+# =============================================
+# Inference Providers
+# =============================================
+
+class OpenRouterProvider:
+    """Remote models served through the OpenRouter API"""
+    
+    name = "openrouter"
+    
+    def available(self, api_key: str) -> bool:
+        return bool(api_key)
+    
+    def complete(self, model: str, messages: list, api_key: str, max_tokens: int = 1000,
+                 temperature: float = 0.7, extra: Optional[Dict[str, Any]] = None,
+                 timeout: Any = 30, deadline: Optional["Deadline"] = None) -> Dict[str, Any]:
+        return post_chat_completion(model, messages, api_key, max_tokens, temperature, extra, timeout, deadline)
+
+class LocalLlamaProvider:
+    """Small quantized instruct model on this machine's CPU, for when the network fails"""
+    
+    name = "local"
+    
+    def __init__(self, model_path: str, threads: int, context_tokens: int):
+        self.model_path = model_path
+        self.threads = threads
+        self.context_tokens = context_tokens
+        self.requests = queue.Queue()
+        self.llm = None
+        self.lock = threading.Lock()
+    
+    def available(self, api_key: str = "") -> bool:
+        return Llama is not None and bool(self.model_path) and os.path.exists(self.model_path)
+    
+    def load(self):
+        """Load the model once and start the worker that owns it"""
+        with self.lock:
+            if self.llm is None:
+                self.llm = Llama(
+                    model_path=self.model_path,
+                    n_threads=self.threads,
+                    n_ctx=self.context_tokens,
+                    n_batch=512,
+                    verbose=False
+                )
+                threading.Thread(target=self.worker, name="third-voice-local", daemon=True).start()
+    
+    def submit(self, messages: list, max_tokens: int = 1000, temperature: float = 0.7,
+               extra: Optional[Dict[str, Any]] = None) -> concurrent.futures.Future:
+        """Queue one request for the worker"""
+        self.load()
+        future = concurrent.futures.Future()
+        self.requests.put((messages, max_tokens, temperature, extra or {}, future))
+        return future
+    
+    def complete(self, model: str, messages: list, api_key: str = "", max_tokens: int = 1000,
+                 temperature: float = 0.7, extra: Optional[Dict[str, Any]] = None,
+                 timeout: Any = 30, deadline: Optional["Deadline"] = None) -> Dict[str, Any]:
+        total_timeout = sum(timeout) if isinstance(timeout, tuple) else timeout
+        future = self.submit(messages, max_tokens, temperature, extra)
+        try:
+            return future.result(timeout=total_timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+    
+    def worker(self):
+        """Run queued requests one at a time; llama.cpp is not thread-safe, so one model serves them in turn"""
+        while True:
+            messages, max_tokens, temperature, extra, future = self.requests.get()
+            # Skip requests whose caller already gave up, so they never hold the model
+            if future.done() or not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self.llm.create_chat_completion(
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    response_format=extra.get("response_format")
+                ))
+            except Exception as e:
+                future.set_exception(e)
+
+@st.cache_resource
+def get_local_provider() -> LocalLlamaProvider:
+    """One local model per server process"""
+    return LocalLlamaProvider(
+        model_path=get_setting("LOCAL_MODEL_PATH", LOCAL_MODEL_PATH),
+        threads=get_setting("LOCAL_THREADS", LOCAL_THREADS),
+        context_tokens=LOCAL_CONTEXT_TOKENS
+    )
+
+OPENROUTER_PROVIDER = OpenRouterProvider()
+
+def get_provider(model: str):
+    """Provider that serves a model id"""
+    return get_local_provider() if model == LOCAL_MODEL_ID else OPENROUTER_PROVIDER
+
+def with_local_fallback(models: List[str], api_key: str) -> List[str]:
+    """Remote models we can reach, then the local model if one is installed"""
+    chain = list(models) if OPENROUTER_PROVIDER.available(api_key) else []
+    if get_local_provider().available():
+        chain.append(LOCAL_MODEL_ID)
+    return chain
+
+# =============================================
+# Tracing
+# =============================================
+
+# (trace, span) of the step running in this thread; None outside a traced action
+current_span = contextvars.ContextVar("third_voice_span", default=None)
+
+class TraceExporter:
+    """Appends finished traces to a JSONL file, one span per line"""
+    
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+    
+    def export(self, spans: List[Dict[str, Any]]):
+        lines = "".join(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in spans)
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError as e:
+                logger.warning("trace export failed: %s", e)
+
+@st.cache_resource
+def get_trace_exporter() -> TraceExporter:
+    """One trace file writer per server process"""
+    return TraceExporter(get_setting("TRACE_FILE", TRACE_FILE), TRACE_MAX_BYTES)
+
+def open_span(trace: Dict[str, Any], name: str, parent_id: Optional[str],
+              attributes: Dict[str, Any]) -> Dict[str, Any]:
+    span = {
+        "trace_id": trace["trace_id"],
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent_id,
+        "name": name,
+        "start": time.time(),
+        "duration_ms": None,
+        "status": "ok",
+        "attributes": attributes
+    }
+    trace["spans"].append(span)
+    return span
+
+@contextlib.contextmanager
+def run_span(trace: Dict[str, Any], span: Dict[str, Any]):
+    """Make a span current for the duration of the block and time it"""
+    token = current_span.set((trace, span))
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span["status"] = "error"
+        span["attributes"]["error"] = type(e).__name__
+        raise
+    finally:
+        span["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        current_span.reset(token)
+
+@contextlib.contextmanager
+def start_trace(name: str, **attributes):
+    """Root span of one user action; the whole trace is exported when it ends"""
+    trace = {"trace_id": uuid.uuid4().hex, "spans": []}
+    try:
+        with run_span(trace, open_span(trace, name, None, attributes)) as span:
+            yield span
+    finally:
+        get_trace_exporter().export(trace["spans"])
+        if get_script_run_ctx() is not None:
+            traces = st.session_state.setdefault('traces', collections.deque(maxlen=TRACE_HISTORY))
+            traces.append(trace["spans"])
+
+@contextlib.contextmanager
+def trace_span(name: str, **attributes):
+    """Child span of the current step; a no-op outside a trace"""
+    current = current_span.get()
+    if current is None:
+        yield {"attributes": attributes}
+        return
+    trace, parent = current
+    with run_span(trace, open_span(trace, name, parent["span_id"], attributes)) as span:
+        yield span
+
+def annotate_span(**attributes):
+    """Add attributes to the current span, if any"""
+    current = current_span.get()
+    if current is not None:
+        current[1]["attributes"].update(attributes)
+
+# =============================================
+# Admission Control
+# =============================================
+
+# Who a call is queued for (a browser session, an API client); workers inherit it through copied contexts
+admission_owner = contextvars.ContextVar("third_voice_admission_owner", default="background")
+# Called with (queue position, ETA seconds) while the current call waits, to keep the user informed
+admission_progress = contextvars.ContextVar("third_voice_admission_progress", default=None)
+
+class UpstreamBusy(Exception):
+    """Raised when a call would wait in the admission queue longer than allowed"""
+    
+    def __init__(self, waiting: int):
+        super().__init__(f"{waiting} requests waiting")
+        self.waiting = waiting
+
+class AdmissionController:
+    """Caps concurrent upstream calls; waiting calls are admitted round-robin across owners"""
+    
+    def __init__(self, capacity: int, max_wait: float):
+        self.capacity = capacity
+        self.max_wait = max_wait
+        self.active = 0
+        self.queues = {}  # owner -> deque of waiting tickets
+        self.rotation = collections.deque()  # owners with waiting tickets, next to be served first
+        self.hold_times = collections.deque(maxlen=50)
+        self.stats = collections.Counter()
+        self.condition = threading.Condition()
+    
+    def waiting(self) -> int:
+        return sum(len(tickets) for tickets in self.queues.values())
+    
+    def position(self, ticket: Dict[str, Any]) -> int:
+        """Calls that will be admitted before this ticket under round-robin"""
+        depth = self.queues[ticket["owner"]].index(ticket)
+        ahead = depth
+        for rank, owner in enumerate(self.rotation):
+            if owner == ticket["owner"]:
+                continue
+            # Owners earlier in the rotation get one more turn before ours comes up
+            turns = depth + 1 if rank < self.rotation.index(ticket["owner"]) else depth
+            ahead += min(len(self.queues[owner]), turns)
+        return ahead
+    
+    def average_hold(self) -> float:
+        """Seconds a recent call held its slot"""
+        if not self.hold_times:
+            return ADMISSION_DEFAULT_HOLD_SECONDS
+        return sum(self.hold_times) / len(self.hold_times)
+    
+    def eta(self, position: int) -> float:
+        return (position // self.capacity + 1) * self.average_hold()
+    
+    def acquire(self, owner: str, on_wait=None, max_wait: Optional[float] = None) -> float:
+        """Block until a slot is free, for at most max_wait (capped at the configured wait); returns the seconds spent waiting"""
+        started = time.monotonic()
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        with self.condition:
+            if self.active < self.capacity and not self.rotation:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return 0.0
+            
+            waiting = self.waiting()
+            if self.eta(waiting) > max_wait:
+                self.stats["shed"] += 1
+                raise UpstreamBusy(waiting)
+            
+            ticket = {"owner": owner, "admitted": False}
+            if owner not in self.queues:
+                self.queues[owner] = collections.deque()
+                self.rotation.append(owner)
+            self.queues[owner].append(ticket)
+            self.stats["queued"] += 1
+        
+        while True:
+            with self.condition:
+                if ticket["admitted"]:
+                    self.stats["admitted"] += 1
+                    return time.monotonic() - started
+                remaining = started + max_wait - time.monotonic()
+                if remaining <= 0:
+                    self.remove(ticket)
+                    self.stats["shed"] += 1
+                    raise UpstreamBusy(self.waiting())
+                position = self.position(ticket)
+                self.condition.wait(min(remaining, ADMISSION_POLL_SECONDS))
+            if on_wait and not ticket["admitted"]:
+                on_wait(position, self.eta(position))
+    
+    def release(self, held_seconds: float):
+        with self.condition:
+            self.active -= 1
+            self.hold_times.append(held_seconds)
+            self.admit_next()
+    
+    def admit_next(self):
+        """Hand free slots to the next owners in the rotation"""
+        while self.active < self.capacity and self.rotation:
+            owner = self.rotation.popleft()
+            ticket = self.queues[owner].popleft()
+            if self.queues[owner]:
+                self.rotation.append(owner)
+            else:
+                del self.queues[owner]
+            ticket["admitted"] = True
+            self.active += 1
+        self.condition.notify_all()
+    
+    def remove(self, ticket: Dict[str, Any]):
+        owner = ticket["owner"]
+        self.queues[owner].remove(ticket)
+        if not self.queues[owner]:
+            del self.queues[owner]
+            self.rotation.remove(owner)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self.condition:
+            return {
+                "capacity": self.capacity,
+                "active": self.active,
+                "waiting": self.waiting(),
+                "owners_waiting": len(self.rotation),
+                "avg_call_s": round(self.average_hold(), 2),
+                **self.stats
+            }
+
+@st.cache_resource
+def get_admission_controller() -> AdmissionController:
+    """One admission queue per server process"""
+    return AdmissionController(
+        get_setting("UPSTREAM_MAX_CONCURRENCY", UPSTREAM_MAX_CONCURRENCY),
+        get_setting("ADMISSION_MAX_WAIT_SECONDS", ADMISSION_MAX_WAIT_SECONDS)
+    )
+
+@contextlib.contextmanager
+def upstream_slot(deadline: Optional["Deadline"] = None):
+    """Hold one of the process-wide upstream slots for the duration of a call; never waits past the deadline"""
+    controller = get_admission_controller()
+    with trace_span("admission", owner_queue=controller.waiting()) as span:
+        max_wait = deadline.remaining() if deadline else None
+        waited = controller.acquire(admission_owner.get(), admission_progress.get(), max_wait)
+        span["attributes"]["waited_s"] = round(waited, 2)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(time.monotonic() - started)
 
 # =============================================
 # Utility Functions
 # =============================================
 
-def get_ai_response(message: str, context: str, is_received: bool = False) -> Dict[str, Any]:
+class Deadline:
+    """Total time budget for one user action, shared by every attempt"""
+    
+    def __init__(self, seconds: float):
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self) -> float:
+        """Seconds left, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+def attempt_timeouts(deadline: Deadline, model: str, attempts_left: int) -> Optional[tuple]:
+    """(connect, read) timeouts for the next attempt, or None once the budget is spent"""
+    remaining = deadline.remaining()
+    connect = min(CONNECT_TIMEOUT_SECONDS, remaining / 4)
+    if remaining - connect < MIN_READ_TIMEOUT_SECONDS:
+        return None
+    
+    # Reserve a fair share for the remaining fallbacks, but give a model
+    # whose recent p95 says it needs longer the time it usually takes
+    fair_share = (remaining - connect) / max(1, attempts_left)
+    p95 = get_latency_tracker().percentile(model, 95)
+    read = fair_share if p95 is None else max(fair_share, p95 * READ_TIMEOUT_P95_FACTOR)
+    
+    return connect, max(MIN_READ_TIMEOUT_SECONDS, min(read, remaining - connect))
+
+def timeouts_after_wait(timeout: tuple, deadline: Deadline) -> tuple:
+    """Shrink a planned (connect, read) pair by the time spent queued for an upstream slot"""
+    connect, read = timeout
+    remaining = deadline.remaining()
+    if remaining - connect < MIN_READ_TIMEOUT_SECONDS:
+        raise requests.exceptions.Timeout("Request budget spent waiting for an upstream slot")
+    return connect, min(read, remaining - connect)
+
+class Cassette:
+    """Gzipped JSONL of upstream requests, responses and timings, with secrets redacted"""
+    
+    def __init__(self, path: str, mode: str, latency_scale: float = 1.0):
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.recordings = collections.defaultdict(list)
+        self.cursors = collections.Counter()
+        if mode == "replay":
+            self.load()
+    
+    @staticmethod
+    def key(payload: Dict[str, Any]) -> str:
+        """Stable fingerprint of a request body"""
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode()).hexdigest()[:24]
+    
+    @staticmethod
+    def redact(text: str, api_key: str = "") -> str:
+        """Strip API keys and bearer tokens before anything touches disk"""
+        if api_key:
+            text = text.replace(api_key, "[REDACTED]")
+        return SECRET_PATTERN.sub("[REDACTED]", text)
+    
+    def load(self):
+        """Index recordings by request fingerprint, keeping their original order"""
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as cassette_file:
+                for line in cassette_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.recordings[record["key"]].append(record)
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning("could not read cassette %s: %s", self.path, e)
+    
+    def record(self, payload: Dict[str, Any], api_key: str, elapsed: float,
+               status: Optional[int] = None, body: str = "", error: Optional[str] = None):
+        """Append one interaction; each append is its own gzip member"""
+        record = {
+            "key": self.key(payload),
+            "time": datetime.datetime.now().isoformat(),
+            "request": json.loads(self.redact(json.dumps(payload), api_key)),
+            "status": status,
+            "body": self.redact(body, api_key),
+            "error": self.redact(error, api_key) if error else None,
+            "elapsed": round(elapsed, 4)
+        }
+        line = json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as cassette_file:
+                cassette_file.write(line)
+    
+    def replay(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Serve the next recorded response for this request with its (scaled) latency"""
+        key = self.key(payload)
+        with self.lock:
+            records = self.recordings.get(key)
+            if not records:
+                raise requests.exceptions.ConnectionError(f"No recorded response for request {key}")
+            record = records[self.cursors[key] % len(records)]
+            self.cursors[key] += 1
+        
+        time.sleep(record["elapsed"] * self.latency_scale)
+        if record["error"] == "timeout":
+            raise requests.exceptions.ReadTimeout(f"Recorded timeout for request {key}")
+        if record["error"]:
+            raise requests.exceptions.ConnectionError(record["error"])
+        if record["status"] >= 400:
+            raise requests.exceptions.HTTPError(f"{record['status']} recorded for request {key}")
+        return json.loads(record["body"])
+
+@st.cache_resource
+def get_cassette() -> Cassette:
+    """Cassette for the configured UPSTREAM_MODE (live mode never touches it)"""
+    mode = get_setting("UPSTREAM_MODE", "live")
+    if mode not in UPSTREAM_MODES:
+        logger.warning("unknown UPSTREAM_MODE %r, using live", mode)
+        mode = "live"
+    return Cassette(
+        get_setting("CASSETTE_FILE", CASSETTE_FILE),
+        mode,
+        get_setting("REPLAY_LATENCY_SCALE", REPLAY_LATENCY_SCALE)
+    )
+
+def post_chat_completion(model: str, messages: list, api_key: str, max_tokens: int = 1000,
+                         temperature: float = 0.7, extra: Optional[Dict[str, Any]] = None,
+                         timeout: Any = 30, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
+    """Send one chat completion request to OpenRouter and return the JSON body"""
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        **(extra or {})
+    }
+    
+    cassette = get_cassette()
+    with upstream_slot(deadline):
+        if cassette.mode == "replay":
+            with trace_span("http", upstream="replay", cache="hit"):
+                return cassette.replay(payload)
+        
+        # The read timeout was planned before queueing; what's left of the deadline now bounds it
+        if deadline is not None:
+            timeout = timeouts_after_wait(timeout, deadline)
+        
+        with trace_span("http", upstream=cassette.mode, cache="none") as span:
+            response = send_chat_completion(payload, api_key, timeout, cassette)
+            span["attributes"]["status_code"] = response.status_code
+    
+    response.raise_for_status()
+    return response.json()
+
+def send_chat_completion(payload: Dict[str, Any], api_key: str, timeout: Any, cassette: "Cassette"):
+    """POST to OpenRouter, recording the exchange when a cassette is recording"""
+    started = time.perf_counter()
+    try:
+        response = requests.post(
+            API_URL,
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            json=payload,
+            timeout=timeout
+        )
+    except requests.exceptions.RequestException as e:
+        if cassette.mode == "record":
+            error = "timeout" if isinstance(e, requests.exceptions.Timeout) else str(e)
+            cassette.record(payload, api_key, time.perf_counter() - started, error=error)
+        raise
+    
+    if cassette.mode == "record":
+        cassette.record(payload, api_key, time.perf_counter() - started, response.status_code, response.text)
+    return response
+
+def get_ai_response(message: str, context: str, is_received: bool = False,
+                    structured: Optional[bool] = None, model_mode: Optional[str] = None,
+                    api_key: Optional[str] = None, memory: Optional[str] = None,
+                    deadline: Optional[Deadline] = None,
+                    session_tokens: Optional[int] = None) -> Dict[str, Any]:
     """Get AI response from OpenRouter API with fallback models"""
-    api_key = st.session_state.get('api_key', '')
-    if not api_key:
+    api_key = api_key or st.session_state.get('api_key', '')
+    if not api_key and not get_local_provider().available():
         return {"error": "No API key configured"}
     
-    # Create the message payload
-    messages = create_message_payload(message, context, is_received)
+    if structured is None:
+        structured = st.session_state.get('structured_output', True)
+    if model_mode is None:
+        model_mode = st.session_state.get('model_mode', 'auto')
+    if session_tokens is None:
+        session_tokens = st.session_state.get('token_usage', {}).get('total_tokens', 0)
+    
+    budget = token_budget_status(session_tokens)
+    if budget["state"] == "throttle":
+        if budget["scope"] == "session":
+            error = "This session has used its AI token budget. Please start a new session later."
+        else:
+            error = "The Third Voice is at its hourly AI capacity. Please try again in a few minutes."
+        return {"error": error, "budget_exceeded": True}
+    
+    # Classify once; the label picks the specialized prompt
+    with trace_span("classify") as span:
+        classification = classify_message(message)
+        message_type = classification["message_type"]
+        prompt_context = resolve_prompt_context(context, classification)
+        span["attributes"].update({"message_type": message_type, "prompt_context": prompt_context})
+    
+    # Create the message payload; a small random share keeps the fixed budget as a baseline
+    messages = create_message_payload(message, prompt_context, is_received, structured, message_type, memory)
+    extra = {"response_format": {"type": "json_object"}} if structured else None
+    length_group = "fixed" if random.random() < get_setting("LENGTH_HOLDOUT_SHARE", LENGTH_HOLDOUT_SHARE) else "adaptive"
+    
+    with trace_span("route", model_mode=model_mode) as span:
+        routing = select_models(message, context, message_type, model_mode)
+        if budget["state"] == "downgrade":
+            routing = downgrade_routing(routing)
+        routing["models"] = with_local_fallback(routing["models"], api_key)
+        span["attributes"].update({"models": routing["models"], "reason": routing["reason"]})
+    # Never ask for more tokens than the tightest budget has left, continuations included
+    max_tokens = DEFAULT_MAX_TOKENS
+    if length_group == "adaptive":
+        max_tokens = plan_output_tokens(message, prompt_context, is_received, structured)
+    if budget["remaining"] is not None:
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        max_tokens = max(MIN_COMPLETION_TOKENS, min(max_tokens, budget["remaining"] - prompt_tokens))
+    if length_group == "adaptive":
+        messages = with_length_hint(messages, max_tokens)
     
-    # Try each model in sequence for reliability
-    for model in AI_MODELS:
+    tracker = get_latency_tracker()
+    deadline = deadline or Deadline(get_setting("REQUEST_BUDGET_SECONDS", REQUEST_BUDGET_SECONDS))
+    attempts = 0
+    
+    # Try each model in sequence for reliability, within one time budget
+    for index, model in enumerate(routing["models"]):
+        timeouts = attempt_timeouts(deadline, model, len(routing["models"]) - index)
+        if timeouts is None:
+            break
+        
+        attempts += 1
+        started = time.perf_counter()
         try:
-            response = requests.post(
-                API_URL,
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                },
-                timeout=30
-            )
-            
-            response.raise_for_status()
-            result_data = response.json()
+            with trace_span("attempt", model=model, context=context, attempt=attempts,
+                            read_timeout=round(timeouts[1], 2), max_tokens=max_tokens) as span:
+                if model == LOCAL_MODEL_ID:
+                    span["attributes"]["upstream"] = "local"
+                result_data = complete_with_continuation(
+                    model, messages, api_key, max_tokens, extra, timeouts, deadline, budget["remaining"]
+                )
             
             if "choices" in result_data and len(result_data["choices"]) > 0:
                 ai_reply = result_data["choices"][0]["message"]["content"]
-                model_name = format_model_name(model)
+                latency = time.perf_counter() - started
+                tracker.record(model, latency)
+                log_routing_decision(routing, model)
+                usage = usage_from_response(result_data, messages, ai_reply)
+                get_token_ledger().record(model, context, usage)
+                cut_off = result_data["choices"][0]["finish_reason"] == "length"
+                get_output_length_stats().record(
+                    length_group, max_tokens, usage["completion_tokens"], latency,
+                    result_data["truncated"], result_data["continuations"], cut_off
+                )
+                annotate_span(tokens=usage["total_tokens"], continuations=result_data["continuations"])
                 
-                # Detect message type for special handling
-                message_type = detect_message_type(message)
+                model_name = LOCAL_MODEL_NAME if model == LOCAL_MODEL_ID else format_model_name(model)
                 
-                return format_ai_response(
-                    message=message,
-                    ai_reply=ai_reply,
-                    model=model_name,
-                    is_received=is_received,
-                    message_type=message_type
-                )
+                # One call gives meaning, sentiment, needs and the reply
+                with trace_span("parse", structured=structured) as span:
+                    parsed = parse_structured_reply(ai_reply) if structured else None
+                    span["attributes"]["parsed"] = bool(parsed)
+                if parsed:
+                    result = format_structured_response(
+                        message=message,
+                        parsed=parsed,
+                        model=model_name,
+                        is_received=is_received,
+                        message_type=message_type
+                    )
+                else:
+                    result = format_ai_response(
+                        message=message,
+                        ai_reply=ai_reply,
+                        model=model_name,
+                        is_received=is_received,
+                        message_type=message_type
+                    )
+                
+                result.update({
+                    "model_id": model, "latency": round(latency, 2), "context": context, "usage": usage,
+                    "cut_off": cut_off
+                })
+                return result
             
+        except UpstreamBusy as e:
+            # Every remote model shares the queue, so trying the next one would only wait again
+            log_routing_decision(routing, None)
+            return {
+                "error": "The Third Voice is very busy right now. Please try again in a minute.",
+                "busy": True,
+                "queue_waiting": e.waiting
+            }
         except requests.exceptions.RequestException as e:
             # Log the error and try next model
-            continue
+            logger.warning("model %s failed: %s", model, e)
         except Exception as e:
             # Unexpected error, try next model
-            continue
+            logger.warning("model %s returned an unexpected response: %s", model, e)
+        
+        tracker.record(model, time.perf_counter() - started, ok=False)
+    
+    log_routing_decision(routing, None)
+    
+    if deadline.remaining() < MIN_READ_TIMEOUT_SECONDS:
+        return {
+            "error": (
+                f"No answer within {deadline.budget:.0f}s "
+                f"({attempts} model{'s' if attempts != 1 else ''} tried). Please try again."
+            ),
+            "deadline_exceeded": True
+        }
     
     return {"error": "All AI models failed to respond"}
 
+def parse_structured_reply(ai_reply: str) -> Optional[Dict[str, Any]]:
+    """Parse and validate a JSON reply, repairing common model mistakes"""
+    text = ai_reply.strip()
+    
+    # Keep only the outermost object if the model added code fences or chatter
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    text = text[start:end + 1]
+    
+    data = None
+    for candidate in (text, repair_json_text(text)):
+        try:
+            data = json.loads(candidate)
+            break
+        except ValueError:
+            continue
+    
+    if not isinstance(data, dict):
+        return None
+    
+    return validate_structured_reply(data)
+
+def repair_json_text(text: str) -> str:
+    """Fix smart quotes and trailing commas that break json.loads"""
+    text = (text
+            .replace("\u201c", '"').replace("\u201d", '"')
+            .replace("\u2018", "'").replace("\u2019", "'"))
+    return re.sub(r",\s*([}\]])", r"\1", text)
+
+def validate_structured_reply(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Normalize a parsed reply, or return None if it is unusable"""
+    reply = data.get("reply") or data.get("suggested_reply") or data.get("improved")
+    if not isinstance(reply, str) or not reply.strip():
+        return None
+    
+    meaning = data.get("meaning", "")
+    if not isinstance(meaning, str):
+        meaning = str(meaning)
+    
+    sentiment = str(data.get("sentiment", "neutral")).strip().lower()
+    if sentiment not in STRUCTURED_SENTIMENTS:
+        sentiment = "neutral"
+    
+    needs = data.get("needs", [])
+    if isinstance(needs, str):
+        needs = [need.strip() for need in needs.split(",")]
+    elif not isinstance(needs, list):
+        needs = []
+    needs = [str(need).strip() for need in needs if str(need).strip()]
+    
+    return {
+        "meaning": meaning.strip(),
+        "sentiment": sentiment,
+        "needs": needs,
+        "reply": reply.strip()
+    }
+
+def format_structured_response(message: str, parsed: Dict[str, Any], model: str, is_received: bool, message_type: str) -> Dict[str, Any]:
+    """Format a validated structured reply into the standard response structure"""
+    result = {
+        "sentiment": parsed["sentiment"],
+        "meaning": parsed["meaning"],
+        "needs": parsed["needs"],
+        "original": message,
+        "model": model,
+        "message_type": message_type,
+        "structured": True
+    }
+    
+    if is_received:
+        result.update({"type": "translate", "response": parsed["reply"]})
+    else:
+        result.update({"type": "coach", "improved": parsed["reply"]})
+    
+    return result
+
 def format_ai_response(message: str, ai_reply: str, model: str, is_received: bool, message_type: str) -> Dict[str, Any]:
     """Format the AI response into a standardized structure"""
     if is_received:
@@ -323,7 +2314,7 @@ def create_history_entry(message: str, result: Dict[str, Any], entry_type: str)
     """Create a standardized history entry"""
     timestamp = datetime.datetime.now()
     
-    return {
+    entry = {
         "id": f"{entry_type}_{timestamp.timestamp()}",
         "time": timestamp.strftime("%m/%d %H:%M"),
         "type": entry_type,
@@ -331,18 +2322,26 @@ def create_history_entry(message: str, result: Dict[str, Any], entry_type: str)
         "result": result.get("improved" if entry_type == "coach" else "response", ""),
         "sentiment": result.get("sentiment", "neutral"),
         "model": result.get("model", "Unknown"),
+        "model_id": result.get("model_id", ""),
+        "context": result.get("context", ""),
+        "latency": result.get("latency"),
+        "tokens": result.get("usage", {}).get("total_tokens"),
         "message_type": result.get("message_type", "normal"),
+        "meaning": result.get("meaning", "") if result.get("structured") else "",
+        "needs": result.get("needs", []),
         "timestamp": timestamp.isoformat()
     }
+    score_entries([entry])
+    return entry
 
 def validate_token(token: str) -> bool:
     """Validate beta access token"""
     return token in VALID_TOKENS
 
-def generate_filename(prefix: str = "third_voice") -> str:
+def generate_filename(prefix: str = "third_voice", extension: str = "json") -> str:
     """Generate a timestamped filename"""
     timestamp = datetime.datetime.now().strftime('%m%d_%H%M')
-    return f"{prefix}_{timestamp}.json"
+    return f"{prefix}_{timestamp}.{extension}"
 
 def truncate_text(text: str, max_length: int = 50) -> str:
     """Truncate text with ellipsis"""
@@ -371,38 +2370,679 @@ def format_time_ago(timestamp_str: str) -> str:
         return "Unknown"
 
 def sanitize_input(text: str) -> str:
-    """Sanitize user input for safety"""
+    """Sanitize user input for safety, keeping at most MESSAGE_TOKEN_BUDGET tokens"""
     text = text.strip()
-    if len(text) > 5000:  # Reasonable limit for messages
-        text = text[:5000]
+    if estimate_tokens(text) > MESSAGE_TOKEN_BUDGET:
+        text = text[:MESSAGE_TOKEN_BUDGET * 4]
     return text
 
-def get_message_stats(history: list) -> Dict[str, int]:
-    """Calculate statistics for message history"""
-    if not history:
-        return {'total': 0, 'coached': 0, 'translated': 0}
+def get_message_stats(history: list) -> Dict[str, int]:
+    """Calculate statistics for message history"""
+    if not history:
+        return {'total': 0, 'coached': 0, 'translated': 0}
+    
+    coached = sum(1 for entry in history if entry.get('type') == 'coach')
+    translated = sum(1 for entry in history if entry.get('type') == 'translate')
+    
+    return {
+        'total': len(history),
+        'coached': coached,
+        'translated': translated
+    }
+
+def health_check() -> Dict[str, bool]:
+    """Perform basic health checks"""
+    checks = {
+        'api_key_configured': bool(st.session_state.get('api_key')),
+        'session_initialized': 'contacts' in st.session_state,
+        'active_contact_valid': (
+            st.session_state.get('active_contact', '') in 
+            st.session_state.get('contacts', {})
+        )
+    }
+    
+    return checks
+
+# =============================================
+# History File Format
+# =============================================
+
+def pack_column(values: List[Any], present: List[int], rows: int) -> bytes:
+    """One compressed column; sparse when some entries lack the field"""
+    column = values if len(present) == rows else {"rows": present, "values": values}
+    return zlib.compress(json.dumps(column, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def encode_history_file(data: Dict[str, Any]) -> bytes:
+    """Encode an export_session_data() dict as a .tvh file"""
+    out = bytearray(HISTORY_HEADER.pack(HISTORY_FILE_MAGIC, HISTORY_FILE_VERSION, 0))
+    
+    def write_block(block: bytes) -> List[int]:
+        offset = len(out)
+        out.extend(block)
+        return [offset, len(block)]
+    
+    index = {"version": HISTORY_FILE_VERSION, "contacts": {}}
+    meta = {key: value for key, value in data.items() if key != 'contacts'}
+    meta['contacts'] = {}
+    
+    for name, contact in data.get('contacts', {}).items():
+        history = contact.get('history', [])
+        meta['contacts'][name] = {key: value for key, value in contact.items() if key != 'history'}
+        chunks = []
+        
+        for start in range(0, len(history), HISTORY_CHUNK_ENTRIES):
+            entries = history[start:start + HISTORY_CHUNK_ENTRIES]
+            fields = list(dict.fromkeys(key for entry in entries for key in entry))
+            columns = {}
+            for field in fields:
+                present = [row for row, entry in enumerate(entries) if field in entry]
+                values = [entries[row][field] for row in present]
+                columns[field] = write_block(pack_column(values, present, len(entries)))
+            chunks.append({"start": start, "count": len(entries), "columns": columns})
+        
+        index["contacts"][name] = {"count": len(history), "chunks": chunks}
+    
+    index["meta"] = write_block(zlib.compress(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+    index_block = zlib.compress(json.dumps(index, ensure_ascii=False).encode("utf-8"))
+    index_offset = len(out)
+    out.extend(index_block)
+    out.extend(HISTORY_FOOTER.pack(index_offset, len(index_block), HISTORY_FILE_MAGIC))
+    return bytes(out)
+
+def is_history_file(data: bytes) -> bool:
+    """True for .tvh content, whatever the file name says"""
+    return data[:len(HISTORY_FILE_MAGIC)] == HISTORY_FILE_MAGIC
+
+class HistoryFileReader:
+    """Random access to a .tvh file: a path is memory-mapped, bytes are read in place"""
+    
+    def __init__(self, source):
+        self.file = None
+        self.mapped = None
+        if isinstance(source, (str, os.PathLike)):
+            self.file = open(source, "rb")
+            self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buffer = memoryview(self.mapped)
+        else:
+            self.buffer = memoryview(source)
+        
+        if len(self.buffer) < HISTORY_HEADER.size + HISTORY_FOOTER.size:
+            raise ValueError("Not a Third Voice history file")
+        magic, version, _ = HISTORY_HEADER.unpack_from(self.buffer, 0)
+        index_offset, index_length, end_magic = HISTORY_FOOTER.unpack_from(
+            self.buffer, len(self.buffer) - HISTORY_FOOTER.size
+        )
+        if magic != HISTORY_FILE_MAGIC or end_magic != HISTORY_FILE_MAGIC:
+            raise ValueError("Not a Third Voice history file")
+        if version > HISTORY_FILE_VERSION:
+            raise ValueError(f"History file version {version} is newer than this app supports")
+        
+        self.index = json.loads(self.block([index_offset, index_length]))
+        self._meta = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        self.buffer.release()
+        if self.mapped:
+            self.mapped.close()
+            self.file.close()
+    
+    def block(self, location: List[int]) -> bytes:
+        offset, length = location
+        return zlib.decompress(self.buffer[offset:offset + length])
+    
+    @property
+    def meta(self) -> Dict[str, Any]:
+        """Everything except contact histories, decoded on first use"""
+        if self._meta is None:
+            self._meta = json.loads(self.block(self.index["meta"]))
+        return self._meta
+    
+    def contact_names(self) -> List[str]:
+        return list(self.index["contacts"])
+    
+    def count(self, name: str) -> int:
+        return self.index["contacts"][name]["count"]
+    
+    def read_chunk(self, chunk: Dict[str, Any], columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Rebuild the entries of one chunk from the requested columns (all by default)"""
+        entries = [{} for _ in range(chunk["count"])]
+        for field, location in chunk["columns"].items():
+            if columns is not None and field not in columns:
+                continue
+            column = json.loads(self.block(location))
+            if isinstance(column, dict):
+                pairs = zip(column["rows"], column["values"])
+            else:
+                pairs = enumerate(column)
+            for row, value in pairs:
+                entries[row][field] = value
+        return entries
+    
+    def page(self, name: str, offset: int = 0, limit: int = 20,
+             columns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Entries [offset, offset + limit) in stored (oldest-first) order"""
+        entries = []
+        for chunk in self.index["contacts"][name]["chunks"]:
+            start, end = chunk["start"], chunk["start"] + chunk["count"]
+            if end <= offset or start >= offset + limit:
+                continue
+            rows = self.read_chunk(chunk, columns)
+            entries.extend(rows[max(0, offset - start):offset + limit - start])
+        return entries
+    
+    def load_contact(self, name: str) -> Dict[str, Any]:
+        """One contact with its full history, without touching the others"""
+        return {**self.meta["contacts"][name], "history": self.page(name, 0, self.count(name))}
+    
+    def to_json(self) -> Dict[str, Any]:
+        """The same dict export_session_data() produced"""
+        data = {key: value for key, value in self.meta.items() if key != 'contacts'}
+        data['contacts'] = {name: self.load_contact(name) for name in self.contact_names()}
+        return data
+
+def decode_history_file(data: bytes) -> Dict[str, Any]:
+    """Decode a whole .tvh file back to the JSON export schema"""
+    with HistoryFileReader(data) as reader:
+        return reader.to_json()
+
+# =============================================
+# Autosave
+# =============================================
+
+class WriteBehindStore:
+    """Coalesces changed keys in memory and flushes them to SQLite on a background thread"""
+    
+    def __init__(self, path: str, debounce: float, max_delay: float):
+        self.path = path
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.pending = {}
+        self.first_change = None
+        self.last_change = None
+        self.stats = collections.Counter()
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()  # Taken before the condition; held from taking a batch to committing it
+        
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS autosave ("
+                "workspace TEXT, key TEXT, value TEXT, updated REAL, "
+                "PRIMARY KEY (workspace, key))"
+            )
+        threading.Thread(target=self.worker, name="third-voice-autosave", daemon=True).start()
+    
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+    
+    def put(self, workspace: str, key: str, value: Optional[str]):
+        """Queue a value (None deletes the key); later puts of the same key replace earlier ones"""
+        with self.condition:
+            if (workspace, key) in self.pending:
+                self.stats["coalesced"] += 1
+            self.pending[(workspace, key)] = value
+            self.last_change = time.monotonic()
+            self.first_change = self.first_change or self.last_change
+            self.condition.notify()
+    
+    def load(self, workspace: str) -> Dict[str, str]:
+        """Everything saved for a workspace, including changes not flushed yet"""
+        with self.connect() as conn:
+            rows = dict(conn.execute(
+                "SELECT key, value FROM autosave WHERE workspace = ?", (workspace,)
+            ).fetchall())
+        with self.condition:
+            for (pending_workspace, key), value in self.pending.items():
+                if pending_workspace != workspace:
+                    continue
+                if value is None:
+                    rows.pop(key, None)
+                else:
+                    rows[key] = value
+        return rows
+    
+    def forget(self, workspace: str):
+        """Drop a workspace, pending changes included; waits out a flush in progress so it can't write it back"""
+        with self.write_lock:
+            with self.condition:
+                for pending_key in [k for k in self.pending if k[0] == workspace]:
+                    del self.pending[pending_key]
+            with self.connect() as conn:
+                conn.execute("DELETE FROM autosave WHERE workspace = ?", (workspace,))
+    
+    def worker(self):
+        """Wait for a quiet period, then write every pending key in one transaction"""
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                while True:
+                    now = time.monotonic()
+                    quiet_for = now - self.last_change
+                    waited = now - self.first_change
+                    if quiet_for >= self.debounce or waited >= self.max_delay:
+                        break
+                    self.condition.wait(min(self.debounce - quiet_for, self.max_delay - waited))
+            
+            with self.write_lock:
+                with self.condition:
+                    batch, self.pending = self.pending, {}
+                    self.first_change = None
+                if not batch:
+                    continue  # A forget() emptied it meanwhile
+                try:
+                    with self.connect() as conn:
+                        now = time.time()
+                        conn.executemany(
+                            "DELETE FROM autosave WHERE workspace = ? AND key = ?",
+                            [key for key, value in batch.items() if value is None]
+                        )
+                        conn.executemany(
+                            "INSERT OR REPLACE INTO autosave VALUES (?, ?, ?, ?)",
+                            [(ws, key, value, now) for (ws, key), value in batch.items() if value is not None]
+                        )
+                    self.stats["flushes"] += 1
+                    self.stats["rows_written"] += len(batch)
+                    continue
+                except sqlite3.Error as e:
+                    logger.warning("autosave flush failed: %s", e)
+                    # Put the batch back unless newer values arrived meanwhile
+                    with self.condition:
+                        for key, value in batch.items():
+                            self.pending.setdefault(key, value)
+                        self.last_change = time.monotonic()
+                        self.first_change = self.first_change or self.last_change
+            time.sleep(self.debounce)
+
+@st.cache_resource
+def get_autosave_store() -> WriteBehindStore:
+    """One autosave writer per server process"""
+    return WriteBehindStore(
+        get_setting("AUTOSAVE_FILE", AUTOSAVE_FILE),
+        AUTOSAVE_DEBOUNCE_SECONDS,
+        AUTOSAVE_MAX_DELAY_SECONDS
+    )
+
+def get_workspace_id() -> str:
+    """Workspace id kept in the URL, so a bookmarked page restores its data"""
+    if 'workspace_id' not in st.session_state:
+        st.session_state.workspace_id = st.query_params.get("ws") or uuid.uuid4().hex[:16]
+    if st.query_params.get("ws") != st.session_state.workspace_id:
+        st.query_params["ws"] = st.session_state.workspace_id
+    return st.session_state.workspace_id
+
+def autosave_fingerprints() -> Dict[str, Any]:
+    """Cheap per-key change markers, so unchanged data is never serialized"""
+    fingerprints = {
+        "active_contact": st.session_state.active_contact,
+        "contact_names": tuple(st.session_state.contact_index),
+        "contact_index": tuple((name, info['total'], info['last_active'], info['context'])
+                               for name, info in st.session_state.contact_index.items()),
+        "feedback": hash(frozenset(st.session_state.feedback_data.items())),
+        "user_stats": tuple(st.session_state.user_stats.items())
+    }
+    # Stored contacts change only by being replaced; str hashes are cached, so this stays cheap
+    for name, stored in st.session_state.stored_contacts.items():
+        fingerprints[f"contact:{name}"] = ("stored", hash(stored['contact']))
+        fingerprints[f"journal:{name}"] = ("stored", hash(stored.get('journal')))
+    for name, contact in st.session_state.contacts.items():
+        history = contact.get('history', [])
+        memory = contact.get('memory', {})
+        fingerprints[f"contact:{name}"] = (
+            contact.get('context'), len(history),
+            history[-1].get('id') if history else None,
+            memory.get('summarized_count')
+        )
+    for name, journal in st.session_state.journal_entries.items():
+        fingerprints[f"journal:{name}"] = tuple(journal.values())
+    return fingerprints
+
+def autosave_value(key: str) -> Any:
+    """Current session value behind an autosave key"""
+    if key.startswith("contact:"):
+        return st.session_state.contacts[key.split(":", 1)[1]]
+    if key.startswith("journal:"):
+        return st.session_state.journal_entries[key.split(":", 1)[1]]
+    return {
+        "active_contact": st.session_state.active_contact,
+        "contact_names": list(st.session_state.contact_index),
+        "contact_index": st.session_state.contact_index,
+        "feedback": st.session_state.feedback_data,
+        "user_stats": st.session_state.user_stats
+    }[key]
+
+def autosave_payload(key: str) -> Optional[str]:
+    """JSON for an autosave key; stored contacts are already serialized"""
+    kind, _, name = key.partition(":")
+    stored = st.session_state.stored_contacts.get(name) if kind in ("contact", "journal") else None
+    if stored is not None:
+        return stored.get(kind)
+    return json.dumps(autosave_value(key), ensure_ascii=False)
+
+def autosave_session():
+    """Queue only the keys that changed since the last run; never waits on disk"""
+    if not st.session_state.get('autosave_enabled', False):
+        return
+    
+    # Turned on mid-session: load the workspace before writing over it
+    if restore_session():
+        st.rerun()
+    
+    previous = st.session_state.get('autosave_fingerprints', {})
+    current = autosave_fingerprints()
+    if current == previous:
+        return
+    
+    store = get_autosave_store()
+    workspace = get_workspace_id()
+    for key, fingerprint in current.items():
+        if previous.get(key) != fingerprint:
+            store.put(workspace, key, autosave_payload(key))
+    for key in previous.keys() - current.keys():
+        store.put(workspace, key, None)
+    
+    st.session_state.autosave_fingerprints = current
+
+def restore_session() -> bool:
+    """Load this workspace's autosaved data once autosave is on; True if anything was saved"""
+    if st.session_state.get('autosave_restored') or not st.session_state.get('autosave_enabled', False):
+        return False
+    st.session_state.autosave_restored = True
+    
+    try:
+        saved = get_autosave_store().load(get_workspace_id())
+    except sqlite3.Error as e:
+        logger.warning("autosave restore failed: %s", e)
+        return False
+    
+    # Saved contacts replace the defaults but stay as JSON until selected
+    stored = {}
+    for key, value in saved.items():
+        kind, _, name = key.partition(":")
+        if kind in ("contact", "journal"):
+            stored.setdefault(name, {})[kind] = value
+        elif key == "feedback":
+            st.session_state.feedback_data = json.loads(value)
+        elif key == "user_stats":
+            st.session_state.user_stats = json.loads(value)
+    stored = {name: parts for name, parts in stored.items() if 'contact' in parts}
+    for name in stored:
+        st.session_state.contacts.pop(name, None)
+        st.session_state.journal_entries.pop(name, None)
+    
+    # Contacts deleted since the save stay deleted, defaults included
+    contacts = st.session_state.contacts
+    kept = json.loads(saved["contact_names"]) if "contact_names" in saved else [*contacts, *stored]
+    kept = [name for name in kept if name in contacts or name in stored]
+    st.session_state.contacts = {name: contacts[name] for name in kept if name in contacts}
+    st.session_state.stored_contacts = {name: stored[name] for name in kept if name in stored}
+    
+    # The saved index spares parsing every history; saves from before it existed are indexed once
+    index = json.loads(saved.get("contact_index", "{}"))
+    st.session_state.contact_index = {
+        name: index.get(name) or contact_summary(
+            st.session_state.contacts[name] if name in st.session_state.contacts
+            else json.loads(stored[name]['contact'])
+        )
+        for name in kept
+    }
+    
+    if saved.get("active_contact"):
+        active_contact = json.loads(saved["active_contact"])
+        if active_contact in st.session_state.contact_index:
+            st.session_state.active_contact = active_contact
+    if st.session_state.active_contact not in st.session_state.contact_index:
+        st.session_state.active_contact = kept[0]
+    ensure_contact_loaded(st.session_state.active_contact)
+    
+    # What was just loaded is already saved
+    st.session_state.autosave_fingerprints = autosave_fingerprints()
+    st.session_state.pop('rollups', None)
+    return bool(saved)
+
+# =============================================
+# Thread Analysis
+# =============================================
+
+# "Alex: hi", "[10:32] Alex: hi", "12/01/2024, 10:32 - Alex: hi", "Alex (10:32): hi"
+TRANSCRIPT_LINE_PATTERN = re.compile(
+    r"^\s*(?:\[[^\]]*\]\s*|[\d/.,:\s]+(?:[AaPp]\.?[Mm]\.?)?\s*[-–]\s*)?"
+    r"(?P<speaker>[^\s:\[\]][^:\[\]]{0,39}?)\s*(?:\([^)]*\))?\s*:\s+(?P<text>\S.*)$"
+)
+
+def split_transcript(text: str) -> List[Dict[str, Any]]:
+    """Speaker-attributed messages; unprefixed lines continue the previous message, and bursts from one speaker merge"""
+    messages = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = TRANSCRIPT_LINE_PATTERN.match(line)
+        if match:
+            speaker, body = match.group("speaker").strip(), match.group("text").strip()
+            if messages and messages[-1]["speaker"] == speaker:
+                messages[-1]["text"] += "\n" + body
+            else:
+                messages.append({"index": len(messages), "speaker": speaker, "text": body})
+        elif messages:
+            messages[-1]["text"] += "\n" + line.strip()
+    return messages
+
+def guess_self_speaker(speakers: List[str]) -> int:
+    """Index of the speaker most likely to be the user"""
+    for index, speaker in enumerate(speakers):
+        if speaker.lower() in SELF_SPEAKER_NAMES:
+            return index
+    return len(speakers) - 1 if len(speakers) > 1 else 0
+
+def format_transcript(messages: List[Dict[str, Any]], me: str) -> str:
+    return "\n".join(f"{'Me' if m['speaker'] == me else m['speaker']}: {m['text']}" for m in messages)
+
+@st.cache_resource
+def get_thread_executor() -> concurrent.futures.ThreadPoolExecutor:
+    """Shared pool, so thread analysis stays within THREAD_WORKERS calls however many users run it"""
+    return concurrent.futures.ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix="third-voice-thread")
+
+def analyze_thread_messages(messages: List[Dict[str, Any]], received: List[Dict[str, Any]], me: str,
+                            context: str, **options):
+    """Analyze each received message in parallel; yields (position in received, result) as each finishes"""
+    budget = get_setting("REQUEST_BUDGET_SECONDS", REQUEST_BUDGET_SECONDS)
+    thread_deadline = Deadline(budget * THREAD_BUDGET_FACTOR)
+    executor = get_thread_executor()
+    futures = {}
     
-    coached = sum(1 for entry in history if entry.get('type') == 'coach')
-    translated = sum(1 for entry in history if entry.get('type') == 'translate')
+    def analyze(text: str, memory: Optional[str]) -> Dict[str, Any]:
+        # A message's own budget starts when a worker picks it up, so waiting in the pool doesn't
+        # eat it, but no message runs past the thread's overall deadline
+        deadline = Deadline(min(budget, thread_deadline.remaining()))
+        return get_ai_response(text, context, True, memory=memory, deadline=deadline, **options)
+    
+    for position, message in enumerate(received):
+        earlier = messages[max(0, message["index"] - THREAD_CONTEXT_TURNS):message["index"]]
+        memory = f"Earlier in this conversation:\n{format_transcript(earlier, me)}" if earlier else None
+        # Run in a copy of this context so the workers' spans join the current trace
+        future = executor.submit(contextvars.copy_context().run, analyze, message["text"], memory)
+        futures[future] = position
+    
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning("thread message analysis failed: %s", e)
+            result = {"error": "Analysis failed for this message"}
+        yield futures[future], result
+
+def build_thread_summary_message(messages: List[Dict[str, Any]], received: List[Dict[str, Any]],
+                                 results: List[Dict[str, Any]], me: str) -> str:
+    """One message asking for the overall meaning and a reply, given the per-message analyses"""
+    meanings = [
+        f"- {message['speaker']}: \"{truncate_text(message['text'], 80)}\" → {result.get('meaning') or result.get('response', '')}"
+        for message, result in zip(received, results)
+        if result and "error" not in result
+    ]
+    transcript = format_transcript(messages, me)
+    # Keep the end of long transcripts: the latest messages matter most for the reply
+    if estimate_tokens(transcript) > THREAD_SUMMARY_TOKENS:
+        transcript = "...\n" + transcript[-THREAD_SUMMARY_TOKENS * 4:]
+    
+    return (
+        f"This is a conversation between me and {', '.join(sorted({m['speaker'] for m in received}))}. "
+        f"Tell me what they mean overall and suggest my next reply.\n\n"
+        f"{transcript}\n\n"
+        + ("What their individual messages seemed to mean:\n" + "\n".join(meanings) if meanings else "")
+    )
+
+# =============================================
+# Long Messages
+# =============================================
+
+SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?…])\s+")
+
+def split_long_message(text: str, max_tokens: int = LONG_MESSAGE_CHUNK_TOKENS) -> List[str]:
+    """Parts of at most max_tokens, cut between paragraphs, then sentences, then words as a last resort"""
+    max_chars = max_tokens * 4
+    pieces = []  # (separator before the piece, piece)
+    for paragraph in re.split(r"\n\s*\n", text.strip()):
+        separator = "\n\n"
+        for sentence in SENTENCE_BOUNDARY_PATTERN.split(paragraph) if len(paragraph) > max_chars else [paragraph]:
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                cut = cut if cut > 0 else max_chars
+                pieces.append((separator, sentence[:cut]))
+                sentence, separator = sentence[cut:].lstrip(), " "
+            pieces.append((separator, sentence))
+            separator = " "
     
+    parts = [""]
+    for separator, piece in pieces:
+        if parts[-1] and len(parts[-1]) + len(separator) + len(piece) > max_chars:
+            parts.append(piece)
+        else:
+            parts[-1] = f"{parts[-1]}{separator}{piece}" if parts[-1] else piece
+    return parts
+
+def session_request_options(structured: Optional[bool] = None, model_mode: Optional[str] = None,
+                            api_key: Optional[str] = None, session_tokens: Optional[int] = None,
+                            **options) -> Dict[str, Any]:
+    """Fill unset get_ai_response options from the session, so worker threads never read st.session_state"""
     return {
-        'total': len(history),
-        'coached': coached,
-        'translated': translated
+        "structured": st.session_state.get('structured_output', True) if structured is None else structured,
+        "model_mode": model_mode or st.session_state.get('model_mode', 'auto'),
+        "api_key": api_key or st.session_state.get('api_key', ''),
+        "session_tokens": (st.session_state.get('token_usage', {}).get('total_tokens', 0)
+                           if session_tokens is None else session_tokens),
+        **options
     }
 
-def health_check() -> Dict[str, bool]:
-    """Perform basic health checks"""
-    checks = {
-        'api_key_configured': bool(st.session_state.get('api_key')),
-        'session_initialized': 'contacts' in st.session_state,
-        'active_contact_valid': (
-            st.session_state.get('active_contact', '') in 
-            st.session_state.get('contacts', {})
+def analyze_message_parts(parts: List[str], context: str, is_received: bool, memory: Optional[str], **options):
+    """Analyze each part in parallel on the thread-mode pool; yields (index, result) as each finishes"""
+    executor = get_thread_executor()
+    futures = {}
+    
+    for index, part in enumerate(parts):
+        note = f"This is part {index + 1} of {len(parts)} of one long message; the other parts are handled separately."
+        future = executor.submit(
+            contextvars.copy_context().run, get_ai_response,
+            part, context, is_received, memory=f"{memory}\n{note}" if memory else note, **options
         )
+        futures[future] = index
+    
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.warning("long message part failed: %s", e)
+            result = {"error": "Analysis failed for part of this message"}
+        yield futures[future], result
+
+def merge_usage(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One usage block for an answer built from several calls"""
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "estimated": False, "calls": 0}
+    for result in results:
+        if "usage" not in result:
+            continue
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            usage[key] += result["usage"][key]
+        usage["estimated"] |= result["usage"].get("estimated", False)
+        usage["calls"] += result["usage"].get("calls", 1)
+    return usage
+
+def merge_rewrites(message: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Improved parts joined in order; they were cut on paragraph boundaries, so no extra call is needed to stitch them"""
+    merged = {
+        "type": "coach",
+        "original": message,
+        "improved": "\n\n".join(result["improved"] for result in results),
+        "sentiment": collections.Counter(result["sentiment"] for result in results).most_common(1)[0][0],
+        "model": ", ".join(dict.fromkeys(result["model"] for result in results)),
+        "model_id": results[0]["model_id"],
+        "context": results[0]["context"],
+        "message_type": next((r["message_type"] for r in results if r["message_type"] != "normal"), "normal")
     }
+    if all(result.get("structured") for result in results):
+        merged.update({
+            "structured": True,
+            "meaning": " ".join(result["meaning"] for result in results),
+            "needs": list(dict.fromkeys(need for result in results for need in result["needs"]))
+        })
+    return merged
+
+def build_long_message_summary(parts: List[str], results: List[Dict[str, Any]]) -> str:
+    """The reduce step's input: what each part meant, far shorter than the message itself"""
+    meanings = [
+        f"- Part {index + 1} (\"{truncate_text(part, 80)}\"): {result.get('meaning') or result.get('response', '')}"
+        + (f" (needs: {', '.join(result['needs'])})" if result.get("needs") else "")
+        for index, (part, result) in enumerate(zip(parts, results))
+    ]
+    return (
+        f"I received one long message and read it in {len(parts)} parts. "
+        f"Tell me what they mean overall and suggest one reply to the whole message.\n\n"
+        "What each part seemed to mean:\n" + "\n".join(meanings)
+    )
+
+def get_long_message_response(message: str, context: str, is_received: bool = False,
+                              memory: Optional[str] = None, **options) -> Dict[str, Any]:
+    """get_ai_response for a message of any length: long ones are split, analyzed in parallel and merged"""
+    parts = split_long_message(message)
+    if len(parts) == 1:
+        return get_ai_response(message, context, is_received, memory=memory, **options)
     
-    return checks
+    options = session_request_options(**options)
+    options.setdefault("deadline", Deadline(get_setting("REQUEST_BUDGET_SECONDS", REQUEST_BUDGET_SECONDS)))
+    started = time.perf_counter()
+    
+    with trace_span("map", parts=len(parts)):
+        results = [None] * len(parts)
+        for index, result in analyze_message_parts(parts, context, is_received, memory, **options):
+            results[index] = result
+    failed = next((result for result in results if "error" in result), None)
+    if failed:
+        return failed
+    
+    # Rewrites are stitched locally; analyses need one short call to become a single reading
+    with trace_span("reduce", parts=len(parts), local=not is_received):
+        if is_received:
+            final = get_ai_response(build_long_message_summary(parts, results), context, True,
+                                    memory=memory, **options)
+            if "error" in final:
+                return final
+            final["original"] = message
+        else:
+            final = merge_rewrites(message, results)
+    
+    final.update({
+        "parts": len(parts),
+        "latency": round(time.perf_counter() - started, 2),
+        "usage": merge_usage(results + [final])
+    })
+    return final
 
 # =============================================
 # Session State Management
@@ -445,7 +3085,9 @@ def initialize_session_state():
         'api_key': st.secrets.get("OPENROUTER_API_KEY", ""),
         
         # Core data structures
-        'contacts': default_contacts,
+        'contacts': default_contacts,  # Loaded contacts only; see stored_contacts
+        'stored_contacts': {},  # name -> {'contact': JSON, 'journal': JSON}, parsed when selected
+        'contact_index': {name: contact_summary(contact) for name, contact in default_contacts.items()},
         'active_contact': get_default_contact_name('romantic'),  # Changed to My Partner ❤️
         'journal_entries': default_journals,
         'feedback_data': {},
@@ -458,8 +3100,15 @@ def initialize_session_state():
         },
         
         # UI state
-        'active_mode': None,  # 'coach' or 'translate'
+        'active_mode': None,  # 'coach', 'translate' or 'thread'
         'show_advanced': False,
+        'structured_output': True,
+        'model_mode': 'auto',
+        'last_response': None,
+        'use_memory': True,
+        'memory_jobs': {},
+        'token_usage': empty_usage(),
+        'autosave_enabled': False,
         'last_save_time': None
     }
     
@@ -470,11 +3119,62 @@ def initialize_session_state():
 
 def get_current_contact():
     """Get the currently active contact"""
+    ensure_contact_loaded(st.session_state.active_contact)
     return st.session_state.contacts[st.session_state.active_contact]
 
+def contact_summary(contact: dict) -> Dict[str, Any]:
+    """Directory entry for a contact: what the sidebar and stats need, without the history"""
+    history = contact.get('history', [])
+    return {
+        'context': contact.get('context', 'general'),
+        'total': len(history),
+        'coached': sum(1 for h in history if h.get('type') == 'coach'),
+        'translated': sum(1 for h in history if h.get('type') == 'translate'),
+        'last_active': history[-1].get('timestamp', '') if history else ''
+    }
+
+def ensure_contact_loaded(name: str):
+    """Parse a stored contact's history and journal the first time it is needed"""
+    stored = st.session_state.stored_contacts.pop(name, None)
+    if stored is None:
+        return
+    st.session_state.contacts[name] = json.loads(stored['contact'])
+    journal = json.loads(stored['journal']) if stored.get('journal') else None
+    st.session_state.journal_entries[name] = journal or {
+        'what_worked': '', 'what_didnt': '', 'insights': '', 'patterns': ''
+    }
+
+def stash_contacts(keep: str):
+    """Serialize every loaded contact but one, to be parsed again only when selected"""
+    for name in [n for n in st.session_state.contacts if n != keep]:
+        journal = st.session_state.journal_entries.pop(name, None)
+        st.session_state.stored_contacts[name] = {
+            'contact': json.dumps(st.session_state.contacts.pop(name), ensure_ascii=False),
+            'journal': json.dumps(journal, ensure_ascii=False) if journal else None
+        }
+
+def iter_all_contacts():
+    """(name, contact) for every contact; stored ones are parsed for the caller but stay unloaded"""
+    for name in st.session_state.contact_index:
+        if name in st.session_state.contacts:
+            yield name, st.session_state.contacts[name]
+        elif name in st.session_state.stored_contacts:
+            yield name, json.loads(st.session_state.stored_contacts[name]['contact'])
+
+def select_contact(name: str):
+    ensure_contact_loaded(name)
+    st.session_state.active_contact = name
+
+def search_contacts(query: str) -> List[str]:
+    """Contact names matching every word of the query by name or relationship, most recently active first"""
+    index = st.session_state.contact_index
+    words = query.lower().split()
+    names = [name for name, info in index.items() if all(w in f"{name} {info['context']}".lower() for w in words)]
+    return sorted(names, key=lambda name: index[name]['last_active'], reverse=True)
+
 def add_contact(name: str, context: str) -> bool:
     """Add a new contact to the system"""
-    if name in st.session_state.contacts:
+    if name in st.session_state.contact_index:
         return False
     
     st.session_state.contacts[name] = {
@@ -487,17 +3187,21 @@ def add_contact(name: str, context: str) -> bool:
         'insights': '',
         'patterns': ''
     }
+    st.session_state.contact_index[name] = contact_summary(st.session_state.contacts[name])
     st.session_state.active_contact = name
     return True
 
 def delete_contact(name: str) -> bool:
     """Delete a contact (except General)"""
-    if name == "General" or name not in st.session_state.contacts:
+    if name == "General" or name not in st.session_state.contact_index:
         return False
     
-    del st.session_state.contacts[name]
+    st.session_state.contacts.pop(name, None)
+    st.session_state.stored_contacts.pop(name, None)
+    del st.session_state.contact_index[name]
     if name in st.session_state.journal_entries:
         del st.session_state.journal_entries[name]
+    st.session_state.pop('rollups', None)
     
     # Switch to General if we deleted the active contact
     if st.session_state.active_contact == name:
@@ -507,8 +3211,16 @@ def delete_contact(name: str) -> bool:
 
 def add_history_entry(contact_name: str, entry: dict):
     """Add a history entry to a specific contact"""
+    ensure_contact_loaded(contact_name)
     if contact_name in st.session_state.contacts:
-        st.session_state.contacts[contact_name]['history'].append(entry)
+        with trace_span("add_history_entry", entry_type=entry.get('type')):
+            st.session_state.contacts[contact_name]['history'].append(entry)
+            summary = st.session_state.contact_index[contact_name]
+            summary['total'] += 1
+            summary['coached' if entry.get('type') == 'coach' else 'translated'] += 1
+            summary['last_active'] = entry.get('timestamp', summary['last_active'])
+            get_rollups().add_entry(contact_name, entry)
+            maybe_schedule_summary(contact_name)
 
 def update_user_stats(stat_type: str):
     """Update user statistics"""
@@ -517,20 +3229,24 @@ def update_user_stats(stat_type: str):
 
 def set_feedback(entry_id: str, feedback_type: str):
     """Set feedback for a specific entry"""
+    previous = st.session_state.feedback_data.get(entry_id)
     st.session_state.feedback_data[entry_id] = feedback_type
+    
+    if previous != feedback_type:
+        contact_name, entry = find_history_entry(entry_id)
+        if entry:
+            rollups = get_rollups()
+            if previous:
+                rollups.add_feedback(contact_name, entry, previous, -1)
+            rollups.add_feedback(contact_name, entry, feedback_type)
 
 def get_contact_stats(contact_name: str) -> dict:
-    """Get statistics for a specific contact"""
-    if contact_name not in st.session_state.contacts:
+    """Get statistics for a specific contact, from the directory index"""
+    summary = st.session_state.contact_index.get(contact_name)
+    if summary is None:
         return {'total': 0, 'coached': 0, 'translated': 0}
     
-    history = st.session_state.contacts[contact_name]['history']
-    
-    return {
-        'total': len(history),
-        'coached': sum(1 for h in history if h['type'] == 'coach'),
-        'translated': sum(1 for h in history if h['type'] == 'translate')
-    }
+    return {key: summary[key] for key in ('total', 'coached', 'translated')}
 
 def get_feedback_stats() -> dict:
     """Get overall feedback statistics"""
@@ -549,15 +3265,21 @@ def get_feedback_stats() -> dict:
 def clear_session_data():
     """Clear all session data (for fresh start)"""
     keys_to_clear = [
-        'contacts', 'active_contact', 'journal_entries',
+        'contacts', 'stored_contacts', 'contact_index', 'active_contact', 'journal_entries',
         'feedback_data', 'user_stats', 'active_mode',
-        'show_advanced', 'last_save_time'
+        'show_advanced', 'last_save_time', 'last_response', 'last_thread', 'rollups', 'history_table'
     ]
     
     for key in keys_to_clear:
         if key in st.session_state:
             del st.session_state[key]
     
+    # A fresh start also drops the autosaved copy, if this session ever had one;
+    # without one, touching the store would create it and put a workspace id in the URL
+    if 'workspace_id' in st.session_state:
+        get_autosave_store().forget(st.session_state.workspace_id)
+    st.session_state.autosave_fingerprints = {}
+    
     # Reinitialize with defaults
     initialize_session_state()
 
@@ -565,9 +3287,13 @@ def export_session_data() -> dict:
     """Export session data for saving"""
     import datetime
     
+    journals = {
+        name: json.loads(stored['journal'])
+        for name, stored in st.session_state.stored_contacts.items() if stored.get('journal')
+    }
     return {
-        'contacts': st.session_state.contacts,
-        'journal_entries': st.session_state.journal_entries,
+        'contacts': dict(iter_all_contacts()),
+        'journal_entries': {**journals, **st.session_state.journal_entries},
         'feedback_data': st.session_state.feedback_data,
         'user_stats': st.session_state.user_stats,
         'exported_at': datetime.datetime.now().isoformat(),
@@ -591,6 +3317,12 @@ def import_session_data(data: dict) -> bool:
                 'what_worked': '', 'what_didnt': '', 'insights': '', 'patterns': ''
             }
         })
+        backfill_sentiment(st.session_state.contacts)
+        st.session_state.contact_index = {
+            name: contact_summary(contact) for name, contact in st.session_state.contacts.items()
+        }
+        st.session_state.stored_contacts = {}
+        st.session_state.pop('rollups', None)
         st.session_state.feedback_data = data.get('feedback_data', {})
         st.session_state.user_stats = data.get('user_stats', {
             'total_messages': 0,
@@ -601,7 +3333,11 @@ def import_session_data(data: dict) -> bool:
         # Ensure active contact is valid
         if st.session_state.active_contact not in st.session_state.contacts:
             st.session_state.active_contact = get_default_contact_name('romantic')  # Changed to My Partner ❤️
+        if st.session_state.active_contact not in st.session_state.contacts:
+            st.session_state.active_contact = next(iter(st.session_state.contacts))
         
+        # Only the active contact stays parsed; the rest load when selected
+        stash_contacts(keep=st.session_state.active_contact)
         return True
         
     except Exception as e:
@@ -650,6 +3386,41 @@ def render_header():
             unsafe_allow_html=True
         )
 
+@st.fragment
+def render_contact_directory():
+    """Searchable, paged contact picker; typing reruns only this list"""
+    query = st.text_input("Search contacts", key="contact_search", type="search", live=True,
+                          placeholder="Name or relationship")
+    names = search_contacts(query)
+    pages = max(1, -(-len(names) // CONTACT_PAGE_SIZE))
+    
+    # Clamp before the widget exists, since a narrower search can leave the page out of range
+    if st.session_state.get("contact_page", 1) > pages:
+        st.session_state.contact_page = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, key="contact_page") if pages > 1 else 1
+    shown = names[(page - 1) * CONTACT_PAGE_SIZE:page * CONTACT_PAGE_SIZE]
+    
+    if shown:
+        active = st.session_state.active_contact
+        selected = st.radio(
+            "Active Contact:",
+            shown,
+            index=shown.index(active) if active in shown else None,
+            # A new widget whenever the active contact changes elsewhere (restore, import, delete),
+            # so a stale selection can't switch it back
+            key=f"contact_pick_{page}_{query}_{active}"
+        )
+        if selected and selected != active:
+            select_contact(selected)
+            st.rerun()
+        if active not in shown:
+            st.caption(f"Active: {active}")
+    else:
+        st.caption("No contacts match your search")
+    
+    total = len(st.session_state.contact_index)
+    st.caption(f"{len(names)} of {total} contacts" if query.strip() else f"{total} contacts, most recent first")
+
 def render_sidebar():
     """Render the sidebar with contact management and data controls"""
     st.sidebar.markdown("### 👥 Your Contacts")
@@ -671,14 +3442,8 @@ def render_sidebar():
                 st.error("Please enter a contact name.")
     
     # Contact selection
-    contact_names = list(st.session_state.contacts.keys())
-    if contact_names:
-        selected = st.sidebar.radio(
-            "Active Contact:", 
-            contact_names, 
-            index=contact_names.index(st.session_state.active_contact)
-        )
-        st.session_state.active_contact = selected
+    with st.sidebar:
+        render_contact_directory()
     
     # Contact info
     current_contact = get_current_contact()
@@ -699,18 +3464,48 @@ def render_sidebar():
                 st.rerun()
     
     st.sidebar.markdown("---")
+    
+    # Advanced settings
+    with st.sidebar.expander("⚙️ Advanced"):
+        st.session_state.structured_output = st.checkbox(
+            "🧩 Meaning, tone and reply in one call",
+            value=st.session_state.structured_output,
+            key="structured_output_toggle",
+            help="Ask the AI for a structured answer instead of free text"
+        )
+        st.session_state.use_memory = st.checkbox(
+            "🧠 Remember past conversations",
+            value=st.session_state.use_memory,
+            key="use_memory_toggle",
+            help="Share a short summary and the last few exchanges with the AI"
+        )
+        st.session_state.autosave_enabled = st.checkbox(
+            "💾 Autosave on this server",
+            value=st.session_state.autosave_enabled,
+            key="autosave_toggle",
+            help="Keep a copy of your contacts and journal so bookmarking this page restores them"
+        )
+        st.session_state.model_mode = st.radio(
+            "🤖 Model choice",
+            list(MODEL_MODES),
+            index=list(MODEL_MODES).index(st.session_state.model_mode),
+            format_func=MODEL_MODES.get,
+            key="model_mode_choice"
+        )
+    
     st.sidebar.markdown("### 💾 Data Management")
     
     # Data import
     uploaded_file = st.sidebar.file_uploader(
         "📤 Import Data", 
-        type="json", 
+        type=["json", "tvh"], 
         key="data_import"
     )
     
     if uploaded_file:
         try:
-            data = json.load(uploaded_file)
+            raw = uploaded_file.getvalue()
+            data = decode_history_file(raw) if is_history_file(raw) else json.loads(raw)
             if import_session_data(data):
                 st.sidebar.success("✅ Data imported successfully!")
                 st.rerun()
@@ -722,21 +3517,28 @@ def render_sidebar():
     # Data export
     if st.sidebar.button("💾 Export Data", key="data_export"):
         export_data = export_session_data()
-        filename = generate_filename()
         st.sidebar.download_button(
             "📥 Download Data",
             data=json.dumps(export_data, indent=2),
-            file_name=filename,
+            file_name=generate_filename(),
             mime="application/json",
             use_container_width=True
         )
+        st.sidebar.download_button(
+            "🗜️ Download Compact (.tvh)",
+            data=encode_history_file(export_data),
+            file_name=generate_filename(extension="tvh"),
+            mime="application/octet-stream",
+            help="Smaller and much faster to load for long histories",
+            use_container_width=True
+        )
 
 def render_main_interface():
     """Render the main communication interface"""
     st.markdown(f"### 💬 Communicating with: **{st.session_state.active_contact}**")
     
     # Mode selection buttons
-    col1, col2 = st.columns(2)
+    col1, col2, col3 = st.columns(3)
     
     with col1:
         if st.button(
@@ -757,6 +3559,16 @@ def render_main_interface():
         ):
             st.session_state.active_mode = "translate"
             st.rerun()
+    
+    with col3:
+        if st.button(
+            "🧵 Analyze a Conversation", 
+            type="primary", 
+            use_container_width=True,
+            key="thread_mode_btn"
+        ):
+            st.session_state.active_mode = "thread"
+            st.rerun()
 
 def render_message_processor():
     """Handle message input and AI processing"""
@@ -764,12 +3576,17 @@ def render_message_processor():
         return
     
     mode = st.session_state.active_mode
+    collect_memory_summaries()
     
     # Back button
     if st.button("← Back", key="back_btn"):
         st.session_state.active_mode = None
         st.rerun()
     
+    if mode == "thread":
+        render_thread_processor()
+        return
+    
     # Mode-specific UI
     input_class = "user-msg" if mode == "coach" else "contact-msg"
     title_text = "📤 Your message to send:" if mode == "coach" else "📥 Message you received:"
@@ -786,8 +3603,14 @@ def render_message_processor():
         height=120,
         key=f"{mode}_input",
         label_visibility="collapsed",
+        max_chars=MESSAGE_TOKEN_BUDGET * 4,
         placeholder=placeholder
     )
+    if estimate_tokens(message) > LONG_MESSAGE_CHUNK_TOKENS:
+        st.caption(
+            f"📄 Long message: about {estimate_tokens(message):,} tokens, "
+            f"read in {len(split_long_message(message))} parts at once"
+        )
     
     # Action buttons
     col1, col2 = st.columns([3, 1])
@@ -799,38 +3622,238 @@ def render_message_processor():
     with col2:
         if st.button("Clear", type="secondary", key="clear_btn"):
             st.session_state[f"{mode}_input"] = ""
+            st.session_state.last_response = None
             st.rerun()
     
-    # Process message
+    # Process message; the trace covers everything up to the rendered answer
     if process_btn and message.strip():
-        clean_message = sanitize_input(message.strip())
+        context = get_current_contact()['context']
+        with start_trace("process_message", mode=mode, context=context, chars=len(message)):
+            process_message(sanitize_input(message.strip()), mode)
+            render_last_response(mode)
+        return
+    
+    if process_btn:
+        st.warning("⚠️ Please enter a message first.")
+    render_last_response(mode)
+
+def process_message(clean_message: str, mode: str):
+    """Get the answer for one message and save it to the active contact"""
+    with st.spinner("🎙️ The Third Voice is analyzing..."):
+        current_contact = get_current_contact()
+        with trace_span("memory", enabled=st.session_state.use_memory):
+            memory = build_memory_context(current_contact) if st.session_state.use_memory else None
+        with trace_span("get_ai_response"), show_queue_position():
+            result = get_long_message_response(
+                clean_message, current_contact['context'], mode == "translate", memory=memory
+            )
+        annotate_span(model=result.get("model_id"), ok="error" not in result)
+        record_session_usage(result)
         
-        with st.spinner("🎙️ The Third Voice is analyzing..."):
-            current_contact = get_current_contact()
-            result = get_ai_response(clean_message, current_contact['context'], mode == "translate")
+        if "error" not in result:
+            # Create and save history entry
+            history_entry = create_history_entry(clean_message, result, mode)
+            add_history_entry(st.session_state.active_contact, history_entry)
+            update_user_stats(mode)
             
-            if "error" not in result:
-                render_ai_response(result, mode)
-                
-                # Create and save history entry
-                history_entry = create_history_entry(clean_message, result, mode)
-                add_history_entry(st.session_state.active_contact, history_entry)
-                update_user_stats(mode)
-                
-                # Feedback section
-                render_feedback_section(history_entry)
-                
-                st.success("✅ Saved to history")
-            else:
-                st.error(f"❌ {result['error']}")
+            st.session_state.last_response = {
+                "result": result,
+                "mode": mode,
+                "entry": history_entry
+            }
+            st.success("✅ Saved to history")
+        else:
+            st.error(f"❌ {result['error']}")
+
+@contextlib.contextmanager
+def show_queue_position():
+    """While a call waits for an upstream slot, show the user's place in line instead of just a spinner"""
+    status = st.empty()
     
-    elif process_btn:
-        st.warning("⚠️ Please enter a message first.")
+    def update(position: int, eta: float):
+        status.info(f"⏳ Busy right now: you're #{position + 1} in line, about {eta:.0f}s to go")
+    
+    token = admission_progress.set(update)
+    try:
+        yield
+    finally:
+        admission_progress.reset(token)
+        status.empty()
+
+def render_last_response(mode: str):
+    """Keep showing the latest answer so feedback clicks survive the rerun"""
+    last_response = st.session_state.get('last_response')
+    if last_response and last_response["mode"] == mode:
+        with trace_span("render"):
+            render_ai_response(last_response["result"], mode)
+            render_feedback_section(last_response["entry"])
+
+def render_thread_processor():
+    """Paste a conversation, analyze each of their messages in parallel, then suggest a reply"""
+    st.markdown(
+        '<div class="contact-msg"><strong>🧵 Paste the conversation:</strong> '
+        'one message per line, starting with who said it</div>', 
+        unsafe_allow_html=True
+    )
+    transcript = st.text_area(
+        "",
+        height=220,
+        key="thread_input",
+        label_visibility="collapsed",
+        max_chars=THREAD_MAX_CHARS,
+        placeholder="Alex: Are you coming tonight?\nMe: I'm not sure yet\nAlex: You always do this"
+    )
+    
+    messages = split_transcript(transcript)
+    speakers = list(dict.fromkeys(m["speaker"] for m in messages))
+    if len(speakers) < 2:
+        if transcript.strip():
+            st.warning('⚠️ I need at least two speakers, with lines like "Alex: message".')
+        render_last_thread()
+        return
+    
+    me = st.selectbox("Which one is you?", speakers, index=guess_self_speaker(speakers), key="thread_me")
+    received = [m for m in messages if m["speaker"] != me][-THREAD_MAX_MESSAGES:]
+    st.caption(f"{len(messages)} messages · {len(received)} of theirs will be analyzed")
+    
+    if st.button("🔍 Analyze Conversation", type="primary", key="thread_btn"):
+        context = get_current_contact()['context']
+        with start_trace("process_thread", context=context, messages=len(messages), received=len(received)):
+            process_thread(messages, received, me, transcript)
+        return
+    render_last_thread()
+
+def process_thread(messages: List[Dict[str, Any]], received: List[Dict[str, Any]], me: str, transcript: str):
+    """Stream each message's analysis as it finishes, then get the combined summary and reply"""
+    current_contact = get_current_contact()
+    options = {
+        "structured": True,
+        "model_mode": st.session_state.model_mode,
+        "api_key": st.session_state.api_key,
+        "session_tokens": st.session_state.token_usage['total_tokens']
+    }
+    
+    st.markdown("### 🎙️ Their messages, one by one:")
+    placeholders = []
+    for message in received:
+        placeholder = st.empty()
+        placeholder.markdown(
+            f'<div class="contact-msg">⏳ <strong>{message["speaker"]}:</strong> {message["text"]}</div>', 
+            unsafe_allow_html=True
+        )
+        placeholders.append(placeholder)
+    
+    results = [None] * len(received)
+    for position, result in analyze_thread_messages(messages, received, me, current_contact['context'], **options):
+        results[position] = result
+        record_session_usage(result)
+        render_thread_message(placeholders[position], received[position], result)
+    
+    with st.spinner("🎙️ Putting it all together..."):
+        memory = build_memory_context(current_contact) if st.session_state.use_memory else None
+        with trace_span("thread_summary"), show_queue_position():
+            final = get_ai_response(
+                build_thread_summary_message(messages, received, results, me),
+                current_contact['context'], True, memory=memory,
+                **{**options, "session_tokens": st.session_state.token_usage['total_tokens']}
+            )
+        record_session_usage(final)
+    
+    entry = None
+    if "error" not in final:
+        entry = create_history_entry(sanitize_input(transcript), final, "translate")
+        entry["thread_messages"] = len(messages)
+        add_history_entry(st.session_state.active_contact, entry)
+        update_user_stats("translate")
+        st.success("✅ Saved to history")
+    else:
+        st.error(f"❌ {final['error']}")
+    
+    st.session_state.last_thread = {"received": received, "results": results, "final": final, "entry": entry}
+    render_thread_summary(st.session_state.last_thread)
+
+def render_thread_message(container, message: Dict[str, Any], result: Dict[str, Any]):
+    """One received message with its meaning, in the placeholder reserved for it"""
+    if "error" in result:
+        container.markdown(
+            f'<div class="contact-msg">📥 <strong>{message["speaker"]}:</strong> {message["text"]}<br>'
+            f'<small>⚠️ {result["error"]}</small></div>', 
+            unsafe_allow_html=True
+        )
+        return
+    sentiment = result.get("sentiment", "neutral")
+    container.markdown(
+        f'<div class="{SENTIMENT_CLASSES.get(sentiment, "neu")}">📥 <strong>{message["speaker"]}:</strong> '
+        f'{message["text"]}<br>🔍 {result.get("meaning") or result.get("response", "")}<br>'
+        f'<small>Tone: {sentiment} · {result.get("model", "Unknown")} · {result.get("latency", "?")}s</small></div>', 
+        unsafe_allow_html=True
+    )
+
+def render_thread_summary(thread: Dict[str, Any]):
+    final = thread["final"]
+    if "error" in final:
+        return
+    st.markdown("### 🎙️ The Third Voice says:")
+    if final.get("structured"):
+        render_structured_insights(final, "translate")
+    st.markdown(
+        f'<div class="ai-response"><strong>💬 Suggested reply:</strong><br><br>'
+        f'{final.get("response", "")}<br><br>'
+        f'<small><i>Generated by: {final.get("model", "Unknown")}</i></small></div>', 
+        unsafe_allow_html=True
+    )
+    if thread["entry"]:
+        render_feedback_section(thread["entry"])
+
+def render_last_thread():
+    """Show the last analyzed conversation again after a rerun"""
+    thread = st.session_state.get('last_thread')
+    if not thread:
+        return
+    with trace_span("render"):
+        st.markdown("### 🎙️ Their messages, one by one:")
+        for message, result in zip(thread["received"], thread["results"]):
+            if result:
+                render_thread_message(st, message, result)
+        render_thread_summary(thread)
+
+def render_trace_waterfall(spans: List[Dict[str, Any]]):
+    """Horizontal bars for each span, offset by when it started"""
+    if not spans:
+        return
+    root = spans[0]
+    total_ms = max(root["duration_ms"] or 0, 1)
+    depth = {root["span_id"]: 0}
+    rows = []
+    
+    for span in sorted(spans, key=lambda item: item["start"]):
+        depth[span["span_id"]] = depth.get(span["parent_id"], -1) + 1
+        offset = (span["start"] - root["start"]) * 1000 / total_ms * 100
+        width = max((span["duration_ms"] or 0) / total_ms * 100, 0.5)
+        color = "#dc3545" if span["status"] == "error" else "#4CAF50"
+        details = ", ".join(f"{key}={value}" for key, value in span["attributes"].items()
+                            if key in ("model", "attempt", "upstream", "cache", "error"))
+        rows.append(
+            f'<div style="display:flex;align-items:center;font-size:0.8em;margin:2px 0">'
+            f'<div style="width:40%;padding-left:{depth[span["span_id"]]}em">'
+            f'{span["name"]} <small>{span["duration_ms"]} ms {details}</small></div>'
+            f'<div style="width:60%;position:relative;height:0.9em">'
+            f'<div style="position:absolute;left:{offset:.1f}%;width:{width:.1f}%;'
+            f'height:100%;background:{color};border-radius:2px"></div></div></div>'
+        )
+    
+    st.markdown("".join(rows), unsafe_allow_html=True)
 
 def render_ai_response(result: dict, mode: str):
     """Display AI response in formatted manner"""
     st.markdown("### 🎙️ The Third Voice says:")
     
+    if result.get("structured"):
+        render_structured_insights(result, mode)
+    
+    if result.get("cut_off"):
+        st.caption("✂️ This answer hit the length limit and may end abruptly.")
+    
     if mode == "coach":
         st.markdown(
             f'<div class="ai-response">'
@@ -840,6 +3863,15 @@ def render_ai_response(result: dict, mode: str):
             f'</div>', 
             unsafe_allow_html=True
         )
+    elif result.get("structured"):
+        st.markdown(
+            f'<div class="ai-response">'
+            f'<strong>💬 Suggested reply:</strong><br><br>'
+            f'{result.get("response", "")}<br><br>'
+            f'<small><i>Generated by: {result.get("model", "Unknown")}</i></small>'
+            f'</div>', 
+            unsafe_allow_html=True
+        )
     else:
         st.markdown(
             f'<div class="ai-response">'
@@ -850,6 +3882,21 @@ def render_ai_response(result: dict, mode: str):
             unsafe_allow_html=True
         )
 
+def render_structured_insights(result: dict, mode: str):
+    """Display meaning, sentiment and needs from a structured reply"""
+    sentiment = result.get("sentiment", "neutral")
+    meaning_label = "🔍 What they really mean" if mode == "translate" else "🔍 How it may land"
+    needs = ", ".join(result.get("needs", [])) or "—"
+    
+    st.markdown(
+        f'<div class="{SENTIMENT_CLASSES.get(sentiment, "neu")}">'
+        f'<strong>{meaning_label}:</strong> {result.get("meaning", "")}<br>'
+        f'<strong>💗 Needs:</strong> {needs}<br>'
+        f'<small>Tone: {sentiment}</small>'
+        f'</div>', 
+        unsafe_allow_html=True
+    )
+
 def render_feedback_section(history_entry: dict):
     """Render feedback collection interface"""
     st.markdown("### 📊 Was this helpful?")
@@ -864,11 +3911,19 @@ def render_feedback_section(history_entry: dict):
     for idx, (label, sentiment) in enumerate(feedback_options):
         with [col1, col2, col3][idx]:
             if st.button(label, key=f"feedback_{sentiment}_{history_entry['id']}"):
+                record_model_feedback(history_entry, sentiment)
                 set_feedback(history_entry['id'], sentiment)
                 st.success("Thanks for the feedback!")
 
 def render_history_tab():
     """Render the conversation history tab"""
+    if pa is not None:
+        view = st.radio("View", ["Cards", "Table"], horizontal=True, key="history_view",
+                        help="Table searches every contact at once")
+        if view == "Table":
+            render_history_table()
+            return
+    
     st.markdown(f"### 📜 History with {st.session_state.active_contact}")
     
     current_contact = get_current_contact()
@@ -907,18 +3962,75 @@ def render_history_tab():
                     f'<div class="contact-msg">📥 <strong>They said:</strong> {entry["original"]}</div>', 
                     unsafe_allow_html=True
                 )
+                if entry.get("meaning"):
+                    st.markdown(
+                        f'<div class="ai-response">🔍 <strong>Meaning:</strong> {entry["meaning"]}<br>'
+                        f'💗 <strong>Needs:</strong> {", ".join(entry.get("needs", [])) or "—"}</div>', 
+                        unsafe_allow_html=True
+                    )
+                result_label = "Suggested reply" if entry.get("meaning") else "Analysis"
                 st.markdown(
-                    f'<div class="ai-response">🎙️ <strong>Analysis:</strong> {entry["result"]}<br>'
+                    f'<div class="ai-response">🎙️ <strong>{result_label}:</strong> {entry["result"]}<br>'
                     f'<small><i>by {entry.get("model", "Unknown")}</i></small></div>', 
                     unsafe_allow_html=True
                 )
             
+            tone = entry.get("tone")
+            if tone:
+                sentiment = entry.get("sentiment", "neutral")
+                st.markdown(
+                    f'<div class="{SENTIMENT_CLASSES.get(sentiment, "neu")}"><small>'
+                    f'Tone: {sentiment} ({tone["original"]:+.2f}) → '
+                    f'{sentiment_label(tone["result"])} ({tone["result"]:+.2f})</small></div>', 
+                    unsafe_allow_html=True
+                )
+            
             # Show existing feedback
             feedback = st.session_state.feedback_data.get(entry.get('id'))
             if feedback:
                 emoji_map = {"positive": "👍", "neutral": "👌", "negative": "👎"}
                 st.markdown(f"*Your feedback: {emoji_map.get(feedback, '❓')}*")
 
+def render_history_table():
+    """Every contact's history in one filterable table"""
+    st.markdown("### 📜 All History")
+    table = get_history_table()
+    if len(table) == 0:
+        st.info("No messages yet. Use the buttons above to get started!")
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        contacts = st.multiselect("Contacts", list(st.session_state.contact_index),
+                                  default=[st.session_state.active_contact], key="table_contacts")
+        types = st.multiselect("Type", ["coach", "translate"], key="table_types",
+                               format_func=lambda t: "Coached" if t == "coach" else "Understood")
+    with col2:
+        models = st.multiselect("Model", pc.unique(table["model"]).to_pylist(), key="table_models")
+        feedback = st.multiselect("Feedback", ["positive", "neutral", "negative", "unrated"], key="table_feedback")
+    with col3:
+        oldest = pc.min(table["time"]).as_py().date()
+        dates = st.date_input("Dates", value=(oldest, datetime.date.today()), key="table_dates")
+    
+    since = until = None
+    if isinstance(dates, tuple) and len(dates) == 2:
+        since = datetime.datetime.combine(dates[0], datetime.time.min)
+        until = datetime.datetime.combine(dates[1], datetime.time.min) + datetime.timedelta(days=1)
+    
+    filtered = filter_history_table(table, contacts, types, models, since, until, feedback)
+    st.caption(f"{len(filtered):,} of {len(table):,} entries")
+    st.dataframe(filtered.select(HISTORY_TABLE_COLUMNS), use_container_width=True, hide_index=True)
+    
+    if len(filtered):
+        st.dataframe(summarize_history_table(filtered), use_container_width=True, hide_index=True)
+        st.download_button(
+            "📥 Download these rows (.arrow)",
+            data=history_table_to_feather(filtered),
+            file_name=generate_filename("third_voice_history", "arrow"),
+            mime="application/vnd.apache.arrow.file",
+            key="table_download"
+        )
+
 def render_journal_tab():
     """Render the communication journal tab"""
     st.markdown(f"### 📘 Communication Journal - {st.session_state.active_contact}")
@@ -1010,15 +4122,21 @@ def render_stats_tab():
                 unsafe_allow_html=True
             )
     
+    render_trends()
+    
     # Stats by contact
     st.markdown("### 👥 By Contact")
-    for name, contact in st.session_state.contacts.items():
-        contact_stats = get_contact_stats(name)
-        if contact_stats['total'] > 0:
-            st.markdown(
-                f"**{name}:** {contact_stats['total']} total "
-                f"({contact_stats['coached']} coached, {contact_stats['translated']} understood)"
-            )
+    active_contacts = sorted(
+        ((name, info) for name, info in st.session_state.contact_index.items() if info['total'] > 0),
+        key=lambda item: item[1]['total'], reverse=True
+    )
+    for name, contact_stats in active_contacts[:CONTACT_PAGE_SIZE]:
+        st.markdown(
+            f"**{name}:** {contact_stats['total']} total "
+            f"({contact_stats['coached']} coached, {contact_stats['translated']} understood)"
+        )
+    if len(active_contacts) > CONTACT_PAGE_SIZE:
+        st.caption(f"…and {len(active_contacts) - CONTACT_PAGE_SIZE} more")
     
     # Feedback summary
     feedback_stats = get_feedback_stats()
@@ -1029,6 +4147,131 @@ def render_stats_tab():
             f"👌 Neutral: {feedback_stats['neutral']} | "
             f"👎 Negative: {feedback_stats['negative']}"
         )
+    
+    render_token_usage()
+    render_output_length()
+    
+    # What the adaptive model choice has learned so far
+    bandit = get_feedback_bandit()
+    bandit_rows = bandit.stats()
+    if bandit_rows:
+        st.markdown("### 🎯 Model Learning")
+        st.markdown(
+            f"Exploration: {bandit.exploration_rate():.0%} of recent choices "
+            f"(capped at {BANDIT_MAX_EXPLORATION:.0%})"
+        )
+        for row in bandit_rows:
+            st.markdown(
+                f"**{row['context']} · {row['model']}:** score {row['score']} "
+                f"from {row['ratings']} ratings, used {row['pulls']} times"
+            )
+
+def render_trends():
+    """Volume, tone, latency and feedback over time, read from the rollups"""
+    rollups = get_rollups()
+    st.markdown("### 📈 Trends")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        granularity = st.radio(
+            "Per", list(ROLLUP_BUCKET_DAYS), horizontal=True, key="trend_granularity",
+            format_func=lambda g: "Day" if g == "day" else "Week"
+        )
+    with col2:
+        scope_label = st.selectbox("Show", ["All contacts", st.session_state.active_contact], key="trend_scope")
+    scope = "*" if scope_label == "All contacts" else scope_label
+    
+    volume = rollups.chart(granularity, scope, "type")
+    if not volume["series"]:
+        st.info("Trends appear once you have some history.")
+        return
+    
+    index = ROLLUP_METRICS.index
+    type_labels = {"coach": "Coached", "translate": "Understood"}
+    st.markdown("**Messages**")
+    st.bar_chart({
+        "date": volume["labels"],
+        **{type_labels.get(name, name): rows[:, index("messages")] for name, rows in volume["series"].items()}
+    }, x="date")
+    
+    overall = rollups.chart(granularity, scope, "all")["series"][""]
+    messages = overall[:, index("messages")]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tone = np.where(messages > 0, overall[:, index("tone_sum")] / messages, np.nan)
+    st.markdown("**Average tone** (−1 negative … +1 positive)")
+    st.line_chart({"date": volume["labels"], "tone": tone}, x="date")
+    
+    models = rollups.chart(granularity, scope, "model")
+    latencies = {}
+    for name, rows in models["series"].items():
+        counts = rows[:, index("latency_count")]
+        if counts.any():
+            with np.errstate(invalid="ignore", divide="ignore"):
+                latencies[name] = np.where(counts > 0, rows[:, index("latency_sum")] / counts, np.nan)
+    if latencies:
+        st.markdown("**Average response time by model** (seconds)")
+        st.line_chart({"date": models["labels"], **latencies}, x="date")
+    
+    feedback = rollups.chart(granularity, scope, "feedback")
+    if any(rows[:, index("messages")].any() for rows in feedback["series"].values()):
+        st.markdown("**Feedback**")
+        st.bar_chart({
+            "date": feedback["labels"],
+            **{name: rows[:, index("messages")] for name, rows in feedback["series"].items()}
+        }, x="date")
+
+def render_token_usage():
+    """Token totals for this session and the server, against their budgets"""
+    usage = st.session_state.token_usage
+    ledger = get_token_ledger()
+    st.markdown("### 🪙 Token Usage")
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("This session", f"{usage['total_tokens']:,}", f"{usage['calls']} calls", delta_color="off")
+    col2.metric("Cost units", f"{usage['cost']:.1f}", help="Thousands of tokens × model cost weight")
+    col3.metric("All sessions, last hour", f"{ledger.last_hour():,}")
+    
+    session_budget = get_setting("SESSION_TOKEN_BUDGET", SESSION_TOKEN_BUDGET)
+    if session_budget:
+        share = min(1.0, usage['total_tokens'] / session_budget)
+        st.progress(share, text=f"Session budget: {share:.0%} of {session_budget:,} tokens")
+    hourly_budget = get_setting("GLOBAL_TOKENS_PER_HOUR", GLOBAL_TOKENS_PER_HOUR)
+    if hourly_budget:
+        share = min(1.0, ledger.last_hour() / hourly_budget)
+        st.progress(share, text=f"Hourly server budget: {share:.0%} of {hourly_budget:,} tokens")
+    
+    for label, group in (("model", "by_model"), ("context", "by_context")):
+        if usage[group]:
+            st.markdown(f"**By {label}:** " + " · ".join(
+                f"{format_model_name(name) if group == 'by_model' else name}: "
+                f"{bucket['total_tokens']:,} tokens in {bucket['calls']} calls"
+                for name, bucket in sorted(usage[group].items(), key=lambda item: -item[1]['total_tokens'])
+            ))
+
+def render_output_length():
+    """How well answer sizing works: truncation, continuations and time saved against the fixed budget"""
+    report = get_output_length_stats().report()
+    adaptive, fixed = report["adaptive"], report["fixed"]
+    if not adaptive["answers"]:
+        return
+    st.markdown("### 📏 Answer Length")
+    
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Hit max_tokens", f"{adaptive['truncation_rate']:.0%}",
+                f"{adaptive['continuations']} continued", delta_color="off")
+    col2.metric("Still cut off", f"{adaptive['cut_off_rate']:.0%}")
+    if report["saved_seconds"] is None:
+        col3.metric("Time saved", "—", help="Needs answers from the fixed-budget baseline to compare against")
+    else:
+        col3.metric("Time saved", f"{report['saved_seconds']:.0f}s",
+                    f"{fixed['avg_latency'] - adaptive['avg_latency']:+.1f}s per answer", delta_color="off")
+    
+    for label, group in (("Adaptive", adaptive), (f"Fixed {DEFAULT_MAX_TOKENS}", fixed)):
+        if group["answers"]:
+            st.caption(
+                f"{label}: {group['answers']} answer{'s' if group['answers'] != 1 else ''} · asked for {group['avg_max_tokens']:.0f} tokens, "
+                f"got {group['avg_completion_tokens']:.0f} on average · {group['avg_latency']:.1f}s"
+            )
 
 def render_about_tab():
     """Render the about/help tab"""
@@ -1052,7 +4295,7 @@ def render_about_tab():
     - 💾 Export/import your data
     - 🔒 Privacy-first design
     
-    **Privacy First:** All data stays on your device. Save and load your own files.
+    **Privacy First:** Your data is yours. Save and load your own files; autosave keeps a copy on the app server for this page's link and can be turned off under ⚙️ Advanced.
     
     **Beta v1.0.0** — Built with ❤️ to heal relationships through better communication.
     
@@ -1076,18 +4319,150 @@ def render_tabs():
     """Render all application tabs"""
     tab1, tab2, tab3, tab4 = st.tabs(["📜 History", "📘 Journal", "📊 Stats", "ℹ️ About"])
     
-    with tab1:
+    with tab1, profile_stage("render_history_tab"):
         render_history_tab()
     
-    with tab2:
+    with tab2, profile_stage("render_journal_tab"):
         render_journal_tab()
     
-    with tab3:
+    with tab3, profile_stage("render_stats_tab"):
         render_stats_tab()
     
-    with tab4:
+    with tab4, profile_stage("render_about_tab"):
         render_about_tab()
 
+# =============================================
+# Rerun Profiler
+# =============================================
+
+class RerunProfiler:
+    """Per-session timings of each render step, plus an optional cProfile of one slow rerun"""
+    
+    def __init__(self, window: int):
+        self.window = window
+        self.samples = {}
+        self.last_rerun = {}
+        self.started = None
+        self.armed = False
+        self.threshold_ms = PROFILE_SLOW_MS
+        self.profile = None
+        self.capture = None
+    
+    def record(self, name: str, ms: float):
+        self.samples.setdefault(name, collections.deque(maxlen=self.window)).append(ms)
+        self.last_rerun[name] = round(ms, 1)
+    
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+    
+    def start_rerun(self):
+        self.last_rerun = {}
+        self.started = time.perf_counter()
+        if self.armed:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is already active in this process
+                self.profile = None
+    
+    def finish_rerun(self):
+        total_ms = (time.perf_counter() - self.started) * 1000
+        self.record("rerun", total_ms)
+        if self.profile is None:
+            return
+        
+        self.profile.disable()
+        if total_ms >= self.threshold_ms:
+            self.profile.create_stats()
+            report = io.StringIO()
+            pstats.Stats(self.profile, stream=report).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            self.capture = {
+                "captured_at": datetime.datetime.now().strftime('%H:%M:%S'),
+                "total_ms": round(total_ms, 1),
+                "stages": dict(self.last_rerun),
+                "report": report.getvalue(),
+                "prof": marshal.dumps(self.profile.stats)  # Same bytes as Profile.dump_stats
+            }
+            self.armed = False
+        self.profile = None
+    
+    def percentiles(self) -> List[Dict[str, Any]]:
+        """One row per stage, slowest p95 first"""
+        rows = []
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            pick = lambda pct: round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 1)
+            rows.append({
+                "stage": name,
+                "last_ms": self.last_rerun.get(name),
+                "p50_ms": pick(50),
+                "p95_ms": pick(95),
+                "max_ms": round(ordered[-1], 1),
+                "reruns": len(ordered)
+            })
+        return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
+
+def get_rerun_profiler() -> Optional[RerunProfiler]:
+    """This session's profiler; None unless DEBUG is on"""
+    if not get_setting("DEBUG", False):
+        return None
+    if 'rerun_profiler' not in st.session_state:
+        st.session_state.rerun_profiler = RerunProfiler(PROFILE_WINDOW)
+    return st.session_state.rerun_profiler
+
+def profile_stage(name: str):
+    """Time a block of the rerun when profiling is on"""
+    profiler = get_rerun_profiler()
+    return profiler.stage(name) if profiler else contextlib.nullcontext()
+
+@contextlib.contextmanager
+def profile_rerun(profiler: Optional[RerunProfiler]):
+    """Time the whole rerun, even when it ends early with st.rerun or st.stop"""
+    if profiler is None:
+        yield
+        return
+    profiler.start_rerun()
+    try:
+        yield
+    finally:
+        profiler.finish_rerun()
+
+def render_profiler_panel(profiler: RerunProfiler):
+    """Rolling render timings and the slow-rerun capture, inside the debug expander"""
+    st.markdown("**🐢 Rerun profile**")
+    st.table(profiler.percentiles())
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        profiler.threshold_ms = st.number_input(
+            "Slow rerun threshold (ms)", min_value=0, value=int(profiler.threshold_ms),
+            step=100, key="profile_threshold"
+        )
+    with col2:
+        if st.button("🎯 Capture next slow rerun", key="profile_arm",
+                     help="Runs cProfile until a rerun exceeds the threshold"):
+            profiler.armed = True
+        if profiler.armed:
+            st.caption("Waiting for a rerun slower than the threshold...")
+    
+    if profiler.capture:
+        capture = profiler.capture
+        st.caption(f"Captured at {capture['captured_at']}: {capture['total_ms']} ms · {capture['stages']}")
+        st.download_button(
+            "📥 Download cProfile (.prof)",
+            data=capture["prof"],
+            file_name=generate_filename("third_voice_rerun", "prof"),
+            mime="application/octet-stream",
+            key="profile_download"
+        )
+        st.code(capture["report"], language=None)
+
 # =============================================
 # Main Application
 # =============================================
@@ -1107,26 +4482,54 @@ def main():
     
     # Initialize session state
     initialize_session_state()
+    restore_session()
     
-    # Authenticate user
-    authenticate_user()
+    # Upstream calls from this run (and its worker threads) queue fairly under this session
+    admission_owner.set(get_script_run_ctx().session_id)
     
-    # Render main interface
-    render_header()
-    render_sidebar()
-    render_main_interface()
-    render_message_processor()
-    render_tabs()
+    profiler = get_rerun_profiler()
+    with profile_rerun(profiler):
+        # Authenticate user
+        authenticate_user()
+        
+        # Render main interface
+        for render in (render_header, render_sidebar, render_main_interface,
+                       render_message_processor, render_tabs):
+            with profile_stage(render.__name__):
+                render()
+        
+        # Queue changed data for the background writer
+        autosave_session()
     
     # Health check in development
-    if st.secrets.get("DEBUG", False):
+    if profiler:
         with st.expander("🔧 Debug Info"):
             st.json({
                 "session_state_keys": list(st.session_state.keys()),
                 "active_contact": st.session_state.get('active_contact'),
                 "active_mode": st.session_state.get('active_mode'),
-                "health_check": health_check()
+                "health_check": health_check(),
+                "classifier_benchmark": benchmark_classifier(rounds=200),
+                "model_latency": get_latency_tracker().snapshot(),
+                "routing_log": list(st.session_state.get('routing_log', [])),
+                "autosave": dict(get_autosave_store().stats),
+                "token_ledger": get_token_ledger().snapshot(),
+                "admission": get_admission_controller().snapshot()
             })
+            
+            traces = list(st.session_state.get('traces', []))
+            if traces:
+                st.markdown("**⏱️ Request waterfall**")
+                labels = [
+                    f"{time.strftime('%H:%M:%S', time.localtime(spans[0]['start']))} · "
+                    f"{spans[0]['name']} · {spans[0]['duration_ms']} ms"
+                    for spans in traces
+                ]
+                choice = st.selectbox("Trace", range(len(traces)), index=len(traces) - 1,
+                                      format_func=labels.__getitem__, key="trace_choice")
+                render_trace_waterfall(traces[choice])
+            
+            render_profiler_panel(profiler)
 
 if __name__ == "__main__":
     main()
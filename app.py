@@ -9,6 +9,32 @@ import requests
 import json
 from datetime import datetime
 import base64
+import time
+import uuid
+import threading
+import re
+import random
+import math
+import sys
+import importlib.util
+from pathlib import Path
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# ===== Shared Code =====
+CORE_PATH = Path(__file__).with_name("app.backup.py")
+
+def load_core():
+    """Import app.backup.py as a module without running its UI, for helpers both apps share"""
+    spec = importlib.util.spec_from_file_location("third_voice_app", CORE_PATH)
+    if spec.name in sys.modules:
+        return sys.modules[spec.name]
+    core = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = core
+    spec.loader.exec_module(core)
+    return core
+
+core = load_core()
 
 # ===== Configuration =====
 API_URL = "https://openrouter.ai/api/v1/chat/completions"
@@ -33,34 +59,104 @@ AI_MODELS = [
     }
 ]
 
+# "quick" templates answer trivial messages locally; {kind} is filled from QUICK_KINDS
 CONTEXTS = {
     "general": {
         "color": "#5D9BFF", 
         "icon": "💙",
-        "description": "Everyday conversations and general communication"
+        "description": "Everyday conversations and general communication",
+        "quick": {
+            "analyze": "This is {kind}, meant just as it reads. There's nothing underneath to decode, so a short, friendly reply (or none) is all it needs.",
+            "improve": "This is {kind} and it already works: clear, short and friendly. Send it as it is."
+        }
     },
     "romantic": {
         "color": "#FF7EB9", 
         "icon": "❤️",
-        "description": "Personal relationships and intimate conversations"
+        "description": "Personal relationships and intimate conversations",
+        "quick": {
+            "analyze": "This is {kind}. Short messages between partners are usually just that, so there's no need to read into it. A warm reply or a ❤️ keeps the connection going.",
+            "improve": "This is {kind} and it's fine as it is. If you want it to feel warmer, add a heart or a word of affection."
+        }
     },
     "workplace": {
         "color": "#6EE7B7", 
         "icon": "💼",
-        "description": "Professional communication and work-related messages"
+        "description": "Professional communication and work-related messages",
+        "quick": {
+            "analyze": "This is {kind}, a normal part of working together. No concern is being raised, and nothing needs a reply unless something is still open.",
+            "improve": "This is {kind} and it reads as professional. Send it as it is, or add a detail (a time, a next step) if one is pending."
+        }
     },
     "family": {
         "color": "#FFB347", 
         "icon": "👨‍👩‍👧‍👦",
-        "description": "Family conversations and sensitive discussions"
+        "description": "Family conversations and sensitive discussions",
+        "quick": {
+            "analyze": "This is {kind}. Everyday family messages like this one are simply keeping in touch, and a short, kind reply is plenty.",
+            "improve": "This is {kind} and it's kind and clear. Send it as it is."
+        }
     },
     "coparenting": {
         "color": "#9B59B6", 
         "icon": "👶",
-        "description": "Co-parenting communication focused on child welfare"
+        "description": "Co-parenting communication focused on child welfare",
+        "quick": {
+            "analyze": "This is {kind}. Short, neutral messages like this are what keeps co-parenting calm, and it needs nothing more than an equally brief, neutral reply.",
+            "improve": "This is {kind}: brief, neutral and child-focused, exactly the right tone for co-parenting. Send it as it is."
+        }
     }
 }
 
+# Trivial messages answered from the templates above instead of a model call
+QUICK_ANSWER_MODEL = "local/quick-answer"
+QUICK_MAX_WORDS = 6
+# Patterns match the whole message, and any tail is a fixed allow-list: a free word after
+# "thanks" or "see you" is how "thanks loser" and "see you in court" would slip through
+QUICK_WHEN = (r"(soon|later|then|tomorrow|tonight|today|"
+              r"(at|around|by) \d{1,2}(:\d{2})? ?(am|pm)?|(on )?(monday|tuesday|wednesday|thursday|friday|saturday|sunday)|"
+              r"at (pickup|drop ?off|school|home|lunch|dinner))")
+QUICK_KINDS = {
+    "a thank-you": r"(thanks|thank you|thx|ty|cheers|many thanks)( so much| again)?"
+                   r"( for (everything|your help|the help|today|tonight|dinner|lunch|the ride|the update))?",
+    "a simple acknowledgement": r"(ok|okay|got it|sounds good|cool|great|perfect|noted|will do|sure thing|yes|yep|yeah|"
+                                r"no problem|np|all good|on my way|omw)",
+    "a friendly greeting": r"(hi|hey|hello|good (morning|afternoon|evening|night)|morning)( there)?",
+    "a practical note about plans": rf"(see you|see ya|cya|talk (to you )?(soon|later|tomorrow)|ttyl|be there|meet you)( {QUICK_WHEN})?"
+}
+# Only reactions that can't read as anger, hurt or mockery; anything else goes to a model
+QUICK_EMOJI = {"👍", "👌", "🙏", "🙂", "😊", "😀", "😄", "🤗", "👋", "❤️", "❤", "💙", "💕", "🥰", "😘", "🎉", "✅"}
+QUICK_EMOJI_PATTERN = "(" + "|".join(sorted(map(re.escape, QUICK_EMOJI), key=len, reverse=True)) + ")+"
+# Words that turn an otherwise trivial message into one worth a real look ("thanks for nothing", "hey idiot")
+QUICK_RISK_WORDS = {"nothing", "idiot", "jerk", "stupid", "loser", "whatever", "fine", "seriously", "never", "always",
+                    "hate", "sorry", "late", "not", "stop", "ugh", "court", "lawyer", "forever"}
+
+# Background jobs: upstream calls run off the script thread so reruns never lose them
+JOB_WORKERS = 8  # A comparison holds one worker per model
+JOB_TIMEOUT_SECONDS = 60
+REQUEST_BUDGET_SECONDS = JOB_TIMEOUT_SECONDS - 5  # One answer, parts and continuations included, ends before its job times out
+CONNECT_TIMEOUT_SECONDS = 3.05
+MIN_READ_TIMEOUT_SECONDS = 2.0
+JOB_RETENTION_SECONDS = 600
+JOB_POLL_SECONDS = 1.0
+
+# Long messages: a token budget instead of a character cap; long ones are read in parts at once
+MESSAGE_TOKEN_BUDGET = core.MESSAGE_TOKEN_BUDGET
+PART_WORKERS = 8  # Separate from the job pool, whose workers wait on these
+# Parts of a message at the full budget (cuts on boundaries leave some parts short, hence the margin)
+MAX_MESSAGE_PARTS = math.ceil(MESSAGE_TOKEN_BUDGET / core.LONG_MESSAGE_CHUNK_TOKENS) + 2
+
+# Answer length: max_tokens and a word limit sized to the message, continued if cut off
+FIXED_MAX_TOKENS = 800  # The old one-size budget, kept for a small baseline share of answers
+OUTPUT_BASE_TOKENS = {"analyze": 150, "improve": 60}
+OUTPUT_TOKENS_PER_INPUT_TOKEN = {"analyze": 0.5, "improve": 1.3}  # A rewrite runs about as long as the original
+OUTPUT_CONTEXT_SCALE = {"coparenting": 1.2, "romantic": 1.2, "family": 1.1, "workplace": 0.9}
+OUTPUT_MIN_TOKENS = 200
+OUTPUT_MAX_TOKENS = 2000
+OUTPUT_MAX_CONTINUATIONS = 2
+LENGTH_HOLDOUT_SHARE = 0.05
+CONTINUE_PROMPT = "You were cut off. Continue exactly where you stopped, without repeating anything."
+
 # ===== Mobile-First UI Setup =====
 st.set_page_config(
     page_title="Third Voice - Message Helper",
@@ -193,22 +289,31 @@ def init_state():
         'message_history': [],
         'current_result': None,
         'current_action': None,
-        'processing': False,  # Add processing state
-        'last_processed_message': None  # Track last processed message
+        'processing': False,  # Derived from active_job_id on every run
+        'last_processed_message': None,  # Track last processed message
+        'current_meta': None,  # Model, tokens and latency behind current_result
+        'active_job_id': st.query_params.get("job"),  # Survives reruns and page reloads
+        'job_notice': None,
+        'compare_mode': False,
+        'compare_job_ids': [j for j in st.query_params.get("compare", "").split(",") if j],
+        'compare_results': None,
+        'model_wins': {},  # Model id -> times picked as the best answer in compare mode
+        'quick_answers': 0  # Upstream calls avoided by answering trivial messages locally
     }
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
 
 # ===== History Management =====
-def add_to_history(original, result, action, context, model):
+def add_to_history(original, result, action, context, model, **extra):
     item = {
         'timestamp': datetime.now().isoformat(),
         'original': original,
         'result': result,
         'action': action,
         'context': context,
-        'model': model
+        'model': model,
+        **extra
     }
     st.session_state.message_history.insert(0, item)
     if len(st.session_state.message_history) > 50:
@@ -262,86 +367,545 @@ def get_system_prompt(action, context):
     }
     return prompts[action].get(context, prompts[action]['general'])
 
-def call_api(message, action, context, model_id):
+def plan_output_tokens(message, action, context):
+    """max_tokens for one answer, from the message length, the action and the context"""
+    tokens = OUTPUT_BASE_TOKENS[action] + OUTPUT_TOKENS_PER_INPUT_TOKEN[action] * core.estimate_tokens(message)
+    tokens *= OUTPUT_CONTEXT_SCALE.get(context, 1.0)
+    return int(min(OUTPUT_MAX_TOKENS, max(OUTPUT_MIN_TOKENS, tokens)))
+
+def call_api(message, action, context, model_id, deadline=None):
+    """Returns ({'content', 'usage', 'latency', ...}, None) on success or (None, error); all calls end by deadline (monotonic)"""
+    deadline = deadline or time.monotonic() + REQUEST_BUDGET_SECONDS
+    adaptive = random.random() >= LENGTH_HOLDOUT_SHARE
+    max_tokens = plan_output_tokens(message, action, context) if adaptive else FIXED_MAX_TOKENS
+    system_prompt = get_system_prompt(action, context)
+    if adaptive:
+        words = max(40, int(max_tokens * 0.6) // 10 * 10)  # ~0.75 words per token, with headroom
+        system_prompt += f" Keep your whole answer under {words} words."
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Context: {context.capitalize()}\nMessage: {message}"}
+    ]
+    
     try:
-        response = requests.post(
-            API_URL,
-            headers={
-                "Authorization": f"Bearer {API_KEY}",
-                "HTTP-Referer": "https://third-voice.streamlit.app",
-                "Content-Type": "application/json"
-            },
-            json={
-                "model": model_id,
-                "messages": [
-                    {"role": "system", "content": get_system_prompt(action, context)},
-                    {"role": "user", "content": f"Context: {context.capitalize()}\nMessage: {message}"}
-                ],
-                "max_tokens": 800,
-                "temperature": 0.7
-            },
-            timeout=30
-        )
+        started = time.monotonic()
+        content, usages, finishes = "", [], []
+        # Ask the model to go on while it stops at max_tokens
+        for _ in range(OUTPUT_MAX_CONTINUATIONS + 1):
+            if content:
+                turn = messages + [{"role": "assistant", "content": content}, {"role": "user", "content": CONTINUE_PROMPT}]
+            else:
+                turn = messages
+            read_timeout = deadline - time.monotonic() - CONNECT_TIMEOUT_SECONDS
+            if read_timeout < MIN_READ_TIMEOUT_SECONDS:
+                if content:
+                    break  # Out of time: keep the part we already have
+                return None, "Request timed out. Please try again."
+            try:
+                response = requests.post(
+                    API_URL,
+                    headers={
+                        "Authorization": f"Bearer {API_KEY}",
+                        "HTTP-Referer": "https://third-voice.streamlit.app",
+                        "Content-Type": "application/json"
+                    },
+                    json={
+                        "model": model_id,
+                        "messages": turn,
+                        "max_tokens": max_tokens,
+                        "temperature": 0.7
+                    },
+                    timeout=(CONNECT_TIMEOUT_SECONDS, read_timeout)
+                )
+            except requests.exceptions.RequestException:
+                if content:
+                    break
+                raise
+            if response.status_code != 200:
+                if content:
+                    break  # Keep the part we already have
+                return None, f"API Error: {response.status_code}"
+            
+            data = response.json()
+            choice = data["choices"][0]
+            content += choice["message"]["content"]
+            usages.append(data.get("usage") or {})
+            finishes.append(choice.get("finish_reason"))
+            if finishes[-1] != "length":
+                break
         
-        if response.status_code == 200:
-            return response.json()["choices"][0]["message"]["content"], None
-        else:
-            return None, f"API Error: {response.status_code}"
+        reply = {
+            'content': content,
+            'usage': {key: sum(u.get(key, 0) for u in usages)
+                      for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')},
+            'latency': round(time.monotonic() - started, 2),
+            'max_tokens': max_tokens,
+            'continuations': len(finishes) - 1,
+            'cut_off': finishes[-1] == "length"
+        }
+        get_length_stats().record("adaptive" if adaptive else "fixed", reply, truncated=finishes[0] == "length")
+        return reply, None
             
     except requests.exceptions.Timeout:
         return None, "Request timed out. Please try again."
     except Exception as e:
         return None, f"Error: {str(e)}"
 
+class LengthStats:
+    """Answer lengths and latency for adaptive and fixed max_tokens, to report what adaptive sizing saves"""
+    
+    def __init__(self):
+        self.groups = {"adaptive": Counter(), "fixed": Counter()}
+        self.lock = threading.Lock()
+    
+    def record(self, group, reply, truncated):
+        with self.lock:
+            self.groups[group].update({
+                'answers': 1,
+                'max_tokens': reply['max_tokens'],
+                'completion_tokens': reply['usage']['completion_tokens'],
+                'latency': reply['latency'],
+                'truncated': int(truncated),
+                'continuations': reply['continuations'],
+                'cut_off': int(reply['cut_off'])
+            })
+    
+    def report(self):
+        with self.lock:
+            groups = {name: dict(counts) for name, counts in self.groups.items()}
+        report = {}
+        for name, counts in groups.items():
+            answers = counts.get('answers', 0)
+            report[name] = {'answers': answers}
+            if answers:
+                report[name].update({
+                    'avg_max_tokens': counts['max_tokens'] / answers,
+                    'avg_completion_tokens': counts['completion_tokens'] / answers,
+                    'avg_latency': counts['latency'] / answers,
+                    'truncation_rate': counts['truncated'] / answers,
+                    'continuations': counts['continuations'],
+                    'cut_off_rate': counts['cut_off'] / answers
+                })
+        
+        adaptive, fixed = report['adaptive'], report['fixed']
+        report['saved_seconds'] = None
+        if adaptive['answers'] and fixed['answers']:
+            report['saved_seconds'] = (fixed['avg_latency'] - adaptive['avg_latency']) * adaptive['answers']
+        return report
+
+@st.cache_resource
+def get_length_stats():
+    return LengthStats()
+
+def quick_answer_kind(message):
+    """QUICK_KINDS label for a trivial, low-risk message, or None when it deserves a model"""
+    text = message.strip()
+    if not text or "?" in text or len(text.split()) > QUICK_MAX_WORDS:
+        return None
+    # Skin tones and variation selectors don't change the meaning
+    bare = re.sub(r"[\U0001F3FB-\U0001F3FF\uFE0F]", "", text)
+    if not any(ch.isalnum() for ch in text):
+        return "an emoji reaction" if re.fullmatch(QUICK_EMOJI_PATTERN, re.sub(r"\s", "", bare)) else None
+    # Words don't vouch for the emoji beside them: "ok 😡" is not an acknowledgement
+    if re.search(r"[^\w\s.,!'’:;-]", re.sub(QUICK_EMOJI_PATTERN, " ", bare)):
+        return None
+    words = " ".join(re.sub(r"[^\w\s:']+", " ", text.lower()).split())
+    if QUICK_RISK_WORDS & set(words.split()):
+        return None
+    for kind, pattern in QUICK_KINDS.items():
+        if re.fullmatch(pattern, words):
+            return kind
+    return None
+
+def format_reply_stats(usage, latency):
+    parts = []
+    if latency is not None:
+        parts.append(f"⏱️ {latency:.1f}s")
+    if usage and usage.get('total_tokens'):
+        parts.append(f"🔢 {usage['total_tokens']} tokens")
+    return " · ".join(parts)
+
+@st.cache_resource
+def get_part_executor():
+    return ThreadPoolExecutor(max_workers=PART_WORKERS, thread_name_prefix="third-voice-part")
+
+class PartSlots:
+    """Counts part calls queued or running, so comparisons of long messages can't pile up without bound"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
+    
+    def reserve(self, count, timeout):
+        """Wait up to timeout for room; returns the slots taken (0 on timeout), at most the whole limit"""
+        count = min(count, self.limit)
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.in_flight + count <= self.limit, timeout):
+                return 0
+            self.in_flight += count
+            return count
+    
+    def release(self, count):
+        with self.condition:
+            self.in_flight -= count
+            self.condition.notify_all()
+
+@st.cache_resource
+def get_part_slots():
+    # A full comparison of the longest message, plus one more long message queued behind it
+    return PartSlots((len(AI_MODELS) + 1) * MAX_MESSAGE_PARTS)
+
+def call_api_long(message, action, context, model_id):
+    """call_api for messages of any length: parts run in parallel, then merge into one answer"""
+    parts = core.split_long_message(message)
+    if len(parts) == 1:
+        return call_api(message, action, context, model_id)
+    
+    # All parts or none: a half-admitted message would only hold slots while it waits
+    deadline = time.monotonic() + REQUEST_BUDGET_SECONDS
+    slots = get_part_slots()
+    reserved = slots.reserve(len(parts), timeout=deadline - time.monotonic() - MIN_READ_TIMEOUT_SECONDS)
+    if not reserved:
+        return None, "Too many long messages are being read right now. Please try again in a moment."
+    
+    started = time.monotonic()
+    labeled = [f"(Part {i + 1} of {len(parts)} of one long message)\n{part}" for i, part in enumerate(parts)]
+    try:
+        answers = list(get_part_executor().map(
+            lambda part: call_api(part, action, context, model_id, deadline), labeled
+        ))
+    finally:
+        slots.release(reserved)
+    error = next((error for _, error in answers if error), None)
+    if error:
+        return None, error
+    replies = [reply for reply, _ in answers]
+    
+    # Rewrites were cut on paragraph boundaries and join back in order; analyses need one short merge call
+    if action == "improve":
+        content = "\n\n".join(reply['content'] for reply in replies)
+    else:
+        analyses = "\n\n".join(f"Part {i + 1}:\n{reply['content']}" for i, reply in enumerate(replies))
+        summary, error = call_api(
+            f"These are analyses of the {len(parts)} consecutive parts of one long message. "
+            f"Combine them into one coherent analysis of the whole message.\n\n{analyses}",
+            action, context, model_id, deadline
+        )
+        if error:
+            return None, error
+        replies.append(summary)
+        content = summary['content']
+    
+    usage = {key: sum(reply['usage'].get(key, 0) for reply in replies)
+             for key in ('prompt_tokens', 'completion_tokens', 'total_tokens')}
+    return {
+        'content': content,
+        'usage': usage,
+        'latency': round(time.monotonic() - started, 2),
+        'cut_off': any(reply.get('cut_off') for reply in replies),
+        'parts': len(parts)
+    }, None
+
 def get_model_name(model_id):
+    if model_id == QUICK_ANSWER_MODEL:
+        return "⚡ Quick answer"
     for model in AI_MODELS:
         if model["id"] == model_id:
             return model["name"]
     return model_id
 
-# ===== Processing Functions =====
-def process_message(user_input, action):
-    """Process message with proper state management"""
-    if st.session_state.processing:
-        return False
+# ===== Background Jobs =====
+class JobManager:
+    """Runs upstream calls on worker threads, keyed by job id, with timeouts and retention"""
     
-    # Set processing state
-    st.session_state.processing = True
-    st.session_state.last_processed_message = user_input
+    def __init__(self, workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="third-voice-job")
+        self.jobs = {}
+        self.lock = threading.Lock()
     
-    # Get selected model info
-    selected_model = next((m for m in AI_MODELS if m["id"] == st.session_state.selected_model), AI_MODELS[0])
+    def submit(self, fn, *args, **meta):
+        job_id = uuid.uuid4().hex[:12]
+        with self.lock:
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': 'running',
+                'meta': meta,
+                'created': time.time(),
+                'finished': None,
+                'result': None,
+                'error': None
+            }
+        self.executor.submit(self._run, job_id, fn, args)
+        return job_id
     
-    with st.spinner(f"🤔 {selected_model['name']} is {action}ing..."):
-        result, error = call_api(
-            user_input, 
-            action, 
-            st.session_state.selected_context, 
-            st.session_state.selected_model
-        )
+    def _run(self, job_id, fn, args):
+        try:
+            result, error = fn(*args)
+        except Exception as e:
+            result, error = None, f"Error: {str(e)}"
+        
+        with self.lock:
+            job = self.jobs.get(job_id)
+            # A cancelled or timed-out job keeps its status; the late result is dropped
+            if job and job['status'] == 'running':
+                job['status'] = 'failed' if error else 'done'
+                job['result'] = result
+                job['error'] = error
+                job['finished'] = time.time()
     
-    # Reset processing state
-    st.session_state.processing = False
+    def get(self, job_id):
+        self.purge()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job['status'] == 'running' and time.time() - job['created'] > JOB_TIMEOUT_SECONDS:
+                job['status'] = 'timed_out'
+                job['finished'] = time.time()
+            return dict(job) if job else None
     
-    if error:
-        st.error(f"❌ {error}")
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job['status'] == 'running':
+                job['status'] = 'cancelled'
+                job['finished'] = time.time()
+    
+    def purge(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self.lock:
+            for job_id in [j for j, job in self.jobs.items() if job['finished'] and job['finished'] < cutoff]:
+                del self.jobs[job_id]
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
+
+def clear_active_job():
+    st.session_state.active_job_id = None
+    st.query_params.pop("job", None)
+
+def collect_job_result():
+    """Move a finished job's result into the session; returns True while a job is still running"""
+    job_id = st.session_state.active_job_id
+    if not job_id:
+        return False
+    
+    job = get_job_manager().get(job_id)
+    if job is None:
+        clear_active_job()
         return False
+    if job['status'] == 'running':
+        return True
+    
+    clear_active_job()
+    meta = job['meta']
+    if job['status'] == 'done':
+        reply = job['result']
+        st.session_state.current_result = reply['content']
+        st.session_state.current_action = meta['action']
+        st.session_state.current_meta = {
+            'model': meta['model'], 'usage': reply['usage'], 'latency': reply['latency'], 'cut_off': reply.get('cut_off')
+        }
+        add_to_history(meta['original'], reply['content'], meta['action'], meta['context'], meta['model'],
+                       tokens=reply['usage'])
     else:
-        st.session_state.current_result = result
-        st.session_state.current_action = action
-        add_to_history(
-            user_input, 
-            result, 
-            action, 
-            st.session_state.selected_context, 
-            st.session_state.selected_model
+        level = "info" if job['status'] == 'cancelled' else "error"
+        st.session_state.job_notice = (level, job_failure_text(job))
+    return False
+
+def job_failure_text(job):
+    if job['status'] == 'failed':
+        return f"❌ {job['error']}"
+    if job['status'] == 'timed_out':
+        return f"⏱️ No answer after {JOB_TIMEOUT_SECONDS} seconds. Please try again."
+    return "🛑 Request cancelled."
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_job_status():
+    """Poll the active job without rerunning the whole page until it finishes"""
+    job_id = st.session_state.active_job_id
+    job = get_job_manager().get(job_id) if job_id else None
+    if job is None or job['status'] != 'running':
+        st.rerun()
+    
+    model_name = get_model_name(job['meta']['model'])
+    elapsed = int(time.time() - job['created'])
+    verb = "analyzing" if job['meta']['action'] == "analyze" else "improving"
+    st.info(f"🤔 {model_name} is {verb} your message... ({elapsed}s)")
+    
+    if st.button("🛑 Cancel", key="cancel_job_btn", use_container_width=True):
+        get_job_manager().cancel(job_id)
+        st.rerun()
+
+# ===== Model Comparison =====
+def clear_compare_jobs():
+    st.session_state.compare_job_ids = []
+    st.query_params.pop("compare", None)
+
+def compare_answer(job):
+    """One model's side of a comparison, whatever state its job is in"""
+    reply = job['result'] if job['status'] == 'done' else None
+    return {
+        'model': job['meta']['model'],
+        'status': job['status'],
+        'content': reply['content'] if reply else None,
+        'usage': reply['usage'] if reply else {},
+        'latency': reply['latency'] if reply else None,
+        'elapsed': int(time.time() - job['created']),
+        'failure': None if reply or job['status'] == 'running' else job_failure_text(job)
+    }
+
+def get_compare_jobs():
+    manager = get_job_manager()
+    return [job for job in (manager.get(job_id) for job_id in st.session_state.compare_job_ids) if job]
+
+def collect_compare_results():
+    """Move a finished comparison into the session; returns True while any model is still answering"""
+    if not st.session_state.compare_job_ids:
+        return False
+    
+    jobs = get_compare_jobs()
+    if any(job['status'] == 'running' for job in jobs):
+        return True
+    
+    clear_compare_jobs()
+    if jobs:
+        meta = jobs[0]['meta']
+        st.session_state.compare_results = {
+            'original': meta['original'],
+            'action': meta['action'],
+            'context': meta['context'],
+            'answers': [compare_answer(job) for job in jobs]
+        }
+    return False
+
+def pick_compare_winner(index):
+    """Keep the chosen answer as the current result and record the pick as feedback"""
+    comparison = st.session_state.compare_results
+    winner = comparison['answers'][index]
+    others = [a['model'] for a in comparison['answers'] if a is not winner and a['status'] == 'done']
+    
+    wins = st.session_state.model_wins
+    wins[winner['model']] = wins.get(winner['model'], 0) + 1
+    add_to_history(comparison['original'], winner['content'], comparison['action'], comparison['context'],
+                   winner['model'], tokens=winner['usage'], picked_over=others)
+    
+    st.session_state.current_result = winner['content']
+    st.session_state.current_action = comparison['action']
+    st.session_state.current_meta = {'model': winner['model'], 'usage': winner['usage'], 'latency': winner['latency']}
+    st.session_state.compare_results = None
+
+def render_compare_answer(answer, index=None):
+    """One column of the comparison; index enables the pick button once every model has answered"""
+    st.markdown(f"**🧠 {get_model_name(answer['model'])}**")
+    if answer['status'] == 'running':
+        st.caption(f"⏳ Thinking... ({answer['elapsed']}s)")
+        return
+    if answer['failure']:
+        st.error(answer['failure'])
+        return
+    
+    st.caption(format_reply_stats(answer['usage'], answer['latency']))
+    st.markdown(f"""
+    <div class="selectable-text">
+        {answer['content']}
+    </div>
+    """, unsafe_allow_html=True)
+    if index is not None and st.button("🏆 Pick this one", key=f"pick_{index}", use_container_width=True):
+        pick_compare_winner(index)
+        st.rerun()
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def render_compare_status():
+    """Fill in each model's column as its answer arrives"""
+    jobs = get_compare_jobs()
+    if not any(job['status'] == 'running' for job in jobs):
+        st.rerun()
+    
+    done = sum(job['status'] != 'running' for job in jobs)
+    st.info(f"⚖️ Comparing {len(jobs)} models... {done}/{len(jobs)} answered")
+    for column, job in zip(st.columns(len(jobs)), jobs):
+        with column:
+            render_compare_answer(compare_answer(job))
+    
+    if st.button("🛑 Cancel", key="cancel_compare_btn", use_container_width=True):
+        for job in jobs:
+            get_job_manager().cancel(job['id'])
+        st.rerun()
+
+def render_compare_results():
+    comparison = st.session_state.compare_results
+    action_title = "Message Analysis" if comparison['action'] == "analyze" else "Improved Response"
+    st.markdown(f"### ⚖️ {action_title}: pick the best answer")
+    
+    answers = comparison['answers']
+    for index, (column, answer) in enumerate(zip(st.columns(len(answers)), answers)):
+        with column:
+            render_compare_answer(answer, index)
+    
+    if st.button("🔄 Dismiss Comparison", use_container_width=True):
+        st.session_state.compare_results = None
+        st.rerun()
+
+def start_comparison(user_input, action, context):
+    """Send the message to every model at once; total wait is the slowest model, not the sum"""
+    manager = get_job_manager()
+    job_ids = [
+        manager.submit(
+            call_api_long, user_input, action, context, model["id"],
+            original=user_input, action=action, context=context, model=model["id"]
         )
+        for model in AI_MODELS
+    ]
+    st.session_state.compare_job_ids = job_ids
+    st.session_state.compare_results = None
+    st.query_params["compare"] = ",".join(job_ids)
+    return True
+
+# ===== Processing Functions =====
+def answer_quickly(user_input, action, context, kind):
+    """Answer a trivial message from the context's template, with no upstream call"""
+    result = CONTEXTS[context]["quick"][action].format(kind=kind)
+    st.session_state.current_result = result
+    st.session_state.current_action = action
+    st.session_state.current_meta = {'model': QUICK_ANSWER_MODEL, 'usage': {}, 'latency': 0.0, 'quick': True}
+    st.session_state.quick_answers += 1
+    add_to_history(user_input, result, action, context, QUICK_ANSWER_MODEL)
+
+def process_message(user_input, action, force_full=False):
+    """Start processing a message as a background job, or one job per model in compare mode"""
+    if st.session_state.active_job_id or st.session_state.compare_job_ids:
+        return False
+    
+    st.session_state.last_processed_message = user_input
+    if force_full and (st.session_state.current_meta or {}).get('quick'):
+        # The quick answer didn't save a call after all
+        st.session_state.quick_answers = max(0, st.session_state.quick_answers - 1)
+    context = st.session_state.selected_context
+    model = st.session_state.selected_model
+    if st.session_state.compare_mode:
+        return start_comparison(user_input, action, context)
+    
+    kind = None if force_full else quick_answer_kind(user_input)
+    if kind:
+        answer_quickly(user_input, action, context, kind)
         return True
+    
+    job_id = get_job_manager().submit(
+        call_api_long, user_input, action, context, model,
+        original=user_input, action=action, context=context, model=model
+    )
+    st.session_state.active_job_id = job_id
+    st.query_params["job"] = job_id
+    return True
 
 # ===== Main App =====
 def main():
     init_state()
     apply_mobile_styles()
+    job_running = collect_job_result()
+    compare_running = collect_compare_results()
+    st.session_state.processing = job_running or compare_running
     
     # Header
     st.markdown("""
@@ -375,6 +939,17 @@ def main():
     </div>
     """, unsafe_allow_html=True)
     
+    st.toggle(
+        "⚖️ Compare all models",
+        key="compare_mode",
+        disabled=st.session_state.processing,
+        help="Send your message to every model at once and pick the best answer"
+    )
+    if st.session_state.model_wins:
+        picks = ", ".join(f"{get_model_name(m)} ×{n}" for m, n in
+                          sorted(st.session_state.model_wins.items(), key=lambda kv: -kv[1]))
+        st.caption(f"🏆 Your picks so far: {picks}")
+    
     # Context Selection - Mobile Optimized
     st.markdown("### 🎯 Choose your context:")
     
@@ -410,12 +985,13 @@ def main():
         disabled=st.session_state.processing
     )
     
-    # Character counter
-    char_count = len(user_input)
-    counter_class = "error" if char_count > 2000 else "warning" if char_count > 1500 else ""
+    # Token counter
+    token_count = core.estimate_tokens(user_input) if user_input else 0
+    counter_class = "error" if token_count > MESSAGE_TOKEN_BUDGET else "warning" if token_count > core.LONG_MESSAGE_CHUNK_TOKENS else ""
+    part_note = f" · read in {len(core.split_long_message(user_input))} parts at once" if counter_class == "warning" else ""
     st.markdown(f"""
     <div class="char-counter {counter_class}">
-        {char_count}/2000 characters
+        ~{token_count:,}/{MESSAGE_TOKEN_BUDGET:,} tokens{part_note}
     </div>
     """, unsafe_allow_html=True)
     
@@ -423,7 +999,7 @@ def main():
     st.markdown("### 🚀 Choose action:")
     
     # Check if we have valid input and not currently processing
-    has_valid_input = user_input.strip() and char_count <= 2000 and not st.session_state.processing
+    has_valid_input = user_input.strip() and token_count <= MESSAGE_TOKEN_BUDGET and not st.session_state.processing
     
     col1, col2 = st.columns(2)
     
@@ -452,11 +1028,28 @@ def main():
                 process_message(user_input, "improve")
                 st.rerun()
     
+    # Job progress, or what happened to the last one
+    if st.session_state.processing:
+        if st.session_state.compare_job_ids:
+            render_compare_status()
+        else:
+            render_job_status()
+    elif st.session_state.job_notice:
+        level, notice = st.session_state.job_notice
+        st.session_state.job_notice = None
+        if level == "error":
+            st.error(notice)
+        else:
+            st.info(notice)
+    
     # Show warning if no valid input
     if not user_input.strip() and not st.session_state.processing:
         st.info("💡 Enter a message above to analyze or improve it.")
-    elif char_count > 2000:
-        st.warning("⚠️ Message too long. Please keep it under 2000 characters.")
+    elif token_count > MESSAGE_TOKEN_BUDGET:
+        st.warning(f"⚠️ Message too long. Please keep it under about {MESSAGE_TOKEN_BUDGET * 4:,} characters.")
+    
+    if st.session_state.compare_results and not st.session_state.processing:
+        render_compare_results()
     
     # Display current result if exists
     if st.session_state.current_result and st.session_state.current_action:
@@ -467,14 +1060,30 @@ def main():
         result_class = "analysis-result" if action == "analyze" else "improvement-result"
         action_icon = "🔍" if action == "analyze" else "✨"
         action_title = "Message Analysis" if action == "analyze" else "Improved Response"
+        meta = st.session_state.current_meta or {'model': selected_model['id'], 'usage': {}, 'latency': None}
+        result_model = get_model_name(meta['model'])
+        result_stats = format_reply_stats(meta['usage'], meta['latency'])
+        result_stats = f"· {result_stats}" if result_stats else ""
         
         st.markdown(f"""
         <div class="result-container {result_class}">
             <h4 style="margin-top: 0; color: #1f2937;">{action_icon} {action_title}</h4>
-            <div style="font-size: 12px; color: #6b7280; margin-bottom: 12px;">Generated by: {selected_model['name']}</div>
+            <div style="font-size: 12px; color: #6b7280; margin-bottom: 12px;">Generated by: {result_model} {result_stats}</div>
             <div style="line-height: 1.6; color: #374151;">{result}</div>
         </div>
         """, unsafe_allow_html=True)
+        if meta.get('cut_off'):
+            st.caption("✂️ This answer hit the length limit and may end abruptly.")
+        if meta.get('quick'):
+            avoided = st.session_state.quick_answers
+            st.caption(
+                f"⚡ Quick answer: simple messages like this one are answered instantly, without the AI "
+                f"({avoided} AI call{'s' if avoided != 1 else ''} avoided this session)."
+            )
+            if st.button("🧠 Get Full AI Analysis", use_container_width=True, key="force_full_btn",
+                         disabled=st.session_state.processing):
+                process_message(st.session_state.last_processed_message, action, force_full=True)
+                st.rerun()
         
         # Mobile-optimized selectable text
         st.markdown("### 📱 Tap to select and copy:")
@@ -487,6 +1096,7 @@ def main():
         if st.button("🔄 Clear Result", use_container_width=True):
             st.session_state.current_result = None
             st.session_state.current_action = None
+            st.session_state.current_meta = None
             st.rerun()
     
     # History Management Section
@@ -534,6 +1144,10 @@ def main():
                 context_info = CONTEXTS[item['context']]
                 timestamp = datetime.fromisoformat(item['timestamp']).strftime("%m/%d %H:%M")
                 model_name = get_model_name(item.get('model', 'Unknown'))
+                if item.get('picked_over'):
+                    model_name += f" 🏆 over {len(item['picked_over'])}"
+                if (item.get('tokens') or {}).get('total_tokens'):
+                    model_name += f" · 🔢 {item['tokens']['total_tokens']}"
                 
                 st.markdown(f"""
                 <div style="border: 1px solid #e5e7eb; border-radius: 8px; padding: 12px; margin: 8px 0; background: #f9fafb;">
@@ -549,11 +1163,28 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
     
+    # How adaptive answer length is doing, across everyone using this server
+    length_report = get_length_stats().report()
+    if length_report['adaptive']['answers']:
+        with st.expander("📏 Answer Length", expanded=False):
+            adaptive, fixed = length_report['adaptive'], length_report['fixed']
+            saved = length_report['saved_seconds']
+            if saved is None:
+                saved_text = "— (no fixed-budget answers to compare against yet)"
+            else:
+                saved_text = f"{saved:.0f}s ({fixed['avg_latency'] - adaptive['avg_latency']:+.1f}s per answer)"
+            st.markdown(f"""
+            - Hit max_tokens: **{adaptive['truncation_rate']:.0%}** of answers ({adaptive['continuations']} continued automatically)
+            - Still cut off after continuing: **{adaptive['cut_off_rate']:.0%}**
+            - Asked for {adaptive['avg_max_tokens']:.0f} tokens instead of {FIXED_MAX_TOKENS}, got {adaptive['avg_completion_tokens']:.0f} on average
+            - Time saved against the fixed budget: **{saved_text}**
+            """)
+    
     # Footer
     st.markdown("---")
     st.markdown("""
     <div style="text-align: center; color: #6b7280; font-size: 14px; padding: 20px 0;">
-        💡 <strong>Tip:</strong> Try different AI models to see which works best for your communication style!<br>
+        💡 <strong>Tip:</strong> Turn on ⚖️ Compare all models to see which works best for your communication style!<br>
         Analyze their message first to understand their emotions, then improve your response for better connection.
     </div>
     """, unsafe_allow_html=True)
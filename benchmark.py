@@ -0,0 +1,466 @@
+"""
+The Third Voice AI - Benchmarks
+Measure the pieces of app.backup.py that affect how fast users get an answer.
+
+Usage:
+    python benchmark.py classifier
+    OPENROUTER_API_KEY=... python benchmark.py router --corpus benchmark_corpus.jsonl
+    OPENROUTER_API_KEY=... python benchmark.py --record traces.jsonl.gz router
+    python benchmark.py --replay traces.jsonl.gz --latency-scale 0.5 router
+    LOCAL_MODEL_PATH=model.gguf python benchmark.py local
+    python benchmark.py api --requests 200 --concurrency 16
+    python benchmark.py history --contacts 20 --entries 2000
+    python benchmark.py sentiment --entries 50000
+    python benchmark.py table --contacts 20 --entries 5000
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Any, List
+
+import requests
+
+APP_PATH = Path(__file__).with_name("app.backup.py")
+
+def load_app():
+    """Import app.backup.py as a module without running the Streamlit UI"""
+    # Bare-mode imports warn about the missing script context on every call
+    from streamlit import logger as st_logger
+    st_logger.set_log_level("error")
+    
+    spec = importlib.util.spec_from_file_location("third_voice_app", APP_PATH)
+    if spec.name in sys.modules:
+        return sys.modules[spec.name]
+    app = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = app
+    spec.loader.exec_module(app)
+    return app
+
+def load_corpus(path: str) -> List[Dict[str, Any]]:
+    """Read one request per line: message, context and optional is_received"""
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Latency and quality summary for one strategy"""
+    latencies = [run["seconds"] for run in runs if run["ok"]]
+    high_stakes = [run for run in runs if run["ok"] and run["needs_strong"]]
+    
+    return {
+        "requests": len(runs),
+        "errors": sum(1 for run in runs if not run["ok"]),
+        "p50_s": round(percentile(latencies, 50), 2),
+        "p95_s": round(percentile(latencies, 95), 2),
+        "mean_s": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        # Quality proxies: the answer parsed as structured output, and
+        # high-stakes messages were answered by a strong-tier model
+        "structured_rate": round(
+            sum(1 for run in runs if run["structured"]) / max(1, len(latencies)), 2
+        ),
+        "strong_coverage": round(
+            sum(1 for run in high_stakes if run["tier"] == "strong") / max(1, len(high_stakes)), 2
+        ),
+        "models": dict(collections.Counter(run["model"] for run in runs if run["ok"]))
+    }
+
+def bench_classifier(args):
+    """Microseconds per message for the precompiled classifier"""
+    app = load_app()
+    messages = [item["message"] for item in load_corpus(args.corpus)] if args.corpus else None
+    print(json.dumps(app.benchmark_classifier(messages, rounds=args.rounds), indent=2))
+
+def bench_router(args):
+    """Compare automatic routing against the fixed model order on a corpus"""
+    app = load_app()
+    api_key = os.environ.get("OPENROUTER_API_KEY", "")
+    if os.environ.get("UPSTREAM_MODE") == "replay":
+        api_key = api_key or "replay"
+    if not api_key:
+        sys.exit("Set OPENROUTER_API_KEY, or pass --replay CASSETTE, to run the router benchmark")
+    
+    corpus = load_corpus(args.corpus)
+    runs = {"fixed": [], "auto": []}
+    
+    for index, item in enumerate(corpus):
+        # Alternate which strategy goes first so warm caches don't favour one
+        order = ["fixed", "auto"] if index % 2 == 0 else ["auto", "fixed"]
+        message_type = app.detect_message_type(item["message"])
+        needs_strong = app.needs_strong_model(item["message"], item["context"], message_type)
+        
+        for strategy in order:
+            started = time.perf_counter()
+            result = app.get_ai_response(
+                item["message"], item["context"], item.get("is_received", False),
+                structured=True, model_mode=strategy, api_key=api_key
+            )
+            ok = "error" not in result
+            model_id = result.get("model_id", "")
+            runs[strategy].append({
+                "ok": ok,
+                "seconds": time.perf_counter() - started,
+                "model": result.get("model", "failed"),
+                "tier": app.MODEL_PROFILES.get(model_id, {}).get("tier"),
+                "structured": bool(result.get("structured")),
+                "needs_strong": needs_strong is not None
+            })
+    
+    print(json.dumps({strategy: summarize(items) for strategy, items in runs.items()}, indent=2))
+
+def time_completion(provider, model: str, messages: list, api_key: str) -> Dict[str, Any]:
+    """One completion with its latency and generated tokens"""
+    started = time.perf_counter()
+    try:
+        data = provider.complete(model, messages, api_key, max_tokens=300, timeout=(3.05, 60))
+    except Exception as e:
+        return {"ok": False, "seconds": time.perf_counter() - started, "error": str(e)}
+    
+    return {
+        "ok": True,
+        "seconds": time.perf_counter() - started,
+        "tokens": data.get("usage", {}).get("completion_tokens", 0)
+    }
+
+def summarize_completions(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Latency percentiles and generation speed for one model"""
+    ok_runs = [run for run in runs if run["ok"]]
+    latencies = [run["seconds"] for run in ok_runs]
+    seconds = sum(latencies)
+    
+    return {
+        "requests": len(runs),
+        "errors": len(runs) - len(ok_runs),
+        "p50_s": round(percentile(latencies, 50), 2),
+        "p95_s": round(percentile(latencies, 95), 2),
+        "tokens_per_s": round(sum(run["tokens"] for run in ok_runs) / seconds, 1) if seconds else 0.0
+    }
+
+def bench_local(args):
+    """Local CPU model against each remote model on the same prompts"""
+    app = load_app()
+    api_key = os.environ.get("OPENROUTER_API_KEY", "")
+    local = app.get_local_provider()
+    if not local.available():
+        sys.exit("Set LOCAL_MODEL_PATH to a GGUF file and install llama-cpp-python")
+    
+    corpus = load_corpus(args.corpus)
+    prompts = [
+        app.create_message_payload(item["message"], item["context"], item.get("is_received", False))
+        for item in corpus
+    ]
+    
+    targets = [(app.LOCAL_MODEL_ID, local)]
+    if api_key:
+        targets += [(model, app.OPENROUTER_PROVIDER) for model in app.AI_MODELS]
+    
+    report = {}
+    for model, provider in targets:
+        runs = [time_completion(provider, model, messages, api_key) for messages in prompts]
+        report[model] = summarize_completions(runs)
+    
+    # Throughput when everything is queued at once; the single worker serves requests in turn
+    started = time.perf_counter()
+    futures = [local.submit(messages, max_tokens=300) for messages in prompts]
+    completed = [future.result() for future in futures]
+    elapsed = time.perf_counter() - started
+    report["local_queued"] = {
+        "requests": len(completed),
+        "seconds": round(elapsed, 2),
+        "requests_per_s": round(len(completed) / elapsed, 2)
+    }
+    
+    print(json.dumps(report, indent=2))
+
+class CannedUpstream:
+    """Stand-in for OpenRouter with a fixed delay, so only serving overhead is compared"""
+    
+    body = {
+        "choices": [{"message": {"content": json.dumps({
+            "meaning": "They want to feel heard.", "sentiment": "neutral",
+            "needs": ["reassurance"], "reply": "Thanks for telling me, let's talk tonight."
+        })}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": 40, "total_tokens": 160}
+    }
+    
+    def __init__(self, delay: float):
+        self.delay = delay
+    
+    def __call__(self, *args, **kwargs):
+        time.sleep(self.delay)
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = json.dumps(self.body).encode()
+        return response
+
+def bench_api(args):
+    """Requests per second through api.py vs a full Streamlit script run per request"""
+    from unittest import mock
+    import threading
+    import urllib.request
+    import uvicorn
+    from streamlit.testing.v1 import AppTest
+    
+    os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+    os.environ.setdefault("API_TOKENS", "benchmark")
+    messages = [item["message"] for item in load_corpus(args.corpus)]
+    upstream = mock.patch("requests.post", CannedUpstream(args.upstream_latency))
+    
+    with upstream:
+        import api
+        server = uvicorn.Server(uvicorn.Config(api.app, port=args.port, log_level="error", access_log=False))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        
+        def call_api(index: int):
+            body = json.dumps({"message": messages[index % len(messages)], "context": "general"}).encode()
+            request = urllib.request.Request(
+                f"http://127.0.0.1:{args.port}/v1/analyze", data=body,
+                headers={"Content-Type": "application/json",
+                         "Authorization": f"Bearer {os.environ['API_TOKENS'].split(',')[0]}"}
+            )
+            with urllib.request.urlopen(request) as response:
+                response.read()
+        
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(call_api, range(args.requests)))
+        api_seconds = time.perf_counter() - started
+        server.should_exit = True
+        
+        # The Streamlit path reruns the whole script for every click
+        streamlit_runs = max(1, args.requests // 5)
+        app_test = AppTest.from_file(str(APP_PATH), default_timeout=60)
+        app_test.secrets["OPENROUTER_API_KEY"] = os.environ["OPENROUTER_API_KEY"]
+        app_test.run()
+        app_test.button(key="translate_mode_btn").click().run()
+        started = time.perf_counter()
+        for index in range(streamlit_runs):
+            app_test.text_area(key="translate_input").input(messages[index % len(messages)]).run()
+            app_test.button(key="process_btn").click().run()
+        streamlit_seconds = time.perf_counter() - started
+    
+    print(json.dumps({
+        "upstream_latency_s": args.upstream_latency,
+        "api": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "requests_per_s": round(args.requests / api_seconds, 1)
+        },
+        "streamlit": {
+            "requests": streamlit_runs,
+            "requests_per_s": round(streamlit_runs / streamlit_seconds, 1),
+            "ms_per_request": round(streamlit_seconds / streamlit_runs * 1000, 1)
+        }
+    }, indent=2))
+
+def synthetic_export(app, contacts: int, entries: int) -> Dict[str, Any]:
+    """An export_session_data()-shaped dict for a heavy user"""
+    corpus = app.CLASSIFIER_BENCHMARK_MESSAGES
+    data = {"contacts": {}, "journal_entries": {}, "feedback_data": {},
+            "user_stats": {"total_messages": contacts * entries}, "version": "1.0.0"}
+    for c in range(contacts):
+        history = []
+        for i in range(entries):
+            message = corpus[(c + i) % len(corpus)]
+            entry_type = "translate" if i % 2 else "coach"
+            history.append({
+                "id": f"{entry_type}_{1700000000 + c * entries + i}",
+                "time": "2025-01-01 12:00",
+                "type": entry_type,
+                "original": message,
+                "result": f"Here is a calmer way to say it: {message}",
+                "healing_score": i % 11,
+                "model": "Llama 3.2 3B",
+                "sentiment": ["positive", "neutral", "negative"][i % 3]
+            })
+        data["contacts"][f"Contact {c}"] = {"context": "general", "history": history}
+    return data
+
+def bench_history(args):
+    """JSON export vs the compact .tvh format: size, full load, one page, one contact"""
+    app = load_app()
+    data = synthetic_export(app, args.contacts, args.entries)
+    target = f"Contact {args.contacts // 2}"
+    
+    json_bytes = json.dumps(data, indent=2).encode("utf-8")
+    started = time.perf_counter()
+    tvh_bytes = app.encode_history_file(data)
+    encode_seconds = time.perf_counter() - started
+    
+    def timed(fn):
+        started = time.perf_counter()
+        result = fn()
+        return result, round((time.perf_counter() - started) * 1000, 2)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.tvh")
+        with open(path, "wb") as f:
+            f.write(tvh_bytes)
+        
+        decoded, json_load_ms = timed(lambda: json.loads(json_bytes))
+        roundtrip, tvh_load_ms = timed(lambda: app.decode_history_file(tvh_bytes))
+        with app.HistoryFileReader(path) as reader:
+            _, open_ms = timed(lambda: reader.count(target))
+            _, page_ms = timed(lambda: reader.page(target, args.entries - 20, 20))
+            _, contact_ms = timed(lambda: reader.load_contact(target))
+    
+    print(json.dumps({
+        "entries": args.contacts * args.entries,
+        "json": {"bytes": len(json_bytes), "load_ms": json_load_ms},
+        "tvh": {
+            "bytes": len(tvh_bytes),
+            "encode_ms": round(encode_seconds * 1000, 2),
+            "load_ms": tvh_load_ms,
+            "mmap_open_ms": open_ms,
+            "page_of_20_ms": page_ms,
+            "one_contact_ms": contact_ms
+        },
+        "round_trip_equal": roundtrip == decoded
+    }, indent=2))
+
+def bench_sentiment(args):
+    """Local tone scoring: one vectorized batch vs scoring entries one at a time"""
+    app = load_app()
+    history = synthetic_export(app, 1, args.entries)["contacts"]["Contact 0"]["history"]
+    for entry in history:
+        entry.pop("sentiment")
+    
+    one_by_one = [dict(entry) for entry in history[:args.entries // 10]]
+    started = time.perf_counter()
+    for entry in one_by_one:
+        app.score_entries([entry])
+    single_us = (time.perf_counter() - started) / len(one_by_one) * 1e6
+    
+    started = time.perf_counter()
+    app.score_entries(history)
+    batch_us = (time.perf_counter() - started) / len(history) * 1e6
+    
+    print(json.dumps({
+        "entries": len(history),
+        "single_us_per_entry": round(single_us, 1),
+        "batch_us_per_entry": round(batch_us, 1),
+        "labels": dict(collections.Counter(entry["sentiment"] for entry in history))
+    }, indent=2))
+
+def bench_table(args):
+    """Arrow history table vs list comprehensions for filtering and per-contact stats"""
+    app = load_app()
+    if app.pa is None:
+        sys.exit("pyarrow is not installed")
+    contacts = synthetic_export(app, args.contacts, args.entries)["contacts"]
+    feedback = {entry["id"]: "positive" for contact in contacts.values() for entry in contact["history"][::7]}
+    names = list(contacts)[:3]
+    
+    def timed_ms(fn, rounds=5):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            result = fn()
+        return result, round((time.perf_counter() - started) / rounds * 1000, 2)
+    
+    started = time.perf_counter()
+    history_table = app.HistoryTable()
+    history_table.sync(contacts)
+    build_ms = round((time.perf_counter() - started) * 1000, 2)
+    table, join_ms = timed_ms(lambda: app.with_feedback(history_table.table, feedback))
+    
+    filtered, filter_ms = timed_ms(lambda: app.filter_history_table(
+        table, contacts=names, types=["coach"], feedback=["positive"]
+    ))
+    _, summary_ms = timed_ms(lambda: app.summarize_history_table(table))
+    
+    def list_filter():
+        return [entry for name in names for entry in contacts[name]["history"]
+                if entry["type"] == "coach" and feedback.get(entry["id"]) == "positive"]
+    
+    def list_summary():
+        summary = collections.defaultdict(lambda: [0, 0.0])
+        for name, contact in contacts.items():
+            for entry in contact["history"]:
+                row = summary[(name, entry["type"])]
+                row[0] += 1
+                row[1] += entry["healing_score"]
+        return summary
+    
+    rows, list_filter_ms = timed_ms(list_filter)
+    _, list_summary_ms = timed_ms(list_summary)
+    
+    print(json.dumps({
+        "entries": len(table),
+        "matches": len(filtered),
+        "same_matches": len(rows) == len(filtered),
+        "arrow": {"build_ms": build_ms, "feedback_join_ms": join_ms,
+                  "filter_ms": filter_ms, "summary_ms": summary_ms},
+        "lists": {"filter_ms": list_filter_ms, "summary_ms": list_summary_ms}
+    }, indent=2))
+
+def main():
+    parser = argparse.ArgumentParser(description="The Third Voice benchmarks")
+    parser.add_argument("--record", metavar="CASSETTE", help="record upstream traffic to a cassette")
+    parser.add_argument("--replay", metavar="CASSETTE", help="serve upstream responses from a cassette")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiply replayed latency (0 = instant)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    classifier = commands.add_parser("classifier", help="time the message classifier")
+    classifier.add_argument("--corpus", help="JSONL corpus; defaults to built-in samples")
+    classifier.add_argument("--rounds", type=int, default=2000)
+    classifier.set_defaults(run=bench_classifier)
+    
+    router = commands.add_parser("router", help="auto routing vs fixed model order")
+    router.add_argument("--corpus", default="benchmark_corpus.jsonl")
+    router.set_defaults(run=bench_router)
+    
+    local = commands.add_parser("local", help="local CPU model vs remote models")
+    local.add_argument("--corpus", default="benchmark_corpus.jsonl")
+    local.set_defaults(run=bench_local)
+    
+    api = commands.add_parser("api", help="headless API throughput vs the Streamlit path")
+    api.add_argument("--corpus", default="benchmark_corpus.jsonl")
+    api.add_argument("--requests", type=int, default=200)
+    api.add_argument("--concurrency", type=int, default=16)
+    api.add_argument("--upstream-latency", type=float, default=0.2)
+    api.add_argument("--port", type=int, default=8765)
+    api.set_defaults(run=bench_api)
+    
+    history = commands.add_parser("history", help="JSON export vs the compact history format")
+    history.add_argument("--contacts", type=int, default=20)
+    history.add_argument("--entries", type=int, default=2000)
+    history.set_defaults(run=bench_history)
+    
+    sentiment = commands.add_parser("sentiment", help="local tone scoring, batched vs one at a time")
+    sentiment.add_argument("--entries", type=int, default=50000)
+    sentiment.set_defaults(run=bench_sentiment)
+    
+    table = commands.add_parser("table", help="Arrow history table vs list comprehensions")
+    table.add_argument("--contacts", type=int, default=20)
+    table.add_argument("--entries", type=int, default=5000)
+    table.set_defaults(run=bench_table)
+    
+    args = parser.parse_args()
+    
+    # The app reads these on first use, so they must be set before it is loaded
+    if args.record or args.replay:
+        os.environ["UPSTREAM_MODE"] = "record" if args.record else "replay"
+        os.environ["CASSETTE_FILE"] = args.record or args.replay
+        os.environ["REPLAY_LATENCY_SCALE"] = str(args.latency_scale)
+    
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Which messages app.py answers from templates instead of asking a model"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+import streamlit as st
+
+APP_PATH = Path(__file__).resolve().parent.parent / "app.py"
+
+
+@pytest.fixture(scope="module")
+def app():
+    # app.py reads its API key at import; no secrets file is needed to test pure helpers
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(st, "secrets", {"OPENROUTER_API_KEY": ""})
+        spec = importlib.util.spec_from_file_location("third_voice_mobile", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        yield module
+
+
+@pytest.mark.parametrize("message, kind", [
+    ("thanks!", "a thank-you"),
+    ("Thank you so much", "a thank-you"),
+    ("thanks for the update", "a thank-you"),
+    ("ok", "a simple acknowledgement"),
+    ("Sounds good.", "a simple acknowledgement"),
+    ("hey there", "a friendly greeting"),
+    ("Good night", "a friendly greeting"),
+    ("see you at 5", "a practical note about plans"),
+    ("See you at 5:30pm", "a practical note about plans"),
+    ("see you on Friday", "a practical note about plans"),
+    ("talk soon", "a practical note about plans"),
+    ("👍", "an emoji reaction"),
+    ("❤️❤️", "an emoji reaction"),
+    ("🙏🏽", "an emoji reaction"),
+    ("thanks 👍", "a thank-you"),
+    ("Thank you 🙏🏽", "a thank-you"),
+])
+def test_trivial_messages_get_a_quick_answer(app, message, kind):
+    assert app.quick_answer_kind(message) == kind
+
+
+@pytest.mark.parametrize("message", [
+    # Hostile tails on otherwise friendly openers
+    "see you in court",
+    "see you at the hearing",
+    "thanks loser",
+    "thank you bitch",
+    "thanks a lot",
+    "thanks for nothing",
+    "hey stupid",
+    "hey idiot",
+    "good night forever",
+    # Reactions that can carry anger, hurt or mockery
+    "😡",
+    "🖕",
+    "💔",
+    "...",
+    "👍😡",
+    # Friendly words don't make any emoji beside them safe
+    "ok 😡",
+    "thanks 🖕",
+    "perfect 🙄",
+    "see you tomorrow 💔",
+    "thanks 👍😡",
+    # Questions and anything longer go to a model
+    "ok?",
+    "ok but we need to talk about the weekend",
+])
+def test_risky_messages_go_to_a_model(app, message):
+    assert app.quick_answer_kind(message) is None